@@ -4,20 +4,150 @@ Module Anti-Spoofing - Phát hiện giả mạo khuôn mặt
 Anti-Spoofing Module for Face Liveness Detection
 """
 
+import os
+import threading
+import time
+from functools import cached_property
+
 import cv2
 import numpy as np
 from scipy import ndimage
 import config
-import os
+from liveness_state import LivenessStateStore
+
+# Thứ tự 8 điểm lân cận (dy, dx) từ bit 7 xuống bit 0, theo chiều kim đồng hồ từ góc trên trái
+LBP_NEIGHBOR_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1))
+
+
+def _build_uniform_lut():
+    """Bảng tra mã LBP -> bin uniform (<= 2 lần chuyển 0/1 theo vòng tròn)"""
+    lut = np.full(256, 58, dtype=np.uint8)
+    next_bin = 0
+    for code in range(256):
+        rotated = ((code << 1) | (code >> 7)) & 0xFF
+        if bin(code ^ rotated).count('1') <= 2:
+            lut[code] = next_bin
+            next_bin += 1
+    return lut
+
+
+UNIFORM_LBP_LUT = _build_uniform_lut()
+UNIFORM_LBP_BINS = 59
+
+_FFT_ROW_WEIGHTS = {}
+
+# Lưới 3x3 quanh mỗi landmark (pixel trên crop 160x160) làm điểm seed cho Lucas-Kanade
+_LANDMARK_SEED_OFFSETS = np.array([(dx, dy) for dy in (-6, 0, 6) for dx in (-6, 0, 6)], dtype=np.float32)
+
+# Chi phí ước lượng ban đầu (ms) cho cascade, được cập nhật sau mỗi lần đo
+DEFAULT_ANALYZER_COSTS = {'blink': 0.05, 'texture': 2.0, 'depth': 5.0, 'motion': 3.0}
+
+
+def _fft_row_weights(rows):
+    """
+    Trọng số theo hàng của nửa phổ rFFT (rfft theo trục 0) sao cho
+    weights @ tổng_theo_hàng bằng đúng tổng trên phổ fft2 + fftshift đầy đủ
+
+    Phổ ảnh thực đối xứng |F[k, l]| = |F[-k, -l]| nên tổng hàng k bằng tổng hàng H-k.
+
+    Returns:
+        high_weights: Trọng số vùng tần số cao (các hàng xa tâm sau fftshift)
+        total_weights: Trọng số toàn phổ
+    """
+    if rows not in _FFT_ROW_WEIGHTS:
+        center = rows // 2
+        shifted_rows = np.fft.fftshift(np.arange(rows))  # hàng gốc tại mỗi vị trí sau fftshift
+        selected = np.concatenate([shifted_rows[0:center // 2], shifted_rows[center + center // 2:]])
+
+        half = np.arange(rows)
+        half = np.minimum(half, rows - half)  # hàng k -> hàng tương ứng trong nửa phổ
+        high_weights = np.bincount(half[selected], minlength=rows // 2 + 1).astype(np.float64)
+        total_weights = np.bincount(half, minlength=rows // 2 + 1).astype(np.float64)
+        _FFT_ROW_WEIGHTS[rows] = (high_weights, total_weights)
+    return _FFT_ROW_WEIGHTS[rows]
+
+
+class FaceFeatureContext:
+    """
+    Đặc trưng dùng chung của 1 crop khuôn mặt, tính lười và cache lại
+    để các bộ phân tích liveness không tính lại grayscale/gradient/phổ
+    """
+
+    def __init__(self, face_image):
+        self.face_image = face_image
+
+    @cached_property
+    def gray(self):
+        return cv2.cvtColor(self.face_image, cv2.COLOR_RGB2GRAY)
+
+    @cached_property
+    def sobel_x(self):
+        return cv2.Sobel(self.gray, cv2.CV_64F, 1, 0, ksize=5)
+
+    @cached_property
+    def sobel_y(self):
+        return cv2.Sobel(self.gray, cv2.CV_64F, 0, 1, ksize=5)
+
+    @cached_property
+    def gradient_magnitude(self):
+        return np.sqrt(self.sobel_x**2 + self.sobel_y**2)
+
+    @cached_property
+    def fft_row_sums(self):
+        """Tổng biên độ phổ theo từng hàng của nửa phổ rFFT (rfft theo trục 0, fft theo trục 1)"""
+        return np.abs(np.fft.rfft2(self.gray, axes=(1, 0))).sum(axis=1)
+
+    @cached_property
+    def high_freq_ratio(self):
+        """Tỉ lệ năng lượng tần số cao, bằng với fft2 + fftshift nhưng chỉ tính nửa phổ"""
+        high_weights, total_weights = _fft_row_weights(self.gray.shape[0])
+        row_sums = self.fft_row_sums
+        return float(high_weights @ row_sums) / (float(total_weights @ row_sums) + 1e-6)
+
+    @cached_property
+    def lbp(self):
+        return AntiSpoofing.compute_lbp(self.gray)
+
+    @cached_property
+    def lbp_histogram(self):
+        """Histogram LBP theo config.LBP_RADII (dùng lại LBP bán kính 1 đã tính)"""
+        return AntiSpoofing.lbp_histogram(self.gray, precomputed={1: self.lbp})
+
+    @cached_property
+    def lbp_nonuniform_ratio(self):
+        """Tỉ lệ mẫu LBP không uniform (vi texture), trung bình theo các bán kính"""
+        if config.LBP_UNIFORM:
+            histograms = self.lbp_histogram.reshape(-1, UNIFORM_LBP_BINS)
+            return float(np.mean(histograms[:, UNIFORM_LBP_BINS - 1]))
+        histograms = self.lbp_histogram.reshape(-1, 256)
+        return float(np.mean(histograms[:, UNIFORM_LBP_LUT == UNIFORM_LBP_BINS - 1].sum(axis=1)))
+
+    @cached_property
+    def edges(self):
+        return cv2.Canny(self.gray, 50, 150)
+
+    @cached_property
+    def hsv_histogram(self):
+        hsv = cv2.cvtColor(self.face_image, cv2.COLOR_RGB2HSV)
+        return cv2.calcHist([hsv], [0, 1], None, [50, 60], [0, 180, 0, 256])
+
+    @cached_property
+    def otsu_binary(self):
+        _, binary = cv2.threshold(self.gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        return binary
+
 
 class AntiSpoofing:
     """Class phát hiện giả mạo khuôn mặt (printed photo, video replay, 3D mask)"""
     
     def __init__(self):
         """Khởi tạo Anti-Spoofing detector"""
+        # Chi phí (ms) của từng phương pháp, trung bình trượt theo thời gian đo thực tế
+        self.analyzer_costs = dict(DEFAULT_ANALYZER_COSTS)
+        self._costs_lock = threading.Lock()  # check_liveness chạy song song trên các worker liveness
         self.blink_counter = 0
-        self.blink_frames = []
-        self.prev_ear = 0
+        # Trạng thái nháy mắt riêng cho từng track (track_id=None: dùng chung như trước)
+        self.track_states = LivenessStateStore()
         
         # Load Haar Cascade cho phát hiện mắt
         self.eye_cascade = None
@@ -99,12 +229,13 @@ class AntiSpoofing:
         ear = (vertical1 + vertical2) / (2.0 * horizontal)
         return ear
     
-    def detect_blink(self, landmarks):
+    def detect_blink(self, landmarks, track_id=None):
         """
         Phát hiện nháy mắt dựa trên EAR
         
         Args:
             landmarks: Face landmarks từ MTCNN (5 điểm)
+            track_id: ID track khuôn mặt, mỗi track có buffer riêng
         
         Returns:
             is_blinking: True nếu đang nháy mắt
@@ -122,59 +253,58 @@ class AntiSpoofing:
         eye_distance = np.linalg.norm(left_eye - right_eye)
         
         # Giả định: nếu không có landmarks chi tiết, sử dụng phương pháp đơn giản
-        # Lưu vào buffer để phát hiện pattern
-        self.blink_frames.append(eye_distance)
-        
-        if len(self.blink_frames) > 10:
-            self.blink_frames.pop(0)
+        # Lưu vào buffer của track để phát hiện pattern
+        blink_frames = self.track_states.get(track_id).blink_frames
+        blink_frames.append(eye_distance)
         
         # Phát hiện biến động đột ngột (có thể là nháy mắt)
-        if len(self.blink_frames) >= 5:
-            variance = np.var(self.blink_frames)
+        if len(blink_frames) >= 5:
+            variance = np.var(blink_frames.values())
             if variance > 10:  # Threshold
                 return True, True
         
         return False, False
     
-    def texture_analysis(self, face_image):
+    def observe(self, face_image, landmarks=None, track_id=None):
+        """
+        Cập nhật trạng thái của track ở frame không cần kiểm tra liveness
+        (buffer nháy mắt + crop cho motion), chi phí O(1) cho mỗi khuôn mặt
+        """
+        if config.USE_BLINK_DETECTION and landmarks is not None:
+            self.detect_blink(landmarks, track_id)
+        if config.USE_MOTION_ANALYSIS and track_id is not None:
+            state = self.track_states.get(track_id)
+            state.swap_motion_history(FaceFeatureContext(face_image).gray, time.monotonic(),
+                                      config.MOTION_HISTORY_MAX_AGE)
+    
+    def texture_analysis(self, face_image, context=None):
         """
         Phân tích texture để phát hiện ảnh in
         Ảnh in thường có texture đồng nhất hơn khuôn mặt thật
         
         Args:
             face_image: numpy array (RGB)
+            context: FaceFeatureContext dùng chung (tạo mới nếu None)
         
         Returns:
             score: Điểm liveness (0-1), càng cao càng giống người thật
         """
-        # Convert sang grayscale
-        gray = cv2.cvtColor(face_image, cv2.COLOR_RGB2GRAY)
+        context = context or FaceFeatureContext(face_image)
+        gray = context.gray
         
         # 1. Phân tích Local Binary Pattern (LBP)
-        lbp = self._compute_lbp(gray)
-        lbp_variance = np.var(lbp)
+        lbp_variance = np.var(context.lbp)
         
         # 2. Phân tích frequency domain (FFT)
-        fft = np.fft.fft2(gray)
-        fft_shift = np.fft.fftshift(fft)
-        magnitude = np.abs(fft_shift)
-        
         # Khuôn mặt thật có nhiều high-frequency components hơn
-        h, w = magnitude.shape
-        center_h, center_w = h // 2, w // 2
-        high_freq = magnitude[0:center_h//2, :].sum() + magnitude[center_h+center_h//2:, :].sum()
-        total_freq = magnitude.sum()
-        high_freq_ratio = high_freq / (total_freq + 1e-6)
+        high_freq_ratio = context.high_freq_ratio
         
         # 3. Phân tích edge density
-        edges = cv2.Canny(gray, 50, 150)
-        edge_density = np.sum(edges > 0) / (gray.shape[0] * gray.shape[1])
+        edge_density = np.count_nonzero(context.edges) / (gray.shape[0] * gray.shape[1])
         
         # 4. Phân tích color distribution
         # Khuôn mặt thật có phân bố màu phức tạp hơn
-        hsv = cv2.cvtColor(face_image, cv2.COLOR_RGB2HSV)
-        hist = cv2.calcHist([hsv], [0, 1], None, [50, 60], [0, 180, 0, 256])
-        hist_variance = np.var(hist)
+        hist_variance = np.var(context.hsv_histogram)
         
         # Tổng hợp các chỉ số
         # Normalize và weighted sum
@@ -188,7 +318,71 @@ class AntiSpoofing:
         return total_score
     
     def _compute_lbp(self, image):
-        """Tính Local Binary Pattern"""
+        """Tính Local Binary Pattern (bán kính 1)"""
+        return self.compute_lbp(image, radius=1)
+    
+    @staticmethod
+    def compute_lbp(image, radius=1):
+        """
+        Tính LBP 8 điểm lân cận bằng phép so sánh mảng dịch chuyển (không vòng lặp pixel)
+        Với radius=1 cho kết quả giống hệt _compute_lbp_reference
+        
+        Args:
+            image: Ảnh grayscale (H, W) hoặc batch (N, H, W)
+            radius: Khoảng cách tới các điểm lân cận
+        
+        Returns:
+            lbp: numpy array uint8 (..., H - 2*radius, W - 2*radius)
+        """
+        image = np.asarray(image)
+        rows, cols = image.shape[-2:]
+        r = radius
+        center = image[..., r:rows-r, r:cols-r]
+        
+        lbp = np.zeros(center.shape, dtype=np.uint8)
+        mask = np.empty(center.shape, dtype=bool)
+        shifted = np.empty(center.shape, dtype=np.uint8)
+        for bit, (dy, dx) in zip(range(7, -1, -1), LBP_NEIGHBOR_OFFSETS):
+            neighbor = image[..., r + dy*r:rows - r + dy*r, r + dx*r:cols - r + dx*r]
+            np.greater(neighbor, center, out=mask)
+            np.left_shift(mask.view(np.uint8), bit, out=shifted)
+            np.bitwise_or(lbp, shifted, out=lbp)
+        
+        return lbp
+    
+    @staticmethod
+    def lbp_histogram(gray, radii=None, uniform=None, precomputed=None):
+        """
+        Histogram LBP nhiều bán kính làm đặc trưng texture
+        
+        Args:
+            gray: Ảnh grayscale
+            radii: List bán kính (mặc định config.LBP_RADII)
+            uniform: Gộp về 59 bin uniform-LBP (58 mẫu uniform + 1 bin còn lại)
+            precomputed: {radius: mã LBP} đã tính sẵn
+        
+        Returns:
+            features: numpy array float32, histogram chuẩn hóa của từng bán kính nối tiếp nhau
+        """
+        radii = config.LBP_RADII if radii is None else radii
+        uniform = config.LBP_UNIFORM if uniform is None else uniform
+        bins = UNIFORM_LBP_BINS if uniform else 256
+        precomputed = precomputed or {}
+        
+        histograms = []
+        for radius in radii:
+            codes = precomputed.get(radius)
+            if codes is None:
+                codes = AntiSpoofing.compute_lbp(gray, radius)
+            if uniform:
+                codes = UNIFORM_LBP_LUT[codes]
+            hist = np.bincount(codes.ravel(), minlength=bins).astype(np.float32)
+            histograms.append(hist / max(codes.size, 1))
+        
+        return np.concatenate(histograms)
+    
+    def _compute_lbp_reference(self, image):
+        """LBP bằng vòng lặp từng pixel (bản gốc, dùng để kiểm tra và benchmark)"""
         rows, cols = image.shape
         lbp = np.zeros((rows-2, cols-2), dtype=np.uint8)
         
@@ -211,7 +405,7 @@ class AntiSpoofing:
         
         return lbp
     
-    def motion_analysis(self, current_frame, prev_frame):
+    def motion_analysis(self, current_frame, prev_frame, context=None):
         """
         Phân tích chuyển động để phát hiện video replay
         Video replay thường có chuyển động không tự nhiên
@@ -219,6 +413,7 @@ class AntiSpoofing:
         Args:
             current_frame: Frame hiện tại (RGB)
             prev_frame: Frame trước đó (RGB)
+            context: FaceFeatureContext của current_frame (tạo mới nếu None)
         
         Returns:
             score: Điểm liveness (0-1)
@@ -232,7 +427,7 @@ class AntiSpoofing:
         
         # Convert sang grayscale
         gray1 = cv2.cvtColor(prev_frame, cv2.COLOR_RGB2GRAY)
-        gray2 = cv2.cvtColor(current_frame, cv2.COLOR_RGB2GRAY)
+        gray2 = (context or FaceFeatureContext(current_frame)).gray
         
         # Resize to same size if needed
         if gray1.shape != gray2.shape:
@@ -245,8 +440,88 @@ class AntiSpoofing:
             iterations=3, poly_n=5, poly_sigma=1.2, flags=0
         )
         
+        return self._flow_score(flow[..., 0], flow[..., 1])
+    
+    @staticmethod
+    def landmark_seed_points(shape):
+        """
+        Điểm seed Lucas-Kanade trên crop đã căn chỉnh: lưới 3x3 quanh 5 landmark
+        (crop căn chỉnh luôn đặt landmarks tại FACE_TEMPLATE_LANDMARKS)
+        
+        Returns:
+            points: float32 (45, 1, 2), None nếu crop không căn chỉnh
+        """
+        if not config.FACE_ALIGNMENT:
+            return None
+        rows, cols = shape[:2]
+        landmarks = np.array(config.FACE_TEMPLATE_LANDMARKS, dtype=np.float32) * np.float32([cols / 112.0, rows / 112.0])
+        offsets = _LANDMARK_SEED_OFFSETS * np.float32([cols / 160.0, rows / 160.0])
+        points = (landmarks[:, None, :] + offsets[None, :, :]).reshape(-1, 2)
+        points = np.clip(points, 0, [cols - 1, rows - 1]).astype(np.float32)
+        return points.reshape(-1, 1, 2)
+    
+    def roi_motion_analysis(self, prev_gray, gray, mode=None, points=None):
+        """
+        Optical flow giữa 2 crop khuôn mặt (đã căn chỉnh) liên tiếp của cùng 1 track
+        
+        Args:
+            prev_gray: Crop grayscale lần trước
+            gray: Crop grayscale hiện tại (cùng kích thước)
+            mode: "dense" (Farneback trên crop thu nhỏ) hoặc "sparse" (Lucas-Kanade trên
+                  các điểm landmark), mặc định config.MOTION_ANALYSIS_MODE
+            points: Điểm seed (K, 1, 2) cho chế độ sparse, mặc định landmark_seed_points
+        
+        Returns:
+            score: Điểm liveness (0-1)
+        """
+        mode = mode or config.MOTION_ANALYSIS_MODE
+        
+        if mode == 'sparse':
+            # Crop đã căn chỉnh: vi chuyển động quanh mắt/mũi/miệng so với template;
+            # crop không căn chỉnh thì không biết vị trí landmarks, dùng các góc của crop
+            if points is None:
+                points = self.landmark_seed_points(prev_gray.shape)
+            if points is None:
+                points = cv2.goodFeaturesToTrack(prev_gray, maxCorners=config.MOTION_SPARSE_POINTS,
+                                                 qualityLevel=0.01, minDistance=5)
+            if points is None or len(points) < 4:
+                # Crop quá phẳng: dùng lưới điểm cố định
+                h, w = prev_gray.shape
+                ys, xs = np.mgrid[h // 8:h:h // 4, w // 8:w:w // 4]
+                points = np.stack([xs.ravel(), ys.ravel()], axis=1).astype(np.float32).reshape(-1, 1, 2)
+            
+            next_points, status, _ = cv2.calcOpticalFlowPyrLK(
+                prev_gray, gray, points, None, winSize=(15, 15), maxLevel=2
+            )
+            tracked = status.ravel() == 1
+            if not np.any(tracked):
+                return 0.5
+            displacement = (next_points - points).reshape(-1, 2)[tracked]
+            return self._flow_score(displacement[:, 0], displacement[:, 1])
+        
+        # Farneback trên ROI thu nhỏ, flow được nhân lại theo tỉ lệ về đơn vị pixel của crop
+        roi_size = config.MOTION_ROI_SIZE
+        scale = 1.0
+        if roi_size and roi_size < max(gray.shape):
+            scale = max(gray.shape) / roi_size
+            roi_shape = (round(gray.shape[1] / scale), round(gray.shape[0] / scale))
+            prev_gray = cv2.resize(prev_gray, roi_shape, interpolation=cv2.INTER_AREA)
+            gray = cv2.resize(gray, roi_shape, interpolation=cv2.INTER_AREA)
+        
+        flow = cv2.calcOpticalFlowFarneback(
+            prev_gray, gray, None,
+            pyr_scale=0.5, levels=3, winsize=15,
+            iterations=3, poly_n=5, poly_sigma=1.2, flags=0
+        )
+        if scale != 1.0:
+            flow *= scale
+        return self._flow_score(flow[..., 0], flow[..., 1])
+    
+    def _flow_score(self, flow_x, flow_y):
+        """Chấm điểm trường chuyển động (dense hoặc các điểm sparse)"""
         # Tính magnitude và angle
-        magnitude, angle = cv2.cartToPolar(flow[..., 0], flow[..., 1])
+        magnitude, angle = cv2.cartToPolar(np.ascontiguousarray(flow_x, dtype=np.float32),
+                                           np.ascontiguousarray(flow_y, dtype=np.float32))
         
         # Video replay thường có pattern chuyển động đồng nhất
         # Người thật có vi chuyển động (micro-movements) tự nhiên hơn
@@ -271,32 +546,30 @@ class AntiSpoofing:
         
         return total_score
     
-    def depth_analysis(self, face_image):
+    def depth_analysis(self, face_image, context=None):
         """
         Phân tích độ sâu để phát hiện mặt nạ 3D hoặc ảnh phẳng
         
         Args:
             face_image: numpy array (RGB)
+            context: FaceFeatureContext dùng chung (tạo mới nếu None)
         
         Returns:
             score: Điểm liveness (0-1)
         """
-        # Convert sang grayscale
-        gray = cv2.cvtColor(face_image, cv2.COLOR_RGB2GRAY)
+        context = context or FaceFeatureContext(face_image)
         
         # 1. Phân tích gradient để ước lượng độ sâu
-        sobelx = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=5)
-        sobely = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=5)
-        
-        gradient_magnitude = np.sqrt(sobelx**2 + sobely**2)
+        gradient_magnitude = context.gradient_magnitude
         
         # 2. Phân tích shadow và highlight
         # Khuôn mặt 3D thật có shadow/highlight tự nhiên
-        _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        binary = context.otsu_binary
         
         # Tính ratio của dark và bright regions
-        dark_ratio = np.sum(binary == 0) / binary.size
-        bright_ratio = np.sum(binary == 255) / binary.size
+        bright_pixels = np.count_nonzero(binary)
+        dark_ratio = (binary.size - bright_pixels) / binary.size
+        bright_ratio = bright_pixels / binary.size
         
         # 3. Phân tích contour complexity
         contours, _ = cv2.findContours(binary, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
@@ -311,51 +584,102 @@ class AntiSpoofing:
         
         return total_score
     
-    def check_liveness(self, face_image, landmarks=None, prev_frame=None):
+    def check_liveness(self, face_image, landmarks=None, prev_frame=None, return_report=False,
+                       cascade=None, track_id=None):
         """
         Kiểm tra tổng hợp liveness
         
         Args:
             face_image: numpy array (RGB)
             landmarks: Face landmarks từ MTCNN
-            prev_frame: Frame trước đó để phân tích motion
+            prev_frame: Frame trước đó để phân tích motion (chỉ dùng khi không có track_id)
+            return_report: Trả thêm report thời gian xử lý từng phương pháp
+            cascade: Chạy theo thứ tự chi phí, dừng sớm khi kết quả đã chắc chắn
+                     (mặc định config.LIVENESS_CASCADE)
+            track_id: ID track khuôn mặt cho các phương pháp có trạng thái
+                      (blink, motion trên crop lần trước của track)
         
         Returns:
             is_real: True nếu là người thật
-            score: Điểm liveness (0-1)
+            score: Điểm liveness (0-1), trung bình các phương pháp; khi dừng sớm là
+                   điểm giữa khoảng chứa trung bình đầy đủ
             details: Dictionary chứa chi tiết các phương pháp
+            report: (chỉ khi return_report=True) {'timings': {method: ms},
+                    'skipped': [method], 'total_ms': ms}
         """
-        scores = {}
+        start = time.perf_counter()
+        cascade = config.LIVENESS_CASCADE if cascade is None else cascade
+        context = FaceFeatureContext(face_image)
         
+        analyzers = []
         # 1. Texture analysis
         if config.USE_TEXTURE_ANALYSIS:
-            texture_score = self.texture_analysis(face_image)
-            scores['texture'] = texture_score
+            analyzers.append(('texture', lambda: self.texture_analysis(face_image, context)))
         
         # 2. Blink detection
         if config.USE_BLINK_DETECTION and landmarks is not None:
-            is_blinking, blink_detected = self.detect_blink(landmarks)
-            scores['blink'] = 1.0 if blink_detected else 0.3
+            analyzers.append(('blink', lambda: 1.0 if self.detect_blink(landmarks, track_id)[1] else 0.3))
         
         # 3. Motion analysis
-        if config.USE_MOTION_ANALYSIS and prev_frame is not None:
-            motion_score = self.motion_analysis(face_image, prev_frame)
-            scores['motion'] = motion_score
+        if config.USE_MOTION_ANALYSIS and track_id is not None:
+            # Optical flow trên crop khuôn mặt của chính track này (luôn lưu crop mới)
+            prev_gray = self.track_states.get(track_id).swap_motion_history(
+                context.gray, time.monotonic(), config.MOTION_HISTORY_MAX_AGE
+            )
+            if prev_gray is not None:
+                analyzers.append(('motion', lambda: self.roi_motion_analysis(prev_gray, context.gray)))
+        elif config.USE_MOTION_ANALYSIS and prev_frame is not None:
+            analyzers.append(('motion', lambda: self.motion_analysis(face_image, prev_frame, context)))
         
         # 4. Depth analysis
         if config.USE_DEPTH_ANALYSIS:
-            depth_score = self.depth_analysis(face_image)
-            scores['depth'] = depth_score
+            analyzers.append(('depth', lambda: self.depth_analysis(face_image, context)))
+        
+        if cascade:
+            # Rẻ trước, đắt sau; blink có trạng thái (buffer) nên luôn chạy
+            with self._costs_lock:
+                costs = dict(self.analyzer_costs)
+            analyzers.sort(key=lambda item: (item[0] != 'blink', costs.get(item[0], 0.0)))
+        
+        scores = {}
+        timings = {}
+        skipped = []
+        num_analyzers = len(analyzers)
+        threshold = config.LIVENESS_THRESHOLD
+        total_score = None
+        for i, (method, analyze) in enumerate(analyzers):
+            t0 = time.perf_counter()
+            scores[method] = analyze()
+            elapsed = (time.perf_counter() - t0) * 1000
+            timings[method] = elapsed
+            with self._costs_lock:
+                cost = self.analyzer_costs.get(method, elapsed)
+                self.analyzer_costs[method] = cost + config.LIVENESS_COST_ALPHA * (elapsed - cost)
+            
+            if cascade and i + 1 < num_analyzers:
+                # Mỗi điểm nằm trong [0, 1] nên trung bình cuối cùng nằm trong
+                # [S / n, (S + số phương pháp còn lại) / n]
+                done = sum(scores.values())
+                remaining = num_analyzers - (i + 1)
+                lower = done / num_analyzers
+                upper = (done + remaining) / num_analyzers
+                if lower >= threshold or upper < threshold:
+                    skipped = [name for name, _ in analyzers[i + 1:]]
+                    # Điểm giữa của cận (= trung bình đủ n phương pháp, coi phương pháp bị
+                    # bỏ qua là 0.5): cùng thang với điểm đầy đủ và cùng phía ngưỡng
+                    total_score = (lower + upper) / 2
+                    break
         
         # Tính tổng điểm (weighted average)
-        if len(scores) > 0:
-            total_score = np.mean(list(scores.values()))
-        else:
-            total_score = 0.5
+        if total_score is None:
+            total_score = np.mean(list(scores.values())) if len(scores) > 0 else 0.5
         
-        # Quyết định
-        is_real = total_score >= config.LIVENESS_THRESHOLD
+        is_real = total_score >= threshold
         
+        if return_report:
+            report = {'timings': timings, 'skipped': skipped,
+                      'total_ms': (time.perf_counter() - start) * 1000}
+            return is_real, total_score, scores, report
         return is_real, total_score, scores
 
 
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Module ghi nhận chấm công (kiểm tra thời gian giữa 2 lần, đi muộn)
+Attendance Logging Module shared by the GUI and the headless pipeline
+
+Thời điểm chấm công gần nhất của từng nhân viên được giữ trong bộ nhớ (nạp từ
+database lúc khởi động, cập nhật sau mỗi lần ghi), nên việc kiểm tra
+MIN_TIME_BETWEEN_CHECKINS khi chạy trực tiếp không cần truy vấn database.
+Khoảng chờ tính theo thời gian tuyệt đối, không reset lúc nửa đêm.
+
+Kiểm tra khoảng chờ và giữ chỗ trong cache diễn ra trong cùng 1 lần giữ lock,
+trước khi ghi, nên nhiều thread (nhiều camera, worker liveness) cùng thấy 1
+người chỉ ghi được 1 lượt; ghi lỗi thì trả lại chỗ đã giữ.
+"""
+
+import threading
+from datetime import datetime, timedelta
+
+import config
+
+
+class AttendanceLogger:
+    """Quyết định và ghi 1 lượt chấm công vào database"""
+
+    def __init__(self, db, writer=None, now=None):
+        """
+        Args:
+            db: DatabaseManager (đọc lượt chấm công gần nhất)
+            writer: Nơi ghi lượt chấm công (WriteBehindWriter), mặc định là db
+            now: Thời điểm nạp cache
+        """
+        self.db = db
+        self.writer = writer or db
+        self.work_start = datetime.strptime(config.WORK_START_TIME, "%H:%M").time()
+        self.cooldown = timedelta(seconds=config.MIN_TIME_BETWEEN_CHECKINS)
+
+        # employee_id -> thời điểm chấm công muộn nhất đã biết
+        self._last_checkins = {}
+        self._covered_from = None  # Cache đầy đủ cho mọi lượt chấm công từ thời điểm này
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.warm_cache(now)
+
+    def warm_cache(self, now=None):
+        """Nạp các lượt chấm công còn trong khoảng chờ từ database"""
+        since = (now or datetime.now()) - self.cooldown
+        recent = self.db.get_recent_checkins(since)
+        with self._lock:
+            self._last_checkins = recent
+            self._covered_from = since
+
+    def _last_checkin_near(self, employee_id, current_time):
+        """
+        Lượt chấm công cách current_time dưới MIN_TIME_BETWEEN_CHECKINS (nếu có), gọi khi giữ _lock
+
+        Cache trả lời được khi cả khoảng chờ trước current_time nằm trong vùng đã
+        nạp và không có lượt nào sau current_time; ngược lại (xử lý lại video cũ)
+        thì truy vấn database.
+        """
+        last_time = self._last_checkins.get(employee_id)
+        if current_time - self.cooldown >= self._covered_from and (
+                last_time is None or last_time <= current_time):
+            self.cache_hits += 1
+            return last_time
+        self.cache_misses += 1
+
+        last_checkin = self.db.get_last_checkin_between(
+            employee_id, current_time - self.cooldown, current_time + self.cooldown
+        )
+        if last_checkin:
+            return datetime.strptime(last_checkin['ts'], config.TIMESTAMP_FORMAT)
+        if last_time is not None and abs(current_time - last_time) < self.cooldown:
+            return last_time  # Lượt đã giữ chỗ nhưng chưa ghi xuống database
+        return None
+
+    def _reserve(self, employee_id, current_time):
+        """
+        Kiểm tra khoảng chờ và giữ chỗ current_time trong cache (nguyên tử)
+
+        Returns:
+            (reserved, previous): previous là giá trị cache trước khi giữ chỗ (để trả lại)
+        """
+        with self._lock:
+            last_time = self._last_checkin_near(employee_id, current_time)
+            # Xử lý lại video cũ có thể gặp lượt chấm công sau thời điểm frame
+            if last_time and abs((current_time - last_time).total_seconds()) < config.MIN_TIME_BETWEEN_CHECKINS:
+                return False, None  # Too soon
+
+            previous = self._last_checkins.get(employee_id)
+            if previous is None or current_time > previous:
+                self._last_checkins[employee_id] = current_time
+            return True, previous
+
+    def _release(self, employee_id, current_time, previous):
+        """Trả lại chỗ đã giữ khi ghi lỗi"""
+        with self._lock:
+            if self._last_checkins.get(employee_id) != current_time:
+                return  # Chưa giữ chỗ trong cache, hoặc đã có lượt muộn hơn
+            if previous is None:
+                del self._last_checkins[employee_id]
+            else:
+                self._last_checkins[employee_id] = previous
+
+    def log(self, employee_id, name, confidence, distance, timestamp=None):
+        """
+        Ghi nhận chấm công nếu đã qua MIN_TIME_BETWEEN_CHECKINS
+
+        Args:
+            employee_id: ID nhân viên
+            name: Tên nhân viên
+            confidence: Độ tin cậy của MTCNN
+            distance: Khoảng cách embedding
+            timestamp: Thời điểm gốc của frame (xử lý lại video), mặc định là bây giờ
+
+        Returns:
+            record: Dictionary thông tin lượt chấm công, hoặc None nếu quá sớm
+        """
+        current_time = timestamp or datetime.now()
+
+        # Check time between check-ins
+        reserved, previous = self._reserve(employee_id, current_time)
+        if not reserved:
+            return None  # Too soon
+
+        # Determine if late
+        is_late = current_time.time() > self.work_start
+
+        # Log to database
+        try:
+            self.writer.log_attendance(
+                employee_id, "Check-in", "Success",
+                confidence, int(is_late),
+                f"Distance: {distance:.3f}",
+                timestamp=current_time
+            )
+        except Exception:
+            self._release(employee_id, current_time, previous)
+            raise
+
+        return {
+            'employee_id': employee_id,
+            'name': name,
+            'datetime': current_time,
+            'confidence': confidence,
+            'distance': distance,
+            'is_late': is_late
+        }
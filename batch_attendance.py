@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+Chấm công offline từ video/thư mục ảnh (xử lý lại sau sự cố mất kết nối)
+Offline Batch Attendance Module
+
+Frame được giải mã trên 1 thread nền, detect + embedding chạy theo batch,
+lượt chấm công được ghi với thời điểm gốc của frame (không phải giờ xử lý).
+Liveness giống stage liveness của pipeline: mọi frame của track đều đi qua
+lịch đánh giá liveness, mặt cần nhận diện mới được kết luận thật/giả (khi
+track đã đủ số lần đánh giá).
+
+Usage:
+    python batch_attendance.py gate1_2024-05-06.mp4 --start "06/05/2024 07:00:00"
+    python batch_attendance.py data/snapshots/ --batch-size 16
+"""
+
+import argparse
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import cv2
+
+import config
+from face_tracker import FaceTracker
+from liveness_state import TemporalLivenessAggregator
+from pipeline import BoundedQueue, QueueClosed
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+class FrameReader(threading.Thread):
+    """
+    Thread nền giải mã video/thư mục ảnh, đẩy (frame_index, timestamp, frame)
+    vào hàng đợi; hàng đợi đầy thì chờ (không bỏ frame khi xử lý offline)
+    """
+
+    def __init__(self, path, out_queue, every_n_frames=1, start_time=None):
+        super().__init__(name="batch-frame-reader", daemon=True)
+        self.path = path
+        self.out_queue = out_queue
+        self.every_n_frames = max(1, every_n_frames)
+        self.start_time = start_time
+        self.total_frames = 0
+        self.error = None
+
+        if os.path.isdir(path):
+            self.images = sorted(
+                os.path.join(path, f) for f in os.listdir(path)
+                if f.lower().endswith(IMAGE_EXTENSIONS)
+            )
+            self.total_frames = len(self.images)
+            self.capture = None
+        else:
+            self.images = None
+            self.capture = cv2.VideoCapture(path)
+            if not self.capture.isOpened():
+                raise IOError(f"Không thể mở video: {path}")
+            self.total_frames = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+            if self.start_time is None:
+                # Mặc định: file được ghi xong lúc mtime -> bắt đầu = mtime - thời lượng
+                fps = self.capture.get(cv2.CAP_PROP_FPS) or config.CAMERA_FPS
+                duration = self.total_frames / fps if fps > 0 else 0
+                self.start_time = datetime.fromtimestamp(os.path.getmtime(path)) - timedelta(seconds=duration)
+
+    def run(self):
+        try:
+            if self.images is not None:
+                self._read_images()
+            else:
+                self._read_video()
+        except QueueClosed:
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            if self.capture is not None:
+                self.capture.release()
+            self.out_queue.close()
+
+    def _read_video(self):
+        frame_index = 0
+        while True:
+            # Frame bị bỏ qua chỉ grab (không giải mã ra ảnh)
+            if frame_index % self.every_n_frames != 0:
+                if not self.capture.grab():
+                    break
+                frame_index += 1
+                continue
+
+            ret, frame = self.capture.read()
+            if not ret:
+                break
+            offset = self.capture.get(cv2.CAP_PROP_POS_MSEC)
+            timestamp = self.start_time + timedelta(milliseconds=offset)
+            self.out_queue.put((frame_index, timestamp, self._resize(frame)))
+            frame_index += 1
+
+    def _read_images(self):
+        for frame_index, image_path in enumerate(self.images):
+            frame = cv2.imread(image_path)
+            if frame is None:
+                print(f"⚠️ Bỏ qua ảnh lỗi: {image_path}")
+                continue
+            # Ảnh chụp: dùng thời điểm chỉnh sửa file làm thời điểm gốc
+            timestamp = datetime.fromtimestamp(os.path.getmtime(image_path))
+            self.out_queue.put((frame_index, timestamp, self._resize(frame)))
+
+    @staticmethod
+    def _resize(frame):
+        # Cùng kích thước với camera live để MTCNN gom batch được
+        return cv2.resize(frame, (config.CAMERA_WIDTH, config.CAMERA_HEIGHT))
+
+
+class BatchAttendanceProcessor:
+    """Detect + nhận diện theo batch và ghi chấm công với thời điểm gốc"""
+
+    def __init__(self, face_recognizer, attendance_logger, anti_spoofing=None, batch_size=8):
+        self.face_recognizer = face_recognizer
+        self.attendance_logger = attendance_logger
+        self.anti_spoofing = anti_spoofing
+        self.batch_size = batch_size
+        # Track giữ danh tính giữa các frame, tránh nhận diện lại cùng 1 người
+        self.tracker = FaceTracker()
+        # Gộp liveness theo thời gian cho từng track (như pipeline)
+        self.liveness_aggregator = None
+        if anti_spoofing is not None and config.LIVENESS_TEMPORAL:
+            self.liveness_aggregator = TemporalLivenessAggregator(anti_spoofing)
+
+        self.frames = 0
+        self.faces = 0
+        self.records = []
+
+    def process(self, items):
+        """
+        Xử lý 1 batch frame
+
+        Args:
+            items: List (frame_index, timestamp, frame) theo thứ tự thời gian
+        """
+        frames = [frame for _, _, frame in items]
+        if config.FACE_ALIGNMENT:
+            detections = self.face_recognizer.detect_faces_aligned_batch(frames)
+        else:
+            detections = []
+            for frame in frames:
+                faces, boxes, probs, landmarks = self.face_recognizer.detect_faces(frame)
+                detections.append((faces, None, boxes, probs, landmarks))
+
+        # Tracker chạy tuần tự theo thời gian, gom mặt cần nhận diện của cả batch
+        entries = []
+        batch_input = []
+        for (frame_index, timestamp, frame), (faces, face_tensor, boxes, probs, landmarks) in zip(items, detections):
+            tracks = self.tracker.update(boxes, landmarks)
+            for i, track in enumerate(tracks):
+                self.faces += 1
+                if not self.tracker.needs_identification(track):
+                    # Mặt đã nhận diện: chỉ cập nhật lịch sử blink/motion của track
+                    self._observe(faces[i], landmarks[i], track.track_id)
+                    continue
+
+                is_real, liveness_score, confidence = self._check_liveness(faces[i], landmarks[i], track.track_id)
+                if is_real is None:
+                    # Track chưa đủ số lần đánh giá liveness: thử lại ở frame sau
+                    self.tracker.mark_inconclusive(track)
+                    continue
+                if not is_real:
+                    self.tracker.mark_identified(track, None, "Unknown", 1.0, False, liveness_score, confidence)
+                    continue
+
+                self.tracker.mark_pending(track)
+                entries.append((track, timestamp, probs[i], liveness_score, confidence))
+                batch_input.append(face_tensor[i] if face_tensor is not None else faces[i])
+
+            self.frames += 1
+
+        results = self.face_recognizer.recognize_faces_batch(batch_input) if batch_input else []
+        for entry, (employee_id, name, distance) in zip(entries, results):
+            track, timestamp, prob, liveness_score, confidence = entry
+            self.tracker.mark_identified(track, employee_id, name, distance, True, liveness_score, confidence)
+            if employee_id is None:
+                continue
+            record = self.attendance_logger.log(employee_id, name, prob, distance, timestamp=timestamp)
+            if record:
+                self.records.append(record)
+                late = " ⚠️ ĐI MUỘN" if record['is_late'] else ""
+                print(f"✅ [{timestamp.strftime(config.DATETIME_FORMAT)}] {name} ({employee_id}){late}")
+
+    def _check_liveness(self, face, landmarks, track_id):
+        """Kết luận thật/giả cho mặt cần nhận diện: (is_real, score, confidence)"""
+        if self.anti_spoofing is None:
+            return True, None, None
+        if self.liveness_aggregator is not None:
+            is_real, score, confidence, _ = self.liveness_aggregator.update(face, landmarks, track_id)
+            return is_real, score, confidence
+        is_real, score, _ = self.anti_spoofing.check_liveness(face, landmarks, track_id=track_id)
+        return is_real, score, None
+
+    def _observe(self, face, landmarks, track_id):
+        if self.liveness_aggregator is not None:
+            self.liveness_aggregator.observe(face, landmarks, track_id)
+        elif self.anti_spoofing is not None:
+            self.anti_spoofing.observe(face, landmarks, track_id)
+
+
+def main():
+    """Chạy chấm công offline"""
+    from database import DatabaseManager
+    from face_recognition import FaceRecognizer
+    from attendance import AttendanceLogger
+
+    parser = argparse.ArgumentParser(description="Offline batch attendance from video files or image folders")
+    parser.add_argument('input', help="File video hoặc thư mục ảnh")
+    parser.add_argument('--start', default=None,
+                        help=f"Thời điểm bắt đầu video ({config.DATETIME_FORMAT}), mặc định = mtime - thời lượng")
+    parser.add_argument('--every', type=int, default=config.PROCESS_EVERY_N_FRAMES,
+                        help="Chỉ xử lý mỗi N frame của video")
+    parser.add_argument('--batch-size', type=int, default=config.PIPELINE_MAX_BATCH)
+    parser.add_argument('--liveness', action='store_true', help="Bật anti-spoofing")
+    parser.add_argument('--progress-every', type=float, default=5.0, help="In tiến độ mỗi N giây")
+    args = parser.parse_args()
+
+    start_time = datetime.strptime(args.start, config.DATETIME_FORMAT) if args.start else None
+
+    print("=" * 60)
+    print("🚀 AI ATTENDANCE SYSTEM - OFFLINE BATCH")
+    print("=" * 60)
+
+    db = DatabaseManager()
+    face_recognizer = FaceRecognizer()
+    embeddings = db.load_face_embeddings()
+    if embeddings:
+        face_recognizer.load_embeddings(embeddings)
+
+    anti_spoofing = None
+    if args.liveness:
+        from anti_spoofing import AntiSpoofing
+        anti_spoofing = AntiSpoofing()
+
+    frame_queue = BoundedQueue(maxsize=4 * args.batch_size, policy='block')
+    reader = FrameReader(args.input, frame_queue, every_n_frames=args.every, start_time=start_time)
+    processor = BatchAttendanceProcessor(face_recognizer, AttendanceLogger(db), anti_spoofing, args.batch_size)
+
+    if reader.start_time is not None:
+        print(f"🕒 Video start: {reader.start_time.strftime(config.DATETIME_FORMAT)}")
+    total = reader.total_frames // args.every if reader.images is None else reader.total_frames
+    print(f"📦 {args.input}: ~{total} frames to process (batch {args.batch_size})")
+
+    reader.start()
+    started = time.perf_counter()
+    last_report = started
+    while True:
+        try:
+            items = frame_queue.get_batch(args.batch_size, timeout=0.5)
+        except QueueClosed:
+            break
+        if not items:
+            continue
+        processor.process(items)
+
+        now = time.perf_counter()
+        if now - last_report >= args.progress_every:
+            last_report = now
+            fps = processor.frames / (now - started)
+            progress = f"{processor.frames}/{total}" if total else f"{processor.frames}"
+            print(f"📊 {progress} frames | {fps:.1f} frames/s | {processor.faces} faces | "
+                  f"{len(processor.records)} records")
+
+    reader.join()
+    if reader.error is not None:
+        print(f"❌ Lỗi đọc dữ liệu: {reader.error}")
+
+    db.close()
+    elapsed = time.perf_counter() - started
+    print(f"✅ Done: {processor.frames} frames in {elapsed:.1f}s "
+          f"({processor.frames / max(elapsed, 1e-6):.1f} frames/s), {len(processor.records)} records")
+
+
+if __name__ == "__main__":
+    main()
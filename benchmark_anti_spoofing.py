@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark + replay anti-spoofing trên dữ liệu đã gán nhãn (không cần camera/GPU)
+Anti-Spoofing Benchmark and Replay Harness
+
+Dữ liệu là thư mục con theo nhãn, mỗi file là 1 crop khuôn mặt hoặc 1 clip ngắn:
+
+    dataset/
+        live/      alice.jpg, bob_gate1.mp4, ...
+        printed/   ...
+        replayed/  ...
+
+Landmarks MTCNN (tùy chọn, cho blink) đặt cạnh file cùng tên: alice.npy
+có shape (5, 2) cho ảnh hoặc (số frame, 5, 2) cho clip.
+
+Chạy check_liveness và từng phương pháp (texture, depth, motion, blink) riêng lẻ,
+ghi báo cáo JSON + CSV: độ trễ p50/p95/p99, throughput và histogram điểm theo nhãn.
+Dòng lbp_nonuniform là đặc trưng thô (tỉ lệ mẫu LBP không uniform, chưa dùng để
+chấm điểm), dùng để hiệu chỉnh trên dữ liệu thật trước khi đưa vào texture_analysis.
+
+Usage:
+    python benchmark_anti_spoofing.py data/spoof_dataset
+    python benchmark_anti_spoofing.py data/spoof_dataset --max-frames 30 --output data/reports/spoof
+    python benchmark_anti_spoofing.py --synthetic 20        # CI: dữ liệu tổng hợp
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+import config
+from anti_spoofing import AntiSpoofing, FaceFeatureContext
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+METHODS = ('check_liveness', 'texture', 'depth', 'motion', 'blink', 'lbp_nonuniform')
+
+
+def prepare_crop(image_bgr, size):
+    """BGR (cv2) -> crop RGB kích thước size x size như đầu ra của MTCNN"""
+    return cv2.cvtColor(cv2.resize(image_bgr, (size, size)), cv2.COLOR_BGR2RGB)
+
+
+def load_landmarks(path, num_frames):
+    """Đọc landmarks cạnh file (nếu có), trả về list theo frame"""
+    landmarks_path = os.path.splitext(path)[0] + '.npy'
+    if not os.path.exists(landmarks_path):
+        return [None] * num_frames
+    landmarks = np.load(landmarks_path).astype(np.float32)
+    if landmarks.ndim == 2:
+        landmarks = landmarks[None]
+    return [landmarks[min(i, len(landmarks) - 1)] for i in range(num_frames)]
+
+
+def read_clip(path, max_frames, size):
+    capture = cv2.VideoCapture(path)
+    frames = []
+    try:
+        while len(frames) < max_frames:
+            ret, frame = capture.read()
+            if not ret:
+                break
+            frames.append(prepare_crop(frame, size))
+    finally:
+        capture.release()
+    return frames
+
+
+def load_dataset(root, max_frames, size):
+    """
+    Đọc thư mục dữ liệu
+
+    Returns:
+        samples: List (label, name, frames, landmarks); ảnh là clip 1 frame
+    """
+    samples = []
+    for label in sorted(os.listdir(root)):
+        label_dir = os.path.join(root, label)
+        if not os.path.isdir(label_dir):
+            continue
+        for filename in sorted(os.listdir(label_dir)):
+            path = os.path.join(label_dir, filename)
+            extension = os.path.splitext(filename)[1].lower()
+            if extension in IMAGE_EXTENSIONS:
+                image = cv2.imread(path)
+                frames = [] if image is None else [prepare_crop(image, size)]
+            elif extension in VIDEO_EXTENSIONS:
+                frames = read_clip(path, max_frames, size)
+            else:
+                continue
+            if not frames:
+                print(f"⚠️ Bỏ qua file lỗi: {path}")
+                continue
+            samples.append((label, filename, frames, load_landmarks(path, len(frames))))
+    return samples
+
+
+def make_synthetic_dataset(num_samples, num_frames, size, seed):
+    """
+    Dữ liệu tổng hợp cho CI: live = texture mịn + rung nhẹ giữa các frame,
+    printed = ảnh mờ tĩnh độ tương phản thấp, replayed = ảnh mờ + vân moiré
+    """
+    rng = np.random.default_rng(seed)
+    base_landmarks = np.array([[0.34, 0.4], [0.66, 0.4], [0.5, 0.56], [0.38, 0.74], [0.62, 0.74]],
+                              dtype=np.float32) * size
+    yy, xx = np.mgrid[0:size + 8, 0:size + 8]
+    moire = (12 * np.sin(0.9 * xx + 0.4 * yy))[..., None]
+
+    samples = []
+    for label in ('live', 'printed', 'replayed'):
+        for index in range(num_samples):
+            noise = rng.integers(0, 256, (size + 8, size + 8, 3), dtype=np.uint8)
+            if label == 'live':
+                canvas = cv2.GaussianBlur(noise, (0, 0), 1.0)
+            elif label == 'printed':
+                canvas = (cv2.GaussianBlur(noise, (0, 0), 3.0) * 0.5 + 64).astype(np.uint8)
+            else:
+                canvas = np.clip(cv2.GaussianBlur(noise, (0, 0), 2.0) + moire, 0, 255).astype(np.uint8)
+
+            frames, landmarks = [], []
+            for _ in range(num_frames):
+                dx, dy = rng.integers(0, 9, 2) if label == 'live' else (4, 4)
+                frames.append(np.ascontiguousarray(canvas[dy:dy + size, dx:dx + size]))
+                landmarks.append(base_landmarks + rng.normal(0, 0.5, base_landmarks.shape).astype(np.float32))
+            samples.append((label, f"{label}_{index:03d}", frames, landmarks))
+    return samples
+
+
+class MethodStats:
+    """Độ trễ + điểm của 1 phương pháp, gom theo nhãn"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.scores = defaultdict(list)
+
+    def add(self, label, latency_ms, score):
+        self.latencies[label].append(latency_ms)
+        self.scores[label].append(float(score))
+
+    def __bool__(self):
+        return bool(self.latencies)
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def run_benchmark(samples, cascade, warmup):
+    """Chạy check_liveness và từng phương pháp trên mọi frame, trả về {method: MethodStats}"""
+    detector = AntiSpoofing()
+    # Mỗi phương pháp có state riêng: blink dùng key riêng để buffer không bị
+    # check_liveness ghi 2 lần, motion so sánh trực tiếp 2 crop liên tiếp
+    stats = {method: MethodStats() for method in METHODS}
+
+    # Khởi động (JIT của cv2/numpy, cấp phát lần đầu), không tính vào kết quả
+    _, _, frames, landmarks = samples[0]
+    for _ in range(warmup):
+        detector.check_liveness(frames[0], landmarks[0], cascade=cascade)
+        detector.texture_analysis(frames[0])
+        detector.depth_analysis(frames[0])
+    detector.track_states.clear()
+
+    for sample_index, (label, name, frames, landmarks) in enumerate(samples):
+        track_id = ('check', sample_index)
+        blink_track_id = ('blink', sample_index)
+        prev_gray = None
+
+        for face, face_landmarks in zip(frames, landmarks):
+            (_, score, _), latency = timed(
+                lambda: detector.check_liveness(face, face_landmarks, cascade=cascade, track_id=track_id)
+            )
+            stats['check_liveness'].add(label, latency, score)
+
+            score, latency = timed(lambda: detector.texture_analysis(face))
+            stats['texture'].add(label, latency, score)
+
+            score, latency = timed(lambda: detector.depth_analysis(face))
+            stats['depth'].add(label, latency, score)
+
+            score, latency = timed(lambda: FaceFeatureContext(face).lbp_nonuniform_ratio)
+            stats['lbp_nonuniform'].add(label, latency, score)
+
+            gray = FaceFeatureContext(face).gray
+            if prev_gray is not None:
+                score, latency = timed(lambda: detector.roi_motion_analysis(prev_gray, gray))
+                stats['motion'].add(label, latency, score)
+            prev_gray = gray
+
+            if face_landmarks is not None:
+                (_, blinked), latency = timed(lambda: detector.detect_blink(face_landmarks, blink_track_id))
+                # Cùng quy đổi điểm với check_liveness
+                stats['blink'].add(label, latency, 1.0 if blinked else 0.3)
+
+        detector.track_states.remove(track_id)
+        detector.track_states.remove(blink_track_id)
+    return stats
+
+
+def summarize(stats, bins, threshold):
+    """Tổng hợp {method: {label: {...}}}, nhãn 'all' gộp mọi nhãn"""
+    bin_edges = np.linspace(0.0, 1.0, bins + 1)
+    summary = {}
+    for method, method_stats in stats.items():
+        if not method_stats:
+            continue
+        labels = sorted(method_stats.latencies)
+        groups = {label: (method_stats.latencies[label], method_stats.scores[label]) for label in labels}
+        groups['all'] = (sum((method_stats.latencies[label] for label in labels), []),
+                         sum((method_stats.scores[label] for label in labels), []))
+
+        summary[method] = {}
+        for label, (latencies, scores) in groups.items():
+            latencies = np.asarray(latencies)
+            scores = np.clip(np.asarray(scores), 0.0, 1.0)
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            counts, _ = np.histogram(scores, bins=bin_edges)
+            summary[method][label] = {
+                'count': int(len(latencies)),
+                'latency_ms': {'mean': float(latencies.mean()), 'p50': float(p50),
+                               'p95': float(p95), 'p99': float(p99)},
+                'throughput_per_s': float(len(latencies) / max(latencies.sum() / 1000, 1e-9)),
+                'mean_score': float(scores.mean()),
+                'accept_rate': float(np.mean(scores >= threshold)),
+                'histogram': counts.tolist(),
+            }
+    return {'bin_edges': bin_edges.tolist(), 'methods': summary}
+
+
+def write_reports(report, output_prefix):
+    """Ghi <prefix>.json (đầy đủ) và <prefix>.csv (1 dòng cho mỗi phương pháp x nhãn)"""
+    directory = os.path.dirname(output_prefix)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    json_path = output_prefix + '.json'
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    csv_path = output_prefix + '.csv'
+    bin_edges = report['bin_edges']
+    hist_columns = [f"hist_{bin_edges[i]:.2f}_{bin_edges[i + 1]:.2f}" for i in range(len(bin_edges) - 1)]
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['method', 'label', 'count', 'p50_ms', 'p95_ms', 'p99_ms', 'mean_ms',
+                         'throughput_per_s', 'mean_score', 'accept_rate'] + hist_columns)
+        for method, labels in report['methods'].items():
+            for label, row in labels.items():
+                latency = row['latency_ms']
+                writer.writerow([method, label, row['count'],
+                                 f"{latency['p50']:.3f}", f"{latency['p95']:.3f}", f"{latency['p99']:.3f}",
+                                 f"{latency['mean']:.3f}", f"{row['throughput_per_s']:.1f}",
+                                 f"{row['mean_score']:.4f}", f"{row['accept_rate']:.4f}"] + row['histogram'])
+    return json_path, csv_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark anti-spoofing analyzers on a labelled dataset")
+    parser.add_argument('dataset', nargs='?', help="Thư mục dữ liệu (thư mục con = nhãn)")
+    parser.add_argument('--synthetic', type=int, default=0,
+                        help="Không dùng dataset, sinh N mẫu tổng hợp cho mỗi nhãn (CI)")
+    parser.add_argument('--synthetic-frames', type=int, default=8, help="Số frame mỗi mẫu tổng hợp")
+    parser.add_argument('--max-frames', type=int, default=60, help="Số frame tối đa đọc từ mỗi clip")
+    parser.add_argument('--size', type=int, default=config.FACENET_IMAGE_SIZE)
+    parser.add_argument('--bins', type=int, default=10, help="Số bin histogram điểm trên [0, 1]")
+    parser.add_argument('--no-cascade', action='store_true', help="check_liveness chạy đủ mọi phương pháp")
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None,
+                        help="Tiền tố file báo cáo (mặc định data/reports/anti_spoofing_benchmark_<thời gian>)")
+    args = parser.parse_args()
+
+    if not args.dataset and not args.synthetic:
+        parser.error("cần thư mục dataset hoặc --synthetic N")
+
+    print("🧪 Anti-spoofing benchmark")
+    if args.synthetic:
+        samples = make_synthetic_dataset(args.synthetic, args.synthetic_frames, args.size, args.seed)
+        source = f"synthetic ({args.synthetic} x {args.synthetic_frames} frames per label)"
+    else:
+        samples = load_dataset(args.dataset, args.max_frames, args.size)
+        source = os.path.abspath(args.dataset)
+    if not samples:
+        raise SystemExit(f"❌ Không có mẫu nào trong {args.dataset}")
+
+    frame_counts = defaultdict(int)
+    for label, _, frames, _ in samples:
+        frame_counts[label] += len(frames)
+    print(f"📦 {source}: " + ", ".join(f"{label}={count} frames" for label, count in sorted(frame_counts.items())))
+
+    cascade = config.LIVENESS_CASCADE and not args.no_cascade
+    started = time.perf_counter()
+    stats = run_benchmark(samples, cascade, args.warmup)
+    elapsed = time.perf_counter() - started
+
+    report = summarize(stats, args.bins, config.LIVENESS_THRESHOLD)
+    report.update({
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'dataset': source,
+        'frames': dict(frame_counts),
+        'wall_time_s': elapsed,
+        'config': {
+            'liveness_threshold': config.LIVENESS_THRESHOLD,
+            'cascade': cascade,
+            'motion_mode': config.MOTION_ANALYSIS_MODE,
+            'face_size': args.size,
+            'enabled': {'texture': config.USE_TEXTURE_ANALYSIS, 'blink': config.USE_BLINK_DETECTION,
+                        'motion': config.USE_MOTION_ANALYSIS, 'depth': config.USE_DEPTH_ANALYSIS},
+        },
+    })
+
+    for method, labels in report['methods'].items():
+        overall = labels['all']
+        latency = overall['latency_ms']
+        per_label = " | ".join(f"{label} {row['mean_score']:.2f}/{row['accept_rate']:.0%}"
+                               for label, row in labels.items() if label != 'all')
+        print(f"   {method:<14} | p50 {latency['p50']:7.2f} ms | p95 {latency['p95']:7.2f} ms | "
+              f"p99 {latency['p99']:7.2f} ms | {overall['throughput_per_s']:8.1f}/s | score/accept: {per_label}")
+
+    output = args.output or os.path.join(
+        config.REPORTS_DIR, f"anti_spoofing_benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    )
+    json_path, csv_path = write_reports(report, output)
+    print(f"📄 Report: {json_path}, {csv_path}")
+    print("\n✅ Benchmark completed!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark SQLite: mở/đóng kết nối mỗi lần gọi vs kết nối dùng lâu dài theo thread
+SQLite Connection Benchmark for DatabaseManager
+
+Chạy trên database tạm (không đụng tới data/database/attendance.db):
+    - "before": mỗi thao tác connect -> execute -> commit -> close, journal mặc định
+    - "after":  DatabaseManager với ConnectionPool (WAL, synchronous NORMAL, cache, prepared statements)
+
+Usage:
+    python benchmark_database.py
+    python benchmark_database.py --inserts 5000 --queries 5000 --threads 4
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import config
+from database import DatabaseManager
+
+
+class LegacyDatabase:
+    """Cách truy cập cũ: 1 kết nối mới cho mỗi thao tác (cùng câu SQL với DatabaseManager)"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def log_attendance(self, employee_id, attendance_type, status, confidence=0.0, is_late=0, notes="",
+                       timestamp=None):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        timestamp = timestamp or datetime.now()
+        cursor.execute('''
+            INSERT INTO attendance_logs (employee_id, datetime, type, status, confidence, is_late, notes)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (employee_id, timestamp.strftime(config.DATETIME_FORMAT),
+              attendance_type, status, confidence, is_late, notes))
+        conn.commit()
+        conn.close()
+
+    def get_employee(self, employee_id):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM employees WHERE employee_id = ? AND is_active = 1', (employee_id,))
+        result = cursor.fetchone()
+        conn.close()
+        return result
+
+    def get_last_checkin(self, employee_id, date=None):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM attendance_logs
+            WHERE employee_id = ? AND datetime LIKE ?
+            ORDER BY datetime DESC LIMIT 1
+        ''', (employee_id, f"{date}%"))
+        result = cursor.fetchone()
+        conn.close()
+        return result
+
+
+def create_database(path, num_employees):
+    """Tạo schema + nhân viên mẫu bằng DatabaseManager, trả về danh sách mã nhân viên"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        db = DatabaseManager(db_path=path)
+        employee_ids = [f"NV{i:04d}" for i in range(num_employees)]
+        for employee_id in employee_ids:
+            db.add_employee(employee_id, f"Employee {employee_id}")
+    db.close()
+    return employee_ids
+
+
+def run_inserts(db, employee_ids, count, num_threads):
+    """Ghi count lượt chấm công chia đều cho num_threads thread, trả về inserts/giây"""
+    start_time = datetime.now()
+
+    def worker(offset):
+        for i in range(offset, count, num_threads):
+            db.log_attendance(employee_ids[i % len(employee_ids)], "Check-in", "Success", 0.99, 0,
+                              "benchmark", timestamp=start_time + timedelta(seconds=i))
+
+    threads = [threading.Thread(target=worker, args=(t,)) for t in range(num_threads)]
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return count / (time.perf_counter() - started)
+
+
+def run_queries(func, keys):
+    """Độ trễ (ms) của từng truy vấn điểm"""
+    latencies = np.empty(len(keys))
+    for i, key in enumerate(keys):
+        start = time.perf_counter()
+        func(key)
+        latencies[i] = (time.perf_counter() - start) * 1000
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SQLite access (per-call connect vs pooled)")
+    parser.add_argument('--employees', type=int, default=200)
+    parser.add_argument('--inserts', type=int, default=2000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=2, help="Số thread ghi đồng thời (camera + Tk, ...)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print("🧪 SQLite benchmark (temporary databases)")
+    rng = np.random.default_rng(args.seed)
+    today = datetime.now().strftime(config.DATE_FORMAT)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = {}
+        for label in ('before', 'after'):
+            path = os.path.join(tmp_dir, f"{label}.db")
+            employee_ids = create_database(path, args.employees)
+            if label == 'before':
+                # Journal mặc định (rollback journal) như database cũ
+                with sqlite3.connect(path) as conn:
+                    conn.execute("PRAGMA journal_mode=DELETE")
+                db = LegacyDatabase(path)
+            else:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    db = DatabaseManager(db_path=path)
+
+            inserts_per_s = run_inserts(db, employee_ids, args.inserts, args.threads)
+            keys = [employee_ids[i] for i in rng.integers(0, len(employee_ids), args.queries)]
+            employee_ms = run_queries(db.get_employee, keys)
+            checkin_ms = run_queries(lambda key: db.get_last_checkin(key, today), keys)
+            if isinstance(db, DatabaseManager):
+                db.close()
+            results[label] = (inserts_per_s, employee_ms, checkin_ms)
+
+        for label, (inserts_per_s, employee_ms, checkin_ms) in results.items():
+            print(f"   {label:<6} | inserts = {inserts_per_s:8.0f}/s ({args.threads} threads) | "
+                  f"get_employee p50 = {np.percentile(employee_ms, 50):6.3f} ms "
+                  f"p95 = {np.percentile(employee_ms, 95):6.3f} ms | "
+                  f"get_last_checkin p50 = {np.percentile(checkin_ms, 50):6.3f} ms "
+                  f"p95 = {np.percentile(checkin_ms, 95):6.3f} ms")
+
+        before, after = results['before'], results['after']
+        print(f"   speedup | inserts {after[0] / before[0]:.1f}x | "
+              f"get_employee {np.median(before[1]) / np.median(after[1]):.1f}x | "
+              f"get_last_checkin {np.median(before[2]) / np.median(after[2]):.1f}x")
+    print("\n✅ Benchmark completed!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark liveness theo batch: đặc trưng texture/depth tính từng mặt vs gộp N mặt
+Batched Liveness Feature Benchmark for N = 1..16 faces per frame
+
+So sánh các kernel của FaceFeatureContext (grayscale, Sobel, gradient, phổ rFFT,
+histogram LBP) chạy từng crop với bản gộp cả N crop vào 1 lần gọi cv2/numpy.
+Các kernel batch chỉ nằm trong file này: kết quả giống hệt từng mặt nhưng tổng
+thời gian chỉ nhanh hơn tối đa ~1.07x (N=4) và chậm hơn tới ~0.8x khi N >= 7
+(crop 160x160 đã đủ lớn để cv2/numpy chạy hiệu quả, gộp lại chỉ thêm bước
+pad/copy), nên anti_spoofing không có API check_liveness_batch.
+Chạy lại benchmark này trước khi đề xuất lại API batch.
+
+Usage:
+    python benchmark_liveness_batch.py
+    python benchmark_liveness_batch.py --max-faces 16 --repeats 20
+"""
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+import config
+from anti_spoofing import AntiSpoofing, FaceFeatureContext, UNIFORM_LBP_BINS, UNIFORM_LBP_LUT
+
+SOBEL_KSIZE = 5  # Giống FaceFeatureContext.sobel_x/sobel_y
+SOBEL_PAD = SOBEL_KSIZE // 2
+
+
+def make_faces(num_faces, size, rng):
+    """Crop tổng hợp: nhiễu đã làm mờ với độ mịn khác nhau (giống ảnh in/ảnh thật)"""
+    faces = []
+    for _ in range(num_faces):
+        noise = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+        faces.append(cv2.GaussianBlur(noise, (0, 0), rng.uniform(0.5, 3.0)))
+    return np.stack(faces)
+
+
+def time_call(func, repeats):
+    """Trả về thời gian trung vị (ms) của func()"""
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return float(np.median(latencies))
+
+
+# ---------------------------------------------------------------- kernel từng mặt
+
+def single_gray(faces):
+    return [FaceFeatureContext(face).gray for face in faces]
+
+
+def single_sobel(grays):
+    return [(cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=SOBEL_KSIZE),
+             cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=SOBEL_KSIZE)) for gray in grays]
+
+
+def single_gradient_magnitude(sobels):
+    return [np.sqrt(sobel_x**2 + sobel_y**2) for sobel_x, sobel_y in sobels]
+
+
+def single_fft_row_sums(grays):
+    return [np.abs(np.fft.rfft2(gray, axes=(1, 0))).sum(axis=1) for gray in grays]
+
+
+def single_lbp_histogram(grays):
+    return [AntiSpoofing.lbp_histogram(gray) for gray in grays]
+
+
+# ---------------------------------------------------------------- kernel batch
+
+def batch_rgb_to_gray(faces):
+    """N crop RGB (N, H, W, 3) -> grayscale (N, H, W) trong 1 lần cvtColor"""
+    num_faces, rows, cols = faces.shape[:3]
+    stacked = faces.reshape(num_faces * rows, cols, 3)
+    return cv2.cvtColor(stacked, cv2.COLOR_RGB2GRAY).reshape(num_faces, rows, cols)
+
+
+def batch_sobel(grays):
+    """
+    Sobel của N crop xếp chồng theo chiều dọc trong 1 lần gọi
+
+    Mỗi crop được pad reflect (giống BORDER_DEFAULT của cv2) ở trên/dưới để
+    kernel không lấy pixel của crop bên cạnh, rồi cắt phần pad đi.
+    """
+    num_faces, rows, cols = grays.shape
+    padded = np.pad(grays, ((0, 0), (SOBEL_PAD, SOBEL_PAD), (0, 0)), mode='reflect')
+    stacked = padded.reshape(-1, cols)
+    crop = slice(SOBEL_PAD, SOBEL_PAD + rows)
+    sobel_x = cv2.Sobel(stacked, cv2.CV_64F, 1, 0, ksize=SOBEL_KSIZE).reshape(num_faces, -1, cols)[:, crop]
+    sobel_y = cv2.Sobel(stacked, cv2.CV_64F, 0, 1, ksize=SOBEL_KSIZE).reshape(num_faces, -1, cols)[:, crop]
+    return sobel_x, sobel_y
+
+
+def batch_gradient_magnitude(sobels):
+    sobel_x, sobel_y = sobels
+    return np.sqrt(sobel_x**2 + sobel_y**2)
+
+
+def batch_fft_row_sums(grays):
+    """Tổng biên độ theo hàng của nửa phổ rFFT cho cả N crop (rfft theo trục hàng)"""
+    return np.abs(np.fft.rfft2(grays, axes=(2, 1))).sum(axis=2)
+
+
+def batch_lbp_histogram(grays):
+    """Histogram LBP nhiều bán kính của N crop: 1 lần bincount với offset theo crop"""
+    num_faces = grays.shape[0]
+    bins = UNIFORM_LBP_BINS if config.LBP_UNIFORM else 256
+    offsets = (np.arange(num_faces, dtype=np.intp) * bins)[:, None]
+
+    histograms = []
+    for radius in config.LBP_RADII:
+        codes = AntiSpoofing.compute_lbp(grays, radius)
+        if config.LBP_UNIFORM:
+            codes = UNIFORM_LBP_LUT[codes]
+        codes = codes.reshape(num_faces, -1)
+        hist = np.bincount((codes + offsets).ravel(), minlength=num_faces * bins)
+        histograms.append(hist.reshape(num_faces, bins).astype(np.float32) / max(codes.shape[1], 1))
+    return np.concatenate(histograms, axis=1)
+
+
+def same(single, batch):
+    """Kết quả batch giống hệt từng mặt (so sánh bit-exact)"""
+    if isinstance(batch, tuple):
+        return all(same([s[i] for s in single], b) for i, b in enumerate(batch))
+    return all(np.array_equal(s, b) for s, b in zip(single, batch))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched liveness features (N faces per frame)")
+    parser.add_argument('--max-faces', type=int, default=16)
+    parser.add_argument('--size', type=int, default=config.FACENET_IMAGE_SIZE)
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print("🧪 Batched liveness feature benchmark (texture + depth kernels)")
+    rng = np.random.default_rng(args.seed)
+
+    totals = []
+    for num_faces in range(1, args.max_faces + 1):
+        faces = make_faces(num_faces, args.size, rng)
+        grays = batch_rgb_to_gray(faces)
+        sobels = batch_sobel(grays)
+        single_grays = single_gray(faces)
+        single_sobels = single_sobel(single_grays)
+
+        # (tên, từng mặt, batch, đầu vào từng mặt, đầu vào batch)
+        kernels = [
+            ('gray', single_gray, batch_rgb_to_gray, faces, faces),
+            ('sobel', single_sobel, batch_sobel, single_grays, grays),
+            ('gradient', single_gradient_magnitude, batch_gradient_magnitude, single_sobels, sobels),
+            ('fft', single_fft_row_sums, batch_fft_row_sums, single_grays, grays),
+            ('lbp_hist', single_lbp_histogram, batch_lbp_histogram, single_grays, grays),
+        ]
+
+        single_total = batch_total = 0.0
+        parts = []
+        for name, single_func, batch_func, single_input, batch_input in kernels:
+            if not same(single_func(single_input), batch_func(batch_input)):
+                raise SystemExit(f"❌ Batch {name} differs from single-face path (N={num_faces})")
+            single_ms = time_call(lambda: single_func(single_input), args.repeats)
+            batch_ms = time_call(lambda: batch_func(batch_input), args.repeats)
+            single_total += single_ms
+            batch_total += batch_ms
+            parts.append(f"{name} {single_ms / batch_ms:.2f}x")
+
+        totals.append((num_faces, single_total, batch_total))
+        print(f"   N={num_faces:<2} | single = {single_total:7.2f} ms | batch = {batch_total:7.2f} ms"
+              f" | {batch_total / num_faces:5.2f} ms/face | speedup = {single_total / batch_total:.2f}x"
+              f" ({', '.join(parts)})")
+
+    print("   ✅ Batch features identical to single-face path")
+    best = max(totals, key=lambda t: t[1] / t[2])
+    print(f"   Best total speedup: {best[1] / best[2]:.2f}x at N={best[0]}")
+    print("\n✅ Benchmark completed!")
+
+
+if __name__ == "__main__":
+    main()
@@ -22,6 +22,17 @@ for directory in [DATA_DIR, DATABASE_DIR, MODELS_DIR, ATTENDANCE_DIR, REPORTS_DI
 # ==================== CẤU HÌNH DATABASE ====================
 DATABASE_PATH = os.path.join(DATABASE_DIR, 'attendance.db')
 EMBEDDINGS_PATH = os.path.join(DATABASE_DIR, 'face_embeddings.pkl')
+SQLITE_JOURNAL_MODE = "WAL"  # Đọc (Tk, báo cáo) không chặn ghi (camera)
+SQLITE_SYNCHRONOUS = "NORMAL"  # Đủ an toàn với WAL, ít fsync hơn FULL
+SQLITE_CACHE_SIZE_KB = 8192  # Page cache mỗi kết nối
+SQLITE_BUSY_TIMEOUT = 5.0  # Chờ khóa ghi tối đa N giây thay vì lỗi "database is locked"
+SQLITE_CACHED_STATEMENTS = 128  # Số prepared statement được cache mỗi kết nối
+WRITE_BEHIND_ENABLED = True  # Ghi chấm công / giả mạo qua hàng đợi, không chặn camera thread
+WRITE_BEHIND_QUEUE_SIZE = 10000  # Số sự kiện tối đa chờ ghi (đầy thì thread gọi phải chờ)
+WRITE_BEHIND_BATCH_SIZE = 64  # Ghi ngay khi gom đủ N sự kiện
+WRITE_BEHIND_FLUSH_INTERVAL = 0.5  # Hoặc sau N giây kể từ sự kiện đầu tiên của lô
+WRITE_BEHIND_JOURNAL_PATH = os.path.join(DATABASE_DIR, 'write_behind.journal')  # Tiền tố các segment journal sự kiện chưa commit (khôi phục sau crash)
+WRITE_BEHIND_JOURNAL_FSYNC = False  # fsync journal mỗi sự kiện (chống mất điện, chậm hơn)
 
 # ==================== CẤU HÌNH FACE RECOGNITION ====================
 # MTCNN settings
@@ -32,7 +43,43 @@ MTCNN_FACTOR = 0.709
 # FaceNet settings
 FACENET_IMAGE_SIZE = 160
 FACE_RECOGNITION_THRESHOLD = 0.6  # Ngưỡng nhận diện (càng nhỏ càng chặt)
+MAX_TEMPLATES_PER_PERSON = 5  # Số template (góc mặt) tối đa lưu cho mỗi người (0 = không giới hạn)
 MIN_CONFIDENCE = 0.95  # Độ tin cậy tối thiểu của MTCNN
+# Căn chỉnh khuôn mặt theo 5 landmarks (similarity warp), đăng ký và nhận diện phải cùng chế độ.
+# "auto": quyết định khi nạp gallery, chỉ bật khi không còn embeddings chưa căn chỉnh (đăng ký trước
+# khi có căn chỉnh), để gallery cũ vẫn nhận diện được; True/False: cố định (đổi chế độ thì mọi nhân viên
+# phải đăng ký lại, danh sách được in ra khi nạp gallery)
+FACE_ALIGNMENT = "auto"
+# Vị trí chuẩn của 5 landmarks MTCNN (mắt trái, mắt phải, mũi, khóe miệng trái, khóe miệng phải)
+# trên ảnh 112x112 (template ArcFace); crop đã căn chỉnh có landmarks tại đây (scale theo kích thước crop)
+FACE_TEMPLATE_LANDMARKS = [
+    [38.2946, 51.6963],
+    [73.5318, 51.5014],
+    [56.0252, 71.7366],
+    [41.5493, 92.3655],
+    [70.7299, 92.2041],
+]
+# Tag lưu kèm embeddings; embeddings của model/chế độ căn chỉnh khác không dùng chung được
+ALIGNED_EMBEDDING_MODEL_VERSION = "facenet-vggface2-aligned"
+LEGACY_EMBEDDING_MODEL_VERSION = "facenet-vggface2"  # Không căn chỉnh; cả document cũ chưa có tag
+EMBEDDING_MODEL_VERSION = (ALIGNED_EMBEDDING_MODEL_VERSION if FACE_ALIGNMENT
+                           else LEGACY_EMBEDDING_MODEL_VERSION)  # "auto": cập nhật khi nạp gallery
+
+# Face index settings (tìm kiếm trong gallery)
+FACE_INDEX_TYPE = "auto"  # "flat": luôn tìm chính xác, "auto"/"ivf": IVF-Flat cho gallery lớn
+ANN_MIN_GALLERY_SIZE = 20000  # Gallery nhỏ hơn ngưỡng này được tìm kiếm chính xác
+IVF_NLIST = 0  # Số cụm k-means (0 = tự động ~sqrt(N))
+IVF_NPROBE = 16  # Số cụm được quét cho mỗi truy vấn
+
+# ==================== CẤU HÌNH FACE TRACKING ====================
+# Mỗi khuôn mặt có 1 track id ổn định; nhận diện + liveness được cache theo track
+TRACKER_IOU_THRESHOLD = 0.3  # Điểm ghép tối thiểu (IoU trừ phạt dịch chuyển landmarks)
+TRACKER_LANDMARK_WEIGHT = 0.5  # Trọng số phạt dịch chuyển landmarks khi ghép track
+TRACKER_MAX_MISSED = 3  # Số lần xử lý liên tiếp mất dấu trước khi xóa track
+TRACKER_CONFIDENCE_DECAY = 0.98  # Độ tin cậy danh tính giảm mỗi lần xử lý
+TRACKER_MIN_CONFIDENCE = 0.5  # Dưới ngưỡng này sẽ nhận diện lại
+TRACKER_UNKNOWN_CONFIDENCE = 0.6  # Độ tin cậy khởi đầu cho mặt chưa nhận ra (kiểm tra lại sớm)
+TRACKER_REID_MOTION = 0.5  # Nhận diện lại nếu tâm mặt dịch chuyển > tỉ lệ này * kích thước mặt
 
 # ==================== CẤU HÌNH ANTI-SPOOFING ====================
 ENABLE_ANTI_SPOOFING = True
@@ -45,6 +92,25 @@ USE_TEXTURE_ANALYSIS = True  # Phân tích texture (ảnh in)
 USE_BLINK_DETECTION = True   # Phát hiện nháy mắt
 USE_MOTION_ANALYSIS = True   # Phân tích chuyển động
 USE_DEPTH_ANALYSIS = True    # Phân tích độ sâu
+LBP_RADII = [1, 2, 3]  # Bán kính LBP cho histogram đặc trưng texture
+LBP_UNIFORM = True  # Histogram uniform-LBP (59 bin) thay vì 256 bin
+LIVENESS_CASCADE = True  # Chạy phương pháp rẻ trước, bỏ qua phần còn lại khi kết quả đã chắc chắn
+LIVENESS_COST_ALPHA = 0.1  # Hệ số trung bình trượt cho chi phí đo được của từng phương pháp
+BLINK_BUFFER_SIZE = 10  # Số frame trong buffer nháy mắt của mỗi track
+LIVENESS_STATE_MAX_TRACKS = 256  # Số track tối đa giữ trạng thái liveness
+LIVENESS_STATE_TTL = 10.0  # Xóa trạng thái của track không xuất hiện quá N giây
+MOTION_ANALYSIS_MODE = "dense"  # dense (Farneback trên crop mặt) | sparse (Lucas-Kanade quanh các landmark của crop)
+MOTION_ROI_SIZE = 80  # Cạnh lớn nhất của crop khi chạy Farneback (0 = giữ nguyên 160)
+MOTION_SPARSE_POINTS = 50  # Số góc tối đa cho chế độ sparse khi crop không căn chỉnh (FACE_ALIGNMENT = False)
+MOTION_HISTORY_MAX_AGE = 1.0  # Chỉ so sánh với crop trước của track nếu mới hơn N giây
+LIVENESS_TEMPORAL = True  # Gộp điểm liveness theo thời gian cho từng track (EWMA)
+LIVENESS_EWMA_ALPHA = 0.3  # Trọng số của điểm mới trong EWMA
+LIVENESS_EVAL_EVERY_N_FRAMES = 5  # Chạy lại các phương pháp liveness sau mỗi N frame của track
+LIVENESS_UNCERTAIN_MARGIN = 0.1  # Điểm cách ngưỡng ít hơn giá trị này thì luôn chạy lại
+LIVENESS_MIN_EVALUATIONS = 3  # Chỉ kết luận thật/giả (cho chấm công) khi track đã được đánh giá ít nhất N lần
+LIVENESS_MODE = "async"  # inline (chặn stage liveness) | async (worker pool, ghi chấm công khi có kết luận)
+LIVENESS_ASYNC_WORKERS = 2  # Số worker thread kiểm tra liveness bất đồng bộ
+LIVENESS_ASYNC_DEADLINE = 2.0  # Chỉ ghi chấm công nếu kết luận liveness về trong N giây
 
 # ==================== CẤU HÌNH CHẤM CÔNG ====================
 MIN_TIME_BETWEEN_CHECKINS = 300  # 5 phút (giây) - Thời gian tối thiểu giữa 2 lần chấm công
@@ -54,9 +120,27 @@ LATE_THRESHOLD_MINUTES = 15  # Đi muộn nếu sau 15 phút
 
 # ==================== CẤU HÌNH CAMERA ====================
 CAMERA_INDEX = 0  # 0 cho webcam mặc định, thử 1, 2 nếu lỗi
+CAMERA_SOURCES = [CAMERA_INDEX]  # Nhiều camera/video/RTSP dùng chung 1 bộ model, ví dụ [0, 1, "rtsp://..."]
+DISPLAY_SOURCE_ID = 0  # Camera hiển thị trên giao diện (vị trí trong CAMERA_SOURCES)
 CAMERA_WIDTH = 640  # Giảm resolution để tăng tốc
 CAMERA_HEIGHT = 480
 CAMERA_FPS = 30
+PROCESS_EVERY_N_FRAMES = 5  # Chỉ chạy detect/nhận diện mỗi N frame
+MOTION_GATE_ENABLED = True  # Không chạy detect khi khung hình tĩnh và không còn khuôn mặt nào
+MOTION_GATE_SIZE = 80  # Chiều rộng frame thu nhỏ để so sánh với ảnh nền
+MOTION_GATE_PIXEL_THRESHOLD = 15  # Chênh lệch mức xám để coi 1 pixel là thay đổi
+MOTION_GATE_MIN_AREA = 0.005  # Tỉ lệ pixel thay đổi tối thiểu để coi là có chuyển động
+MOTION_GATE_BG_ALPHA = 0.05  # Tốc độ cập nhật ảnh nền
+MOTION_GATE_HOLD = 2.0  # Giữ cổng mở N giây sau chuyển động cuối cùng
+
+# ==================== CẤU HÌNH PIPELINE ====================
+PIPELINE_QUEUE_SIZE = 4  # Kích thước hàng đợi giữa các stage
+PIPELINE_DROP_POLICY = "drop_oldest"  # drop_oldest | drop_newest | block khi hàng đợi đầy
+PIPELINE_MAX_BATCH = 8  # Số frame (từ nhiều camera) tối đa gom thành 1 batch detect/recognize
+PIPELINE_EXECUTION_MODE = "thread"  # thread | process (detect/embedding trong worker process)
+INFERENCE_WORKERS = 0  # Số worker process ở chế độ process, 0 = tự động (cpu_count // 2)
+INFERENCE_WORKER_THREADS = 1  # Số thread torch/OpenCV mỗi worker (tránh tranh chấp CPU)
+INFERENCE_TIMEOUT = 5.0  # Số giây tối đa chờ kết quả 1 frame từ worker
 
 # ==================== CẤU HÌNH GIAO DIỆN ====================
 WINDOW_TITLE = "AI Attendance System - Anti-Spoofing"
@@ -90,6 +174,7 @@ LANGUAGE = "vi"  # vi: Tiếng Việt, en: English
 DATE_FORMAT = "%d/%m/%Y"
 TIME_FORMAT = "%H:%M:%S"
 DATETIME_FORMAT = "%d/%m/%Y %H:%M:%S"
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"  # ISO-8601 lưu trong database (sắp xếp/so sánh được như chuỗi)
 
 # Số lượng ảnh để đăng ký 1 người
 NUM_IMAGES_FOR_REGISTRATION = 5
@@ -7,7 +7,9 @@ Database Management Module for Attendance System
 import sqlite3
 import pickle
 import os
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
+import numpy as np
 import pandas as pd
 import config
 
@@ -16,11 +18,203 @@ try:
 except Exception:
     pymongo = None
 
+# Phiên bản schema (PRAGMA user_version), tăng khi thêm migration
+SCHEMA_VERSION = 1
+
+# Cột datetime cũ (DD/MM/YYYY HH:MM:SS) -> ts ISO-8601 (YYYY-MM-DDTHH:MM:SS) bằng SQL,
+# không phải đọc từng dòng lên Python (hàng chục triệu dòng)
+_DATETIME_TO_TS_SQL = (
+    "substr(datetime, 7, 4) || '-' || substr(datetime, 4, 2) || '-' || substr(datetime, 1, 2)"
+    " || 'T' || substr(datetime, 12, 8)"
+)
+_DATETIME_GLOB = '[0-3][0-9]/[01][0-9]/[0-9][0-9][0-9][0-9] [0-2][0-9]:[0-5][0-9]:[0-5][0-9]'
+# Dòng không khớp _DATETIME_GLOB (không đệm số 0, ghi tay, nhập từ nguồn khác) được
+# chuyển bằng Python theo lần lượt các định dạng này
+_LEGACY_DATETIME_FORMATS = (
+    config.DATETIME_FORMAT,
+    config.TIMESTAMP_FORMAT,
+    "%Y-%m-%d %H:%M:%S",
+    "%d/%m/%Y %H:%M",
+)
+
+ATTENDANCE_INSERT_SQL = '''
+    INSERT INTO attendance_logs (employee_id, datetime, ts, type, status, confidence, is_late, notes)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+SPOOFING_INSERT_SQL = '''
+    INSERT INTO spoofing_logs (datetime, liveness_score, is_real, detection_method, notes)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+
+def to_ts(value, end=False):
+    """
+    Chuyển mốc thời gian sang chuỗi ts ISO-8601 (so sánh chuỗi = so sánh thời gian)
+    
+    Args:
+        value: datetime, date, chuỗi DD/MM/YYYY hoặc DD/MM/YYYY HH:MM:SS
+        end: Mốc cuối của khoảng; chỉ có ngày thì lấy 00:00:00 của ngày hôm sau
+             (dùng với "<") để bao trọn cả ngày
+    
+    Returns:
+        (ts, inclusive): inclusive = False khi mốc cuối là đầu ngày hôm sau
+    """
+    inclusive = True
+    if isinstance(value, str):
+        try:
+            value = datetime.strptime(value, config.DATETIME_FORMAT)
+        except ValueError:
+            value = datetime.strptime(value, config.DATE_FORMAT).date()
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, datetime.min.time())
+        if end:
+            value += timedelta(days=1)
+            inclusive = False
+    return value.strftime(config.TIMESTAMP_FORMAT), inclusive
+
+
+def attendance_row(employee_id, attendance_type, status, confidence=0.0, is_late=0, notes="", timestamp=None):
+    """Tham số của ATTENDANCE_INSERT_SQL (kiểu Python thuần, ghi được ra journal JSON)"""
+    if timestamp is None:
+        timestamp = datetime.now()
+    return (employee_id, timestamp.strftime(config.DATETIME_FORMAT), timestamp.strftime(config.TIMESTAMP_FORMAT),
+            attendance_type, status, float(confidence), int(is_late), notes)
+
+
+def spoofing_row(liveness_score, is_real, method, notes="", timestamp=None):
+    """Tham số của SPOOFING_INSERT_SQL"""
+    if timestamp is None:
+        timestamp = datetime.now()
+    return (timestamp.strftime(config.DATETIME_FORMAT),
+            None if liveness_score is None else float(liveness_score), int(is_real), method, notes)
+
+
+def embedding_document(employee_id, embedding, name=None, model_version=None):
+    """
+    Document MongoDB của 1 nhân viên: templates (T, D) đóng gói float32 little-endian
+    
+    Nhỏ hơn ~10 lần so với list số thực (mỗi phần tử BSON double + key) và
+    đọc lại bằng np.frombuffer không cần chuyển từng phần tử. model_version mặc
+    định là EMBEDDING_MODEL_VERSION (embeddings vừa tính bằng cấu hình hiện tại).
+    """
+    templates = np.atleast_2d(np.asarray(embedding, dtype='<f4'))
+    return {
+        'employee_id': employee_id,
+        'embedding': templates.tobytes(),
+        'num_templates': templates.shape[0],
+        'dim': templates.shape[1],
+        'dtype': 'float32',
+        'model_version': model_version or config.EMBEDDING_MODEL_VERSION,
+        'name': name,
+        'updated_at': datetime.now().strftime(config.DATETIME_FORMAT)
+    }
+
+
+def embedding_model_version(doc):
+    """Tag model của document MongoDB (document cũ chưa có tag: LEGACY_EMBEDDING_MODEL_VERSION)"""
+    return doc.get('model_version') or config.LEGACY_EMBEDDING_MODEL_VERSION
+
+
+def resolve_face_alignment(model_versions):
+    """
+    Quyết định FACE_ALIGNMENT = "auto" theo tag của các embeddings đã lưu (gọi khi nạp gallery)
+
+    Bật căn chỉnh khi không có embeddings chưa căn chỉnh, ngược lại giữ chế độ cũ
+    để nhân viên đã đăng ký vẫn được nhận diện. Cập nhật EMBEDDING_MODEL_VERSION theo.
+    """
+    if config.FACE_ALIGNMENT != "auto":
+        return config.FACE_ALIGNMENT
+    aligned = config.LEGACY_EMBEDDING_MODEL_VERSION not in model_versions
+    config.FACE_ALIGNMENT = aligned
+    config.EMBEDDING_MODEL_VERSION = (config.ALIGNED_EMBEDDING_MODEL_VERSION if aligned
+                                      else config.LEGACY_EMBEDDING_MODEL_VERSION)
+    if not aligned:
+        print("⚠️ Gallery has unaligned face embeddings, face alignment disabled "
+              "(set FACE_ALIGNMENT = True and re-register everyone to enable it)")
+    return aligned
+
+
+def decode_embedding(doc, check_version=True):
+    """
+    Templates (T, D) float32 từ document MongoDB
+    
+    Hỗ trợ cả định dạng cũ (list số thực, chưa có model_version). Trả về None
+    nếu embeddings thuộc model khác EMBEDDING_MODEL_VERSION (check_version=False
+    để đọc bất kể model).
+    """
+    if check_version and embedding_model_version(doc) != config.EMBEDDING_MODEL_VERSION:
+        return None
+    embedding = doc.get('embedding')
+    if isinstance(embedding, (bytes, bytearray, memoryview)):
+        templates = np.frombuffer(embedding, dtype='<f4')
+        return templates.reshape(-1, doc.get('dim') or templates.size // max(1, doc.get('num_templates', 1)))
+    return np.atleast_2d(np.asarray(embedding, dtype=np.float32))
+
+
+class ConnectionPool:
+    """
+    Kết nối SQLite dùng lâu dài, mỗi thread 1 kết nối riêng
+    
+    Camera thread, Tk thread, pipeline stage... mỗi thread mở kết nối 1 lần
+    (WAL, synchronous NORMAL, cache lớn, busy timeout) và dùng lại mãi, câu
+    lệnh được sqlite3 cache sẵn ở dạng prepared statement theo nội dung SQL.
+    Kết nối của thread đã kết thúc được đóng khi có thread mới mở kết nối.
+    """
+    
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []  # (thread, connection)
+    
+    def get(self):
+        """Kết nối của thread hiện tại (mở nếu chưa có)"""
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.connection = conn
+            with self._lock:
+                self._close_dead_threads()
+                self._connections.append((threading.current_thread(), conn))
+        return conn
+    
+    def _connect(self):
+        # check_same_thread=False chỉ để close_all() đóng được từ thread khác,
+        # mỗi kết nối vẫn chỉ được dùng bởi thread đã mở nó
+        conn = sqlite3.connect(self.db_path, timeout=config.SQLITE_BUSY_TIMEOUT,
+                               cached_statements=config.SQLITE_CACHED_STATEMENTS,
+                               check_same_thread=False)
+        conn.execute(f"PRAGMA journal_mode={config.SQLITE_JOURNAL_MODE}")
+        conn.execute(f"PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA cache_size=-{int(config.SQLITE_CACHE_SIZE_KB)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute(f"PRAGMA busy_timeout={int(config.SQLITE_BUSY_TIMEOUT * 1000)}")
+        return conn
+    
+    def _close_dead_threads(self):
+        alive = []
+        for thread, conn in self._connections:
+            if thread.is_alive():
+                alive.append((thread, conn))
+            else:
+                conn.close()
+        self._connections = alive
+    
+    def close_all(self):
+        """Đóng mọi kết nối (khi tắt ứng dụng)"""
+        with self._lock:
+            for _, conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+
 class DatabaseManager:
     """Quản lý database SQLite cho hệ thống chấm công"""
     
-    def __init__(self):
-        self.db_path = config.DATABASE_PATH
+    def __init__(self, db_path=None):
+        self.db_path = db_path or config.DATABASE_PATH
+        self.connections = ConnectionPool(self.db_path)
         self.embeddings_path = config.EMBEDDINGS_PATH
         # Initialize MongoDB client for storing embeddings (optional)
         self.mongo_client = None
@@ -37,7 +231,7 @@ class DatabaseManager:
     
     def init_database(self):
         """Khởi tạo database và các bảng cần thiết"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connections.get()
         cursor = conn.cursor()
         
         # Bảng nhân viên
@@ -82,13 +276,86 @@ class DatabaseManager:
             )
         ''')
         
+        # Số thứ tự sự kiện write-behind cuối cùng đã commit (xem write_behind.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS write_behind_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                last_seq INTEGER NOT NULL
+            )
+        ''')
+        
         conn.commit()
-        conn.close()
+        self._migrate(conn)
         print("✅ Database initialized successfully!")
     
+    def _migrate(self, conn):
+        """Nâng schema theo PRAGMA user_version (chạy 1 lần cho mỗi phiên bản)"""
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        
+        with conn:
+            if version < 1:
+                # v1: cột ts ISO-8601 sắp xếp được + index cho truy vấn theo khoảng thời gian
+                columns = {row[1] for row in conn.execute('PRAGMA table_info(attendance_logs)')}
+                if 'ts' not in columns:
+                    conn.execute('ALTER TABLE attendance_logs ADD COLUMN ts TEXT')
+                converted = conn.execute(
+                    f"UPDATE attendance_logs SET ts = {_DATETIME_TO_TS_SQL} "
+                    f"WHERE ts IS NULL AND datetime GLOB '{_DATETIME_GLOB}'"
+                ).rowcount
+                fallback = self._convert_irregular_datetimes(conn)
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_attendance_employee_ts '
+                             'ON attendance_logs (employee_id, ts)')
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_attendance_ts ON attendance_logs (ts)')
+                print(f"✅ Migrated attendance_logs to schema v1 ({converted + fallback} rows converted, "
+                      f"{fallback} by Python fallback)")
+            conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    
+    @staticmethod
+    def _convert_irregular_datetimes(conn):
+        """
+        Điền ts cho các dòng SQL không chuyển được (datetime không khớp _DATETIME_GLOB)
+
+        Dòng thiếu ts không xuất hiện trong truy vấn theo khoảng thời gian và kiểm tra
+        khoảng chờ, nên nếu còn dòng không đọc được thì migration thất bại (rollback,
+        user_version giữ nguyên) thay vì bỏ qua chúng.
+
+        Returns:
+            converted: Số dòng đã chuyển
+        """
+        rows = conn.execute('SELECT id, datetime FROM attendance_logs WHERE ts IS NULL').fetchall()
+        updates = []
+        unparsed = []
+        for row_id, value in rows:
+            for fmt in _LEGACY_DATETIME_FORMATS:
+                try:
+                    timestamp = datetime.strptime(value.strip(), fmt)
+                except (AttributeError, ValueError):
+                    continue
+                updates.append((timestamp.strftime(config.TIMESTAMP_FORMAT), row_id))
+                break
+            else:
+                unparsed.append((row_id, value))
+
+        if unparsed:
+            samples = ', '.join(f"id={row_id} {value!r}" for row_id, value in unparsed[:5])
+            raise RuntimeError(
+                f"Không chuyển được {len(unparsed)} dòng attendance_logs sang ts "
+                f"(datetime không đúng định dạng {config.DATETIME_FORMAT}): {samples}. "
+                f"Sửa hoặc xóa các dòng này rồi chạy lại."
+            )
+
+        conn.executemany('UPDATE attendance_logs SET ts = ? WHERE id = ?', updates)
+        return len(updates)
+    
+    def close(self):
+        """Đóng các kết nối SQLite của mọi thread"""
+        self.connections.close_all()
+    
     def add_employee(self, employee_id, name, department="", position="", email="", phone=""):
         """Thêm nhân viên mới"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connections.get()
         cursor = conn.cursor()
         
         try:
@@ -101,19 +368,17 @@ class DatabaseManager:
             print(f"✅ Added employee: {name} (ID: {employee_id})")
             return True
         except sqlite3.IntegrityError:
+            conn.rollback()
             print(f"❌ Employee ID {employee_id} already exists!")
             return False
-        finally:
-            conn.close()
     
     def get_employee(self, employee_id):
         """Lấy thông tin nhân viên"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connections.get()
         cursor = conn.cursor()
         
         cursor.execute('SELECT * FROM employees WHERE employee_id = ? AND is_active = 1', (employee_id,))
         result = cursor.fetchone()
-        conn.close()
         
         if result:
             return {
@@ -131,12 +396,11 @@ class DatabaseManager:
     
     def get_all_employees(self):
         """Lấy danh sách tất cả nhân viên"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connections.get()
         cursor = conn.cursor()
         
         cursor.execute('SELECT * FROM employees WHERE is_active = 1 ORDER BY name')
         results = cursor.fetchall()
-        conn.close()
         
         employees = []
         for result in results:
@@ -154,59 +418,65 @@ class DatabaseManager:
     
     def delete_employee(self, employee_id):
         """Xóa nhân viên (soft delete)"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connections.get()
         cursor = conn.cursor()
         
         cursor.execute('UPDATE employees SET is_active = 0 WHERE employee_id = ?', (employee_id,))
         conn.commit()
-        conn.close()
         print(f"✅ Deleted employee ID: {employee_id}")
     
-    def log_attendance(self, employee_id, attendance_type, status, confidence=0.0, is_late=0, notes=""):
-        """Ghi nhận chấm công"""
-        conn = sqlite3.connect(self.db_path)
+    def log_attendance(self, employee_id, attendance_type, status, confidence=0.0, is_late=0, notes="",
+                       timestamp=None):
+        """Ghi nhận chấm công (timestamp: thời điểm gốc khi xử lý lại video, mặc định là bây giờ)"""
+        conn = self.connections.get()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            INSERT INTO attendance_logs (employee_id, datetime, type, status, confidence, is_late, notes)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (employee_id, datetime.now().strftime(config.DATETIME_FORMAT), 
-              attendance_type, status, confidence, is_late, notes))
+        cursor.execute(ATTENDANCE_INSERT_SQL, attendance_row(
+            employee_id, attendance_type, status, confidence, is_late, notes, timestamp
+        ))
         
         conn.commit()
-        conn.close()
         print(f"✅ Logged attendance: {employee_id} - {attendance_type} - {status}")
     
     def get_attendance_logs(self, start_date=None, end_date=None, employee_id=None):
-        """Lấy lịch sử chấm công"""
-        conn = sqlite3.connect(self.db_path)
+        """
+        Lấy lịch sử chấm công (mới nhất trước)
+        
+        Args:
+            start_date, end_date: datetime/date hoặc chuỗi DD/MM/YYYY [HH:MM:SS];
+                                  end_date chỉ có ngày thì lấy trọn ngày đó
+            employee_id: ID nhân viên (None = tất cả)
+        """
+        conn = self.connections.get()
         cursor = conn.cursor()
         
         query = '''
-            SELECT a.*, e.name, e.department 
+            SELECT a.id, a.employee_id, a.datetime, a.type, a.status, a.confidence,
+                   a.is_late, a.notes, e.name, e.department, a.ts
             FROM attendance_logs a
             JOIN employees e ON a.employee_id = e.employee_id
             WHERE 1=1
         '''
         params = []
         
+        # Khoảng thời gian trên cột ts -> index seek trên (ts) hoặc (employee_id, ts)
         if start_date:
-            query += ' AND datetime >= ?'
-            params.append(start_date)
+            query += ' AND a.ts >= ?'
+            params.append(to_ts(start_date)[0])
         
         if end_date:
-            query += ' AND datetime <= ?'
-            params.append(end_date)
+            end_ts, inclusive = to_ts(end_date, end=True)
+            query += ' AND a.ts <= ?' if inclusive else ' AND a.ts < ?'
+            params.append(end_ts)
         
         if employee_id:
             query += ' AND a.employee_id = ?'
             params.append(employee_id)
         
-        query += ' ORDER BY datetime DESC'
+        query += ' ORDER BY a.ts DESC'
         
         cursor.execute(query, params)
         results = cursor.fetchall()
-        conn.close()
         
         logs = []
         for result in results:
@@ -220,26 +490,37 @@ class DatabaseManager:
                 'is_late': result[6],
                 'notes': result[7],
                 'employee_name': result[8],
-                'department': result[9]
+                'department': result[9],
+                'ts': result[10]
             })
         return logs
     
     def get_last_checkin(self, employee_id, date=None):
-        """Lấy lần chấm công cuối cùng của nhân viên"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        """Lấy lần chấm công cuối cùng của nhân viên trong ngày (date: DD/MM/YYYY, mặc định hôm nay)"""
         if date is None:
             date = datetime.now().strftime(config.DATE_FORMAT)
+        start_ts = to_ts(date)[0]
+        end_ts = to_ts(date, end=True)[0]
+        return self._last_checkin_in_range(employee_id, start_ts, end_ts, inclusive=False)
+    
+    def get_last_checkin_between(self, employee_id, start, end):
+        """Lần chấm công cuối cùng của nhân viên trong [start, end] (datetime)"""
+        return self._last_checkin_in_range(employee_id, start.strftime(config.TIMESTAMP_FORMAT),
+                                           end.strftime(config.TIMESTAMP_FORMAT), inclusive=True)
+    
+    def _last_checkin_in_range(self, employee_id, start_ts, end_ts, inclusive):
+        conn = self.connections.get()
+        cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT * FROM attendance_logs 
-            WHERE employee_id = ? AND datetime LIKE ?
-            ORDER BY datetime DESC LIMIT 1
-        ''', (employee_id, f"{date}%"))
+        # Index seek trên (employee_id, ts), lấy dòng cuối của khoảng
+        cursor.execute(f'''
+            SELECT id, employee_id, datetime, type, status, confidence, is_late, notes, ts
+            FROM attendance_logs
+            WHERE employee_id = ? AND ts >= ? AND ts {'<=' if inclusive else '<'} ?
+            ORDER BY ts DESC LIMIT 1
+        ''', (employee_id, start_ts, end_ts))
         
         result = cursor.fetchone()
-        conn.close()
         
         if result:
             return {
@@ -250,25 +531,65 @@ class DatabaseManager:
                 'status': result[4],
                 'confidence': result[5],
                 'is_late': result[6],
-                'notes': result[7]
+                'notes': result[7],
+                'ts': result[8]
             }
         return None
     
+    def get_recent_checkins(self, since):
+        """
+        Lần chấm công mới nhất của từng nhân viên từ thời điểm since (datetime)
+        
+        Returns:
+            {employee_id: datetime}
+        """
+        conn = self.connections.get()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT employee_id, MAX(ts) FROM attendance_logs
+            WHERE ts >= ?
+            GROUP BY employee_id
+        ''', (since.strftime(config.TIMESTAMP_FORMAT),))
+        
+        return {employee_id: datetime.strptime(ts, config.TIMESTAMP_FORMAT)
+                for employee_id, ts in cursor.fetchall()}
+    
     def log_spoofing_attempt(self, liveness_score, is_real, method, notes=""):
         """Ghi nhận phát hiện giả mạo"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connections.get()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            INSERT INTO spoofing_logs (datetime, liveness_score, is_real, detection_method, notes)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (datetime.now().strftime(config.DATETIME_FORMAT), liveness_score, is_real, method, notes))
+        cursor.execute(SPOOFING_INSERT_SQL, spoofing_row(liveness_score, is_real, method, notes))
         
         conn.commit()
-        conn.close()
+    
+    def write_batch(self, attendance_rows=(), spoofing_rows=(), last_seq=None):
+        """
+        Ghi 1 lô sự kiện trong 1 transaction (group commit)
+        
+        Args:
+            attendance_rows: List tham số của attendance_row()
+            spoofing_rows: List tham số của spoofing_row()
+            last_seq: Số thứ tự write-behind của sự kiện cuối trong lô, commit
+                      cùng transaction để khôi phục journal không ghi trùng
+        """
+        conn = self.connections.get()
+        with conn:
+            if attendance_rows:
+                conn.executemany(ATTENDANCE_INSERT_SQL, attendance_rows)
+            if spoofing_rows:
+                conn.executemany(SPOOFING_INSERT_SQL, spoofing_rows)
+            if last_seq is not None:
+                conn.execute('INSERT OR REPLACE INTO write_behind_state (id, last_seq) VALUES (1, ?)', (last_seq,))
+    
+    def get_write_behind_seq(self):
+        """Số thứ tự write-behind cuối cùng đã commit (0 nếu chưa có)"""
+        result = self.connections.get().execute('SELECT last_seq FROM write_behind_state WHERE id = 1').fetchone()
+        return result[0] if result else 0
     
     def save_face_embeddings(self, embeddings_dict):
-        """Lưu face embeddings"""
+        """Đồng bộ toàn bộ face embeddings (1 lần bulk_write)"""
         # embeddings_dict expected shape: {'embeddings': {id: vector, ...}, 'names': {id: name, ...}}
         embeddings = None
         names = None
@@ -279,21 +600,17 @@ class DatabaseManager:
         # If MongoDB is available, persist embeddings there (preferred)
         if self.mongo_collection is not None:
             try:
-                # If there are no embeddings, clear the collection
-                if not embeddings or len(embeddings) == 0:
-                    self.mongo_collection.delete_many({})
-                    print(f"✅ No embeddings left — cleared MongoDB collection: {self.mongo_collection.name}")
+                # Không xóa document nào ở đây (nhân viên bị xóa: delete_face_embedding)
+                if not embeddings:
                     return
 
-                # Upsert each embedding document
-                for emp_id, emb in embeddings.items():
-                    doc = {
-                        'employee_id': emp_id,
-                        'embedding': emb.tolist() if hasattr(emb, 'tolist') else emb,
-                        'name': names.get(emp_id) if names else None,
-                        'updated_at': datetime.now().strftime(config.DATETIME_FORMAT)
-                    }
-                    self.mongo_collection.replace_one({'employee_id': emp_id}, doc, upsert=True)
+                # 1 round-trip upsert mọi nhân viên; xóa nhân viên dùng delete_face_embedding
+                self.mongo_collection.bulk_write([
+                    pymongo.ReplaceOne({'employee_id': emp_id},
+                                       embedding_document(emp_id, emb, names.get(emp_id) if names else None),
+                                       upsert=True)
+                    for emp_id, emb in embeddings.items()
+                ], ordered=False)
 
                 print(f"✅ Saved {len(embeddings)} face embeddings to MongoDB collection: {self.mongo_collection.name}")
                 return
@@ -303,25 +620,99 @@ class DatabaseManager:
         # Fallback: save to local file (legacy)
         try:
             with open(self.embeddings_path, 'wb') as f:
-                pickle.dump(embeddings_dict, f)
+                pickle.dump(dict(embeddings_dict, model_version=config.EMBEDDING_MODEL_VERSION), f)
             print(f"✅ Saved {len(embeddings or {})} face embeddings to: {self.embeddings_path}")
         except Exception as e:
             print(f"⚠️ Failed to save embeddings to file: {e}")
     
+    def save_face_embedding(self, employee_id, embedding, name=None):
+        """Lưu embeddings của 1 nhân viên (đăng ký mới / đăng ký lại), 1 document"""
+        if self.mongo_collection is not None:
+            try:
+                self.mongo_collection.replace_one(
+                    {'employee_id': employee_id}, embedding_document(employee_id, embedding, name), upsert=True
+                )
+                print(f"✅ Saved face embedding of {employee_id} to MongoDB")
+                return
+            except Exception as e:
+                print(f"⚠️ Failed to save embedding to MongoDB: {e}")
+
+        self._update_embeddings_file(employee_id, embedding, name)
+    
+    def delete_face_embedding(self, employee_id):
+        """Xóa embeddings của 1 nhân viên, 1 document"""
+        if self.mongo_collection is not None:
+            try:
+                self.mongo_collection.delete_one({'employee_id': employee_id})
+                print(f"✅ Deleted face embedding of {employee_id} from MongoDB")
+                return
+            except Exception as e:
+                print(f"⚠️ Failed to delete embedding from MongoDB: {e}")
+
+        self._update_embeddings_file(employee_id, None)
+    
+    def _update_embeddings_file(self, employee_id, embedding, name=None):
+        """Fallback không có MongoDB: cập nhật 1 nhân viên trong file pickle (embedding None = xóa)"""
+        embeddings_dict = {'embeddings': {}, 'names': {}}
+        if os.path.exists(self.embeddings_path):
+            try:
+                with open(self.embeddings_path, 'rb') as f:
+                    embeddings_dict = pickle.load(f)
+            except Exception as e:
+                print(f"⚠️ Failed to load embeddings from file: {e}")
+        embeddings = embeddings_dict.setdefault('embeddings', {})
+        names = embeddings_dict.setdefault('names', {})
+        if embedding is None:
+            embeddings.pop(employee_id, None)
+            names.pop(employee_id, None)
+        else:
+            embeddings[employee_id] = np.atleast_2d(np.asarray(embedding, dtype=np.float32))
+            names[employee_id] = name
+        if embeddings:
+            embeddings_dict['model_version'] = config.EMBEDDING_MODEL_VERSION
+        try:
+            with open(self.embeddings_path, 'wb') as f:
+                pickle.dump(embeddings_dict, f)
+            print(f"✅ Saved {len(embeddings)} face embeddings to: {self.embeddings_path}")
+        except Exception as e:
+            print(f"⚠️ Failed to save embeddings to file: {e}")
+    
     def load_face_embeddings(self):
         """Đọc face embeddings"""
         # Try to load from MongoDB first
         if self.mongo_collection is not None:
             try:
                 docs = list(self.mongo_collection.find({}))
+                resolve_face_alignment({embedding_model_version(d) for d in docs if d.get('embedding') is not None})
                 embeddings = {}
                 names = {}
+                legacy = []
+                skipped = []
                 for d in docs:
                     emp_id = d.get('employee_id')
-                    emb = d.get('embedding')
-                    if emp_id and emb is not None:
-                        embeddings[emp_id] = emb
-                        names[emp_id] = d.get('name')
+                    if not emp_id or d.get('embedding') is None:
+                        continue
+                    if isinstance(d['embedding'], list):
+                        legacy.append(d)
+                    emb = decode_embedding(d)
+                    if emb is None:
+                        skipped.append(emp_id)
+                        continue
+                    embeddings[emp_id] = emb
+                    names[emp_id] = d.get('name')
+                if skipped:
+                    print(f"⚠️ Skipped {len(skipped)} face embeddings of another model "
+                          f"(expected {config.EMBEDDING_MODEL_VERSION}), please re-register: {', '.join(skipped)}")
+                if legacy:
+                    # Chuyển document cũ (list số thực) sang định dạng nhị phân, 1 lần; giữ tag
+                    # model cũ để không bị nhận nhầm là embeddings của cấu hình hiện tại
+                    self.mongo_collection.bulk_write([
+                        pymongo.ReplaceOne({'employee_id': d['employee_id']},
+                                           embedding_document(d['employee_id'], decode_embedding(d, check_version=False),
+                                                              d.get('name'), model_version=embedding_model_version(d)))
+                        for d in legacy
+                    ], ordered=False)
+                    print(f"✅ Converted {len(legacy)} legacy face embeddings to float32 binary")
                 print(f"✅ Loaded {len(embeddings)} face embeddings from MongoDB")
                 return {'embeddings': embeddings, 'names': names}
             except Exception as e:
@@ -332,11 +723,20 @@ class DatabaseManager:
             try:
                 with open(self.embeddings_path, 'rb') as f:
                     embeddings = pickle.load(f)
+                # File cũ chưa có tag: embeddings chưa căn chỉnh
+                model_version = embeddings.get('model_version') or config.LEGACY_EMBEDDING_MODEL_VERSION
+                resolve_face_alignment({model_version} if embeddings.get('embeddings') else set())
+                if embeddings.get('embeddings') and model_version != config.EMBEDDING_MODEL_VERSION:
+                    print(f"⚠️ Skipped face embeddings file of another model ({model_version}, "
+                          f"expected {config.EMBEDDING_MODEL_VERSION}), please re-register: "
+                          f"{', '.join(embeddings['embeddings'])}")
+                    return {}
                 print(f"✅ Loaded {len(embeddings.get('embeddings',{}))} face embeddings from file")
                 return embeddings
             except Exception as e:
                 print(f"⚠️ Failed to load embeddings from file: {e}")
 
+        resolve_face_alignment(set())  # Chưa có ai đăng ký
         return {}
     
     def export_to_excel(self, start_date=None, end_date=None, output_path=None):
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Module chỉ mục tìm kiếm embedding (exact + approximate nearest neighbour)
+Embedding Search Index Module (Flat + IVF-Flat, numpy only)
+"""
+
+from collections import defaultdict
+
+import numpy as np
+
+import config
+
+
+def _normalize_rows(vectors):
+    """L2-normalize từng hàng, trả về float32 contiguous"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-10)
+
+
+def _top_k(similarities, labels, top_k):
+    """Lấy top-k (labels, similarities) theo thứ tự giảm dần"""
+    n = len(similarities)
+    top_k = min(top_k, n)
+    if top_k == 0:
+        return labels[:0], similarities[:0]
+    if top_k < n:
+        top = np.argpartition(-similarities, top_k - 1)[:top_k]
+    else:
+        top = np.arange(n)
+    top = top[np.argsort(-similarities[top])]
+    return labels[top], similarities[top]
+
+
+class FlatIndex:
+    """Tìm kiếm chính xác (brute force) bằng 1 phép nhân ma trận"""
+
+    def __init__(self, dim=512):
+        self.dim = dim
+        self._size = 0
+        self._vectors = np.empty((0, dim), dtype=np.float32)
+        self._labels = np.empty(0, dtype=object)
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def vectors(self):
+        """Ma trận (N, dim) các vector đã normalize"""
+        return self._vectors[:self._size]
+
+    @property
+    def labels(self):
+        """Mảng label song song với vectors"""
+        return self._labels[:self._size]
+
+    def reset(self):
+        """Xóa toàn bộ index"""
+        self._size = 0
+        self._vectors = np.empty((0, self.dim), dtype=np.float32)
+        self._labels = np.empty(0, dtype=object)
+
+    def add(self, labels, vectors):
+        """
+        Thêm vector vào index
+
+        Args:
+            labels: List label (employee_id) cho từng vector
+            vectors: numpy array (N, dim)
+        """
+        vectors = _normalize_rows(vectors)
+        n = len(vectors)
+        if n == 0:
+            return
+
+        # Tăng capacity theo cấp số nhân để add có chi phí O(1) amortized
+        required = self._size + n
+        if required > len(self._vectors):
+            capacity = max(required, 2 * len(self._vectors), 16)
+            grown_vectors = np.empty((capacity, self.dim), dtype=np.float32)
+            grown_labels = np.empty(capacity, dtype=object)
+            grown_vectors[:self._size] = self._vectors[:self._size]
+            grown_labels[:self._size] = self._labels[:self._size]
+            self._vectors = grown_vectors
+            self._labels = grown_labels
+
+        self._vectors[self._size:required] = vectors
+        self._labels[self._size:required] = list(labels)
+        self._size = required
+
+    def remove(self, label):
+        """Xóa toàn bộ vector có label cho trước, trả về số vector đã xóa"""
+        keep = self.labels != label
+        removed = self._size - int(keep.sum())
+        if removed > 0:
+            kept = int(keep.sum())
+            self._vectors[:kept] = self.vectors[keep]
+            self._labels[:kept] = self.labels[keep]
+            self._labels[kept:self._size] = None
+            self._size = kept
+        return removed
+
+    def search(self, queries, top_k=1):
+        """
+        Tìm top-k vector gần nhất (cosine similarity)
+
+        Args:
+            queries: numpy array (N, dim)
+            top_k: Số kết quả cho mỗi query
+
+        Returns:
+            results: List (labels, similarities) cho từng query
+        """
+        queries = _normalize_rows(queries)
+        if self._size == 0:
+            return [(self._labels[:0], np.empty(0, dtype=np.float32)) for _ in queries]
+
+        similarities = queries @ self.vectors.T
+        return [_top_k(row, self.labels, top_k) for row in similarities]
+
+
+class IVFFlatIndex:
+    """
+    Inverted File index (IVF-Flat): chia gallery thành nlist cụm bằng k-means,
+    mỗi truy vấn chỉ quét nprobe cụm gần nhất. Gallery nhỏ hơn min_train_size
+    được tìm kiếm chính xác.
+    """
+
+    def __init__(self, dim=512, nlist=None, nprobe=None, min_train_size=None, seed=0):
+        self.dim = dim
+        self.nlist = nlist if nlist is not None else config.IVF_NLIST
+        self.nprobe = nprobe if nprobe is not None else config.IVF_NPROBE
+        self.min_train_size = (min_train_size if min_train_size is not None
+                               else config.ANN_MIN_GALLERY_SIZE)
+        self.seed = seed
+        self.reset()
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def reset(self):
+        """Xóa toàn bộ index (kể cả centroids)"""
+        self.centroids = None
+        self._lists = [FlatIndex(self.dim)]
+        self._label_lists = defaultdict(set)
+        self._size = 0
+
+    def add(self, labels, vectors):
+        """Thêm vector vào index (tự train k-means khi gallery đủ lớn)"""
+        labels = list(labels)
+        vectors = _normalize_rows(vectors)
+        if len(vectors) == 0:
+            return
+
+        if not self.is_trained and self._size + len(vectors) >= self.min_train_size:
+            # Gom toàn bộ dữ liệu hiện có rồi train 1 lần
+            all_labels = list(self._lists[0].labels) + labels
+            all_vectors = np.concatenate([self._lists[0].vectors, vectors])
+            self._train(all_vectors)
+            self._lists = [FlatIndex(self.dim) for _ in range(len(self.centroids))]
+            self._label_lists = defaultdict(set)
+            self._size = 0
+            labels, vectors = all_labels, all_vectors
+
+        if self.is_trained:
+            assignments = self._assign(vectors)
+        else:
+            assignments = np.zeros(len(vectors), dtype=np.int64)
+
+        # Gom nhóm theo cụm bằng 1 lần sort thay vì quét mảng cho từng cụm
+        labels = np.array(labels, dtype=object)
+        order = np.argsort(assignments, kind='stable')
+        list_ids, starts = np.unique(assignments[order], return_index=True)
+        for list_id, members in zip(list_ids, np.split(order, starts[1:])):
+            self._lists[list_id].add(labels[members], vectors[members])
+            for label in labels[members]:
+                self._label_lists[label].add(int(list_id))
+        self._size += len(vectors)
+
+    def remove(self, label):
+        """Xóa toàn bộ vector có label cho trước"""
+        removed = 0
+        for list_id in self._label_lists.pop(label, ()):
+            removed += self._lists[list_id].remove(label)
+        self._size -= removed
+        return removed
+
+    def search(self, queries, top_k=1):
+        """Tìm top-k vector gần nhất, quét nprobe cụm cho mỗi query"""
+        queries = _normalize_rows(queries)
+        exact = not self.is_trained or self._size < self.min_train_size
+        if exact:
+            probes = np.tile(np.arange(len(self._lists)), (len(queries), 1))
+        else:
+            nprobe = min(self.nprobe, len(self.centroids))
+            centroid_sims = queries @ self.centroids.T
+            probes = np.argpartition(-centroid_sims, nprobe - 1, axis=1)[:, :nprobe]
+
+        results = []
+        for query, probe in zip(queries, probes):
+            sims_parts = []
+            label_parts = []
+            for list_id in probe:
+                inv_list = self._lists[list_id]
+                if len(inv_list) == 0:
+                    continue
+                sims_parts.append(inv_list.vectors @ query)
+                label_parts.append(inv_list.labels)
+
+            if not sims_parts:
+                results.append((np.empty(0, dtype=object), np.empty(0, dtype=np.float32)))
+                continue
+            results.append(_top_k(np.concatenate(sims_parts), np.concatenate(label_parts), top_k))
+        return results
+
+    def _assign(self, vectors, chunk_size=65536):
+        """Gán mỗi vector vào centroid gần nhất (chia chunk để giới hạn bộ nhớ)"""
+        assignments = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), chunk_size):
+            chunk = vectors[start:start + chunk_size]
+            assignments[start:start + chunk_size] = np.argmax(chunk @ self.centroids.T, axis=1)
+        return assignments
+
+    def _train(self, vectors, n_iter=10, max_train_points=64):
+        """Spherical k-means trên 1 mẫu con của gallery"""
+        rng = np.random.default_rng(self.seed)
+        nlist = self.nlist or int(np.sqrt(len(vectors)))
+        nlist = max(1, min(nlist, len(vectors)))
+
+        sample_size = min(len(vectors), nlist * max_train_points)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        self.centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+        for _ in range(n_iter):
+            assignments = self._assign(sample)
+            order = np.argsort(assignments, kind='stable')
+            counts = np.bincount(assignments, minlength=nlist)
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            sums = np.zeros_like(self.centroids)
+            non_empty = counts > 0
+            sums[non_empty] = np.add.reduceat(sample[order], starts[non_empty], axis=0)
+
+            # Cụm rỗng: khởi tạo lại bằng 1 điểm ngẫu nhiên
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(sample_size, int(empty.sum()), replace=False)]
+            self.centroids = _normalize_rows(sums)
+
+        print(f"✅ Trained IVF index: {nlist} lists on {sample_size} vectors")
+
+
+def create_index(index_type=None, dim=512):
+    """
+    Tạo index theo cấu hình
+
+    Args:
+        index_type: "flat" (chính xác) hoặc "ivf"/"auto" (IVF-Flat, tự fallback
+                    sang tìm kiếm chính xác khi gallery nhỏ)
+    """
+    index_type = index_type or config.FACE_INDEX_TYPE
+    if index_type == "flat":
+        return FlatIndex(dim)
+    if index_type in ("ivf", "auto"):
+        return IVFFlatIndex(dim)
+    raise ValueError(f"Unknown face index type: {index_type}")
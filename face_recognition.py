@@ -11,28 +11,32 @@ from PIL import Image
 from facenet_pytorch import MTCNN, InceptionResnetV1
 import config
 import pymongo
+from database import decode_embedding, embedding_document, embedding_model_version, resolve_face_alignment
+from face_index import create_index
 
 #Kết nối MongoDB
 client = pymongo.MongoClient("mongodb://localhost:27017/")
 db = client["face_db"]
 col = db["faces"]
 
+# Vị trí chuẩn của 5 landmarks MTCNN trên ảnh 112x112, scale theo kích thước đầu vào FaceNet
+REFERENCE_LANDMARKS = np.array(config.FACE_TEMPLATE_LANDMARKS, dtype=np.float32) * (config.FACENET_IMAGE_SIZE / 112.0)
+
 class FaceRecognizer:
     def delete_all_employees(self):
         """Xóa toàn bộ dữ liệu nhân viên khỏi RAM và MongoDB"""
         self.known_embeddings = {}
         self.known_names = {}
+        self._rebuild_gallery()
         col.delete_many({})
         print("Đã xóa toàn bộ dữ liệu nhân viên khỏi hệ thống.")
     def delete_employee(self, employee_id):
-        """Xóa dữ liệu nhân viên khỏi RAM và MongoDB"""
-        # Xóa khỏi RAM
+        """Xóa dữ liệu nhân viên khỏi RAM (lưu trữ: DatabaseManager.delete_face_embedding)"""
         if employee_id in self.known_embeddings:
             del self.known_embeddings[employee_id]
         if employee_id in self.known_names:
             del self.known_names[employee_id]
-        # Xóa trên MongoDB
-        col.delete_one({"employee_id": employee_id})
+        self.face_index.remove(employee_id)
         print(f"Đã xóa nhân viên {employee_id} khỏi hệ thống.")
     """Class nhận diện khuôn mặt sử dụng MTCNN và FaceNet"""
     
@@ -61,22 +65,36 @@ class FaceRecognizer:
         
         # Dictionary lưu face embeddings
         self.known_embeddings = {}
-        self.known_names = {} 
+        self.known_names = {}
+        
+        # Index tìm kiếm: embeddings đã L2-normalize (float32) kèm employee_id,
+        # tìm chính xác cho gallery nhỏ, IVF-Flat cho gallery lớn
+        self.face_index = create_index()
+        self._max_templates = 1  # Số template lớn nhất của 1 nhân viên trong index
 
     def save_face_to_mongodb(self, employee_id, name, embedding):
-        doc = {
-            "employee_id": employee_id,
-            "name": name,
-            "embedding": embedding.tolist()  # numpy array -> list
-        }
-        col.replace_one({"employee_id": employee_id}, doc, upsert=True)
+        # 1 document cho mỗi nhân viên, chứa toàn bộ templates (T, 512) dạng float32 nhị phân
+        col.replace_one({"employee_id": employee_id}, embedding_document(employee_id, embedding, name), upsert=True)
         print(f"Đã lưu khuôn mặt {name} vào MongoDB.")
 
     def load_all_embeddings_from_mongodb(self):
+        self.known_embeddings = {}
+        self.known_names = {}
+        skipped = []
         faces = list(col.find({}))
-        self.known_embeddings = {f["employee_id"]: np.array(f["embedding"]) for f in faces}
-        self.known_names = {f["employee_id"]: f["name"] for f in faces}
+        resolve_face_alignment({embedding_model_version(f) for f in faces})
+        for f in faces:
+            # Document cũ chưa có tag được coi là LEGACY_EMBEDDING_MODEL_VERSION
+            embedding = decode_embedding(f)
+            if embedding is None:
+                skipped.append(f["employee_id"])
+                continue
+            self.known_embeddings[f["employee_id"]] = embedding
+            self.known_names[f["employee_id"]] = f["name"]
+        self._rebuild_gallery()
         print(f"Đã tải {len(self.known_embeddings)} khuôn mặt từ MongoDB.")
+        if skipped:
+            print(f"⚠️ {len(skipped)} nhân viên cần đăng ký lại (embeddings của model khác): {', '.join(skipped)}")
     def detect_faces(self, image):
         """
         Phát hiện khuôn mặt trong ảnh sử dụng MTCNN
@@ -111,14 +129,15 @@ class FaceRecognizer:
         
         # Extract and align faces
         faces = []
-        for box in boxes:
+        kept = []
+        for i, box in enumerate(boxes):
             x1, y1, x2, y2 = [int(b) for b in box]
             
             # Kiểm tra box hợp lệ
             if x2 <= x1 or y2 <= y1:
                 continue
                 
-            face = image_rgb[y1:y2, x1:x2]
+            face = image_rgb[max(y1, 0):y2, max(x1, 0):x2]
             
             # Kiểm tra face không rỗng
             if face.size == 0 or face.shape[0] == 0 or face.shape[1] == 0:
@@ -127,9 +146,157 @@ class FaceRecognizer:
             # Resize to FaceNet input size
             face = cv2.resize(face, (config.FACENET_IMAGE_SIZE, config.FACENET_IMAGE_SIZE))
             faces.append(face)
+            kept.append(i)
+        
+        if len(faces) == 0:
+            return None, None, None, None
+        
+        # Giữ boxes/probs/landmarks song song với faces
+        boxes = boxes[kept]
+        probs = probs[kept]
+        if landmarks is not None:
+            landmarks = landmarks[kept]
         
         return faces, boxes, probs, landmarks
     
+    def detect_faces_aligned(self, image):
+        """
+        Phát hiện khuôn mặt và căn chỉnh theo 5 landmarks trong 1 lượt
+        
+        Args:
+            image: numpy array (BGR format from OpenCV)
+        
+        Returns:
+            faces: numpy array (N, 160, 160, 3) RGB uint8 đã căn chỉnh (cho liveness/đăng ký)
+            face_tensor: torch tensor (N, 3, 160, 160) đã normalize, đưa thẳng vào FaceNet
+            boxes: List of bounding boxes [x1, y1, x2, y2]
+            probs: List of confidence scores
+            landmarks: 5 landmarks của từng khuôn mặt (tọa độ trên ảnh gốc)
+        """
+        return self.detect_faces_aligned_batch([image])[0]
+    
+    def detect_faces_aligned_batch(self, images):
+        """
+        Phát hiện + căn chỉnh khuôn mặt cho nhiều ảnh (ví dụ từ nhiều camera)
+        Ảnh cùng kích thước được đưa vào MTCNN trong 1 batch
+        
+        Args:
+            images: List numpy array (BGR format from OpenCV)
+        
+        Returns:
+            results: List (faces, face_tensor, boxes, probs, landmarks) cho từng ảnh,
+                     giống detect_faces_aligned
+        """
+        if len(images) == 0:
+            return []
+        
+        # Convert BGR to RGB
+        images_rgb = [cv2.cvtColor(image, cv2.COLOR_BGR2RGB) for image in images]
+        
+        # Detect faces: 1 lần MTCNN cho mỗi nhóm ảnh cùng kích thước
+        detections = [None] * len(images_rgb)
+        groups = {}
+        for i, image_rgb in enumerate(images_rgb):
+            groups.setdefault(image_rgb.shape, []).append(i)
+        for indices in groups.values():
+            if len(indices) == 1:
+                boxes, probs, landmarks = self.mtcnn.detect(images_rgb[indices[0]], landmarks=True)
+                detections[indices[0]] = (boxes, probs, landmarks)
+                continue
+            
+            batch_boxes, batch_probs, batch_landmarks = self.mtcnn.detect(
+                np.stack([images_rgb[i] for i in indices]), landmarks=True
+            )
+            for j, i in enumerate(indices):
+                detections[i] = (batch_boxes[j], batch_probs[j], batch_landmarks[j])
+        
+        # Lọc theo confidence và căn chỉnh từng ảnh
+        per_image = []
+        for image_rgb, (boxes, probs, landmarks) in zip(images_rgb, detections):
+            if boxes is None or landmarks is None:
+                per_image.append(None)
+                continue
+            
+            # Filter faces with confidence > threshold
+            valid_indices = np.asarray(probs, dtype=np.float32) > config.MIN_CONFIDENCE
+            boxes = np.asarray(boxes)[valid_indices]
+            probs = np.asarray(probs)[valid_indices]
+            landmarks = np.asarray(landmarks)[valid_indices]
+            
+            if len(boxes) == 0:
+                per_image.append(None)
+                continue
+            
+            per_image.append((self.align_faces(image_rgb, landmarks), boxes, probs, landmarks))
+        
+        # Normalize toàn bộ khuôn mặt của mọi ảnh trong 1 lần, rồi chia lại theo ảnh
+        all_faces = [item[0] for item in per_image if item is not None]
+        if all_faces:
+            face_tensor = self.faces_to_tensor(np.concatenate(all_faces))
+        
+        results = []
+        offset = 0
+        for item in per_image:
+            if item is None:
+                results.append((None, None, None, None, None))
+                continue
+            faces, boxes, probs, landmarks = item
+            results.append((faces, face_tensor[offset:offset + len(faces)], boxes, probs, landmarks))
+            offset += len(faces)
+        
+        return results
+    
+    def align_faces(self, image_rgb, landmarks):
+        """
+        Căn chỉnh khuôn mặt bằng similarity transform từ 5 landmarks
+        
+        Args:
+            image_rgb: Ảnh gốc (RGB)
+            landmarks: numpy array (N, 5, 2)
+        
+        Returns:
+            faces: numpy array (N, 160, 160, 3) uint8
+        """
+        size = config.FACENET_IMAGE_SIZE
+        faces = np.empty((len(landmarks), size, size, 3), dtype=np.uint8)
+        
+        for i, points in enumerate(landmarks):
+            # Similarity transform (xoay + scale + tịnh tiến) khớp landmarks với template
+            matrix, _ = cv2.estimateAffinePartial2D(
+                np.asarray(points, dtype=np.float32), REFERENCE_LANDMARKS, method=cv2.LMEDS
+            )
+            if matrix is None:
+                # Landmarks suy biến: dùng scale + tịnh tiến theo tâm 2 mắt
+                matrix = self._fallback_alignment(points)
+            
+            # Warp trực tiếp vào buffer đầu ra, không tạo bản sao trung gian
+            cv2.warpAffine(image_rgb, matrix, (size, size), dst=faces[i],
+                           borderMode=cv2.BORDER_CONSTANT)
+        
+        return faces
+    
+    def _fallback_alignment(self, points):
+        """Ma trận affine đơn giản khi estimateAffinePartial2D thất bại"""
+        points = np.asarray(points, dtype=np.float32)
+        eye_center = points[:2].mean(axis=0)
+        ref_eye_center = REFERENCE_LANDMARKS[:2].mean(axis=0)
+        eye_dist = np.linalg.norm(points[0] - points[1])
+        ref_eye_dist = np.linalg.norm(REFERENCE_LANDMARKS[0] - REFERENCE_LANDMARKS[1])
+        scale = ref_eye_dist / max(eye_dist, 1e-6)
+        tx, ty = ref_eye_center - scale * eye_center
+        return np.array([[scale, 0, tx], [0, scale, ty]], dtype=np.float32)
+    
+    def faces_to_tensor(self, faces):
+        """
+        Chuyển batch ảnh khuôn mặt uint8 (N, H, W, 3) thành tensor đã normalize
+        (cùng chuẩn hóa với fixed_image_standardization của facenet-pytorch)
+        """
+        batch = np.ascontiguousarray(np.asarray(faces, dtype=np.uint8))
+        # Copy uint8 sang device trước rồi mới chuyển float (ít dữ liệu hơn 4 lần)
+        face_tensor = torch.from_numpy(batch).to(self.device)
+        face_tensor = face_tensor.permute(0, 3, 1, 2).float()
+        return face_tensor.sub_(127.5).div_(128.0)
+    
     def get_embedding(self, face_image):
         """
         Trích xuất face embedding từ ảnh khuôn mặt
@@ -140,16 +307,36 @@ class FaceRecognizer:
         Returns:
             embedding: 512-dimensional vector
         """
-        # Convert to tensor
-        face_tensor = torch.from_numpy(face_image).permute(2, 0, 1).float()
-        face_tensor = (face_tensor - 127.5) / 128.0  # Normalize
-        face_tensor = face_tensor.unsqueeze(0).to(self.device)
+        return self.get_embeddings_batch([face_image])[0]
+    
+    def get_embeddings_batch(self, face_images):
+        """
+        Trích xuất embeddings cho nhiều khuôn mặt bằng 1 lần forward
         
-        # Get embedding
+        Args:
+            face_images: List các ảnh khuôn mặt (RGB, cùng kích thước) hoặc
+                         tensor (N, 3, H, W) đã normalize từ detect_faces_aligned
+        
+        Returns:
+            embeddings: numpy array (N, 512)
+        """
+        if len(face_images) == 0:
+            return np.empty((0, 512), dtype=np.float32)
+        
+        if isinstance(face_images, torch.Tensor):
+            face_tensor = face_images.to(self.device)
+        elif isinstance(face_images[0], torch.Tensor):
+            # List các tensor (3, H, W) từ nhiều frame/camera
+            face_tensor = torch.stack(list(face_images)).to(self.device)
+        else:
+            # Stack toàn bộ crops thành 1 tensor (N, 3, H, W)
+            face_tensor = self.faces_to_tensor(np.stack(face_images))
+        
+        # Get embeddings
         with torch.no_grad():
-            embedding = self.facenet(face_tensor)
+            embeddings = self.facenet(face_tensor)
         
-        return embedding.cpu().numpy()[0]
+        return embeddings.cpu().numpy()
     
     def register_face(self, employee_id, name, face_images):
         """
@@ -163,21 +350,18 @@ class FaceRecognizer:
         Returns:
             success: True nếu đăng ký thành công
         """
-        embeddings = []
-        
-        for face_image in face_images:
-            embedding = self.get_embedding(face_image)
-            embeddings.append(embedding)
-        
-        # Tính embedding trung bình
-        avg_embedding = np.mean(embeddings, axis=0)
-        #Lưu vào MongoDB
-        self.save_face_to_mongodb(employee_id, name, avg_embedding)
-        # Lưu vào dictionary
-        self.known_embeddings[employee_id] = avg_embedding
+        embeddings = self.get_embeddings_batch(face_images)
+        
+        # Giữ từng template theo góc mặt thay vì lấy trung bình (giữ độ phủ tư thế)
+        templates = self._select_templates(embeddings, config.MAX_TEMPLATES_PER_PERSON)
+        # Lưu vào dictionary (lưu trữ: DatabaseManager.save_face_embedding)
+        self.known_embeddings[employee_id] = templates
         self.known_names[employee_id] = name
+        self.face_index.remove(employee_id)
+        self.face_index.add([employee_id] * len(templates), templates)
+        self._max_templates = max(self._max_templates, len(templates))
         
-        print(f"✅ Registered face for {name} (ID: {employee_id})")
+        print(f"✅ Registered face for {name} (ID: {employee_id}, {len(templates)} templates)")
         return True
     
     def recognize_face(self, face_image):
@@ -192,35 +376,162 @@ class FaceRecognizer:
             name: Tên nhân viên (hoặc "Unknown")
             distance: Khoảng cách Euclidean
         """
-        if len(self.known_embeddings) == 0:
-            return None, "Unknown", 1.0
+        return self.recognize_faces_batch([face_image])[0]
+    
+    def recognize_faces_batch(self, face_images):
+        """
+        Nhận diện nhiều khuôn mặt trong cùng 1 frame
         
-        # Get embedding của khuôn mặt cần nhận diện
-        embedding = self.get_embedding(face_image)
+        Args:
+            face_images: List các ảnh khuôn mặt (RGB format) hoặc tensor đã normalize
+        
+        Returns:
+            results: List (employee_id, name, distance) theo thứ tự đầu vào
+        """
+        if len(face_images) == 0:
+            return []
         
-        # So sánh với tất cả embeddings đã lưu
-        min_distance = float('inf')
-        best_match_id = None
+        if len(self.face_index) == 0:
+            return [(None, "Unknown", 1.0) for _ in face_images]
         
-        for employee_id, known_embedding in self.known_embeddings.items():
-            # Tính Euclidean distance
-            distance = np.linalg.norm(embedding - known_embedding)
+        # 1 lần forward cho tất cả khuôn mặt
+        return self.identify_embeddings(self.get_embeddings_batch(face_images))
+    
+    def identify_embeddings(self, embeddings):
+        """
+        Nhận diện từ embeddings đã tính sẵn (ví dụ từ inference worker process)
+        
+        Args:
+            embeddings: numpy array (N, 512)
+        
+        Returns:
+            results: List (employee_id, name, distance) theo thứ tự đầu vào
+        """
+        if len(embeddings) == 0:
+            return []
+        
+        if len(self.face_index) == 0:
+            return [(None, "Unknown", 1.0) for _ in embeddings]
+        
+        matches = self.search_gallery_batch(embeddings, top_k=1)
+        
+        results = []
+        for ids, distances in matches:
+            if len(ids) == 0:
+                results.append((None, "Unknown", 1.0))
+                continue
             
-            if distance < min_distance:
-                min_distance = distance
-                best_match_id = employee_id
-        
-        # Kiểm tra threshold
-        if min_distance < config.FACE_RECOGNITION_THRESHOLD:
-            name = self.known_names.get(best_match_id, "Unknown")
-            return best_match_id, name, min_distance
-        else:
-            return None, "Unknown", min_distance
+            best_match_id = ids[0]
+            min_distance = distances[0]
+            
+            # Kiểm tra threshold
+            if min_distance < config.FACE_RECOGNITION_THRESHOLD:
+                name = self.known_names.get(best_match_id, "Unknown")
+                results.append((best_match_id, name, min_distance))
+            else:
+                results.append((None, "Unknown", min_distance))
+        
+        return results
+    
+    def search_gallery(self, embedding, top_k=1):
+        """
+        Tìm top-k nhân viên gần nhất trong gallery
+        
+        Args:
+            embedding: Vector embedding 512 chiều
+            top_k: Số kết quả trả về
+        
+        Returns:
+            ids: List employee_id, sắp xếp theo khoảng cách tăng dần
+            distances: List khoảng cách Euclidean tương ứng
+        """
+        return self.search_gallery_batch(np.atleast_2d(embedding), top_k)[0]
+    
+    def search_gallery_batch(self, embeddings, top_k=1):
+        """
+        Tìm top-k cho nhiều embedding cùng lúc (1 phép nhân ma trận)
+        
+        Args:
+            embeddings: numpy array (N, 512)
+            top_k: Số kết quả trả về cho mỗi embedding
+        
+        Returns:
+            matches: List (ids, distances) cho từng embedding
+        """
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        
+        # Lấy đủ hàng để còn top_k nhân viên khác nhau sau khi gộp template
+        candidates = self.face_index.search(queries, top_k * self._max_templates)
+        
+        matches = []
+        for labels, similarities in candidates:
+            # Kết quả đã sắp xếp giảm dần -> lần xuất hiện đầu tiên của mỗi
+            # employee_id chính là max-similarity trên các template của người đó
+            if len(labels) > 0:
+                _, first = np.unique(labels, return_index=True)
+                best = np.sort(first)[:top_k]
+                labels, similarities = labels[best], similarities[best]
+            
+            # Với vector đơn vị: ||a - b||^2 = 2 - 2 * <a, b>
+            distances = np.sqrt(np.maximum(2.0 - 2.0 * similarities, 0.0))
+            matches.append((list(labels), [float(d) for d in distances]))
+        return matches
+    
+    def _rebuild_gallery(self):
+        """Dựng lại face_index từ known_embeddings"""
+        self.face_index.reset()
+        self._max_templates = 1
+        if len(self.known_embeddings) == 0:
+            return
+        
+        # Mỗi nhân viên có thể có nhiều template -> nhiều hàng cùng employee_id
+        self.known_embeddings = {
+            emp_id: self._as_templates(emb) for emp_id, emb in self.known_embeddings.items()
+        }
+        ids = []
+        for emp_id, templates in self.known_embeddings.items():
+            ids.extend([emp_id] * len(templates))
+            self._max_templates = max(self._max_templates, len(templates))
+        self.face_index.add(ids, np.concatenate(list(self.known_embeddings.values())))
+    
+    @staticmethod
+    def _as_templates(embedding):
+        """Chuẩn hóa embedding đã lưu về ma trận templates (T, 512) float32"""
+        # Dữ liệu cũ lưu 1 vector trung bình (512,) -> coi như 1 template
+        return np.atleast_2d(np.asarray(embedding, dtype=np.float32))
+    
+    @staticmethod
+    def _select_templates(embeddings, max_templates):
+        """
+        Chọn tối đa max_templates template đa dạng nhất (farthest-point sampling)
+        
+        Args:
+            embeddings: numpy array (N, 512)
+            max_templates: Số template tối đa (0 = giữ tất cả)
+        
+        Returns:
+            templates: numpy array (T, 512) float32
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if max_templates <= 0 or len(embeddings) <= max_templates:
+            return embeddings
+        
+        # Bắt đầu từ template gần trung bình nhất, sau đó lần lượt thêm
+        # template xa nhất so với tập đã chọn
+        selected = [int(np.argmin(np.linalg.norm(embeddings - embeddings.mean(axis=0), axis=1)))]
+        min_dist = np.linalg.norm(embeddings - embeddings[selected[0]], axis=1)
+        while len(selected) < max_templates:
+            next_idx = int(np.argmax(min_dist))
+            selected.append(next_idx)
+            min_dist = np.minimum(min_dist, np.linalg.norm(embeddings - embeddings[next_idx], axis=1))
+        
+        return embeddings[sorted(selected)]
     
     def load_embeddings(self, embeddings_dict):
         """Load face embeddings từ database"""
         self.known_embeddings = embeddings_dict.get('embeddings', {})
         self.known_names = embeddings_dict.get('names', {})
+        self._rebuild_gallery()
         print(f"✅ Loaded {len(self.known_embeddings)} face embeddings")
     
     def save_embeddings(self):
@@ -270,6 +581,7 @@ class FaceRecognizer:
         """Xóa toàn bộ dữ liệu khuôn mặt trong RAM"""
         self.known_embeddings = {}
         self.known_names = {}
+        self._rebuild_gallery()
         print("Đã xóa toàn bộ dữ liệu khuôn mặt trong RAM.")
 
 
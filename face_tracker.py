@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Module theo dõi khuôn mặt giữa các frame (IoU + landmark motion)
+Lightweight Multi-Face Tracker Module
+"""
+
+import itertools
+
+import numpy as np
+
+import config
+
+
+def box_iou(boxes_a, boxes_b):
+    """
+    Tính ma trận IoU giữa 2 tập bounding boxes
+
+    Args:
+        boxes_a: numpy array (N, 4) [x1, y1, x2, y2]
+        boxes_b: numpy array (M, 4)
+
+    Returns:
+        iou: numpy array (N, M)
+    """
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+
+    x1 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y1 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x2 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y2 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return intersection / np.maximum(union, 1e-6)
+
+
+class Track:
+    """Trạng thái của 1 khuôn mặt được theo dõi"""
+
+    def __init__(self, track_id, box, landmarks):
+        self.track_id = track_id
+        self.box = np.asarray(box, dtype=np.float32)
+        self.landmarks = None if landmarks is None else np.asarray(landmarks, dtype=np.float32)
+        self.hits = 1
+        self.missed = 0
+
+        # Kết quả nhận diện + liveness được cache cho cả track
+        self.employee_id = None
+        self.name = "Unknown"
+        self.distance = 1.0
+        self.is_real = None
+        self.liveness_score = None
+        self.liveness_confidence = None
+        self.confidence = 0.0
+        self.identified_box = None
+        self.pending = False  # Đang chờ kết quả nhận diện (pipeline nhiều luồng)
+
+    @property
+    def is_identified(self):
+        return self.identified_box is not None
+
+    @property
+    def center(self):
+        return (self.box[:2] + self.box[2:]) / 2.0
+
+    @property
+    def size(self):
+        return max(float(self.box[2] - self.box[0]), float(self.box[3] - self.box[1]), 1.0)
+
+
+class FaceTracker:
+    """
+    Tracker nhiều khuôn mặt: ghép detection với track cũ theo IoU của box
+    và độ dịch chuyển landmarks, giữ track id ổn định giữa các frame
+    """
+
+    def __init__(self, iou_threshold=None, max_missed=None):
+        self.iou_threshold = iou_threshold if iou_threshold is not None else config.TRACKER_IOU_THRESHOLD
+        self.max_missed = max_missed if max_missed is not None else config.TRACKER_MAX_MISSED
+        self.tracks = {}
+        self._next_id = itertools.count(1)
+
+    def reset(self):
+        """Xóa toàn bộ track"""
+        self.tracks = {}
+
+    def update(self, boxes, landmarks=None):
+        """
+        Cập nhật tracker với các detection của frame hiện tại
+
+        Args:
+            boxes: List bounding boxes [x1, y1, x2, y2] (có thể None)
+            landmarks: 5 landmarks MTCNN cho từng box (có thể None)
+
+        Returns:
+            tracks: List Track tương ứng thứ tự với boxes
+        """
+        if boxes is None or len(boxes) == 0:
+            self._age_unmatched(set())
+            return []
+
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        if landmarks is None:
+            landmarks = [None] * len(boxes)
+
+        track_ids = list(self.tracks.keys())
+        assigned = [None] * len(boxes)
+
+        if track_ids:
+            scores = self._match_scores([self.tracks[t] for t in track_ids], boxes, landmarks)
+
+            # Ghép tham lam theo điểm cao nhất (số mặt mỗi frame nhỏ)
+            for flat_idx in np.argsort(-scores, axis=None):
+                t_idx, d_idx = np.unravel_index(flat_idx, scores.shape)
+                if scores[t_idx, d_idx] < self.iou_threshold:
+                    break
+                if assigned[d_idx] is not None or track_ids[t_idx] is None:
+                    continue
+                assigned[d_idx] = track_ids[t_idx]
+                track_ids[t_idx] = None
+
+        matched = set()
+        tracks = []
+        for d_idx, track_id in enumerate(assigned):
+            if track_id is None:
+                track = Track(next(self._next_id), boxes[d_idx], landmarks[d_idx])
+                self.tracks[track.track_id] = track
+            else:
+                track = self.tracks[track_id]
+                track.box = boxes[d_idx]
+                if landmarks[d_idx] is not None:
+                    track.landmarks = np.asarray(landmarks[d_idx], dtype=np.float32)
+                track.hits += 1
+                track.missed = 0
+                # Độ tin cậy danh tính giảm dần theo thời gian
+                track.confidence *= config.TRACKER_CONFIDENCE_DECAY
+            matched.add(track.track_id)
+            tracks.append(track)
+
+        self._age_unmatched(matched)
+        return tracks
+
+    def _match_scores(self, tracks, boxes, landmarks):
+        """Điểm ghép = IoU trừ phạt dịch chuyển landmarks (chuẩn hóa theo kích thước mặt)"""
+        scores = box_iou(np.stack([t.box for t in tracks]), boxes)
+
+        for t_idx, track in enumerate(tracks):
+            if track.landmarks is None:
+                continue
+            for d_idx, points in enumerate(landmarks):
+                if points is None or scores[t_idx, d_idx] <= 0:
+                    continue
+                motion = np.linalg.norm(np.asarray(points) - track.landmarks, axis=1).mean()
+                scores[t_idx, d_idx] -= config.TRACKER_LANDMARK_WEIGHT * motion / track.size
+        return scores
+
+    def _age_unmatched(self, matched):
+        """Tăng bộ đếm missed, xóa track mất dấu quá lâu"""
+        for track_id in list(self.tracks.keys()):
+            if track_id in matched:
+                continue
+            track = self.tracks[track_id]
+            track.missed += 1
+            if track.missed > self.max_missed:
+                del self.tracks[track_id]
+
+    def needs_identification(self, track):
+        """
+        Track cần chạy lại liveness + nhận diện khi: track mới, độ tin cậy
+        đã giảm dưới ngưỡng, hoặc khuôn mặt đã di chuyển nhiều
+        """
+        if track.pending:
+            return False
+        if not track.is_identified:
+            return True
+        if track.confidence < config.TRACKER_MIN_CONFIDENCE:
+            return True
+
+        identified_center = (track.identified_box[:2] + track.identified_box[2:]) / 2.0
+        displacement = np.linalg.norm(track.center - identified_center)
+        return bool(displacement > config.TRACKER_REID_MOTION * track.size)
+
+    def mark_pending(self, track):
+        """Đánh dấu track đã được gửi đi nhận diện, tránh gửi trùng"""
+        track.pending = True
+
+    def invalidate(self, track):
+        """Buộc track chạy lại liveness + nhận diện ở frame xử lý tiếp theo"""
+        track.confidence = 0.0
+
+    def mark_inconclusive(self, track):
+        """Liveness chưa đủ bằng chứng: giữ kết quả cũ, thử lại ở frame xử lý tiếp theo"""
+        track.pending = False
+        self.invalidate(track)
+
+    def mark_identified(self, track, employee_id, name, distance, is_real=True, liveness_score=None,
+                        liveness_confidence=None):
+        """Lưu kết quả nhận diện/liveness vào track"""
+        track.pending = False
+        track.employee_id = employee_id
+        track.name = name
+        track.distance = distance
+        track.is_real = is_real
+        track.liveness_score = liveness_score
+        track.liveness_confidence = liveness_confidence
+        track.identified_box = track.box.copy()
+        # Mặt chưa nhận ra (hoặc nghi giả) được kiểm tra lại sớm hơn
+        track.confidence = 1.0 if employee_id and is_real else config.TRACKER_UNKNOWN_CONFIDENCE
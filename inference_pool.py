@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+Pool worker process cho detect + embedding
+Process-Pool Inference Module with Shared-Memory Frame Ring
+
+Mỗi worker là 1 process riêng (không tranh GIL), nạp MTCNN/FaceNet đúng 1 lần
+khi khởi động. Frame được ghi vào ring buffer trong
+multiprocessing.shared_memory, worker chỉ nhận (seq, slot) qua hàng đợi nên
+frame không bị pickle. Kết quả lấy ra theo đúng thứ tự frame đã gửi.
+
+Liveness không chạy trong worker: trạng thái blink/motion/EWMA gắn với từng
+track (tracker nằm ở process chính), nên pipeline kiểm tra liveness ở process
+chính trên các mặt worker trả về.
+"""
+
+import multiprocessing as mp
+import os
+import queue
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import config
+
+
+class SharedFrameRing:
+    """Ring buffer gồm `slots` frame cùng kích thước trong 1 block shared memory"""
+
+    def __init__(self, slots, frame_shape, dtype=np.uint8, name=None):
+        """
+        Args:
+            slots: Số frame tối đa trong ring
+            frame_shape: (H, W, C) của mọi frame
+            name: Tên block đã tồn tại (worker attach), None để tạo mới
+        """
+        self.slots = slots
+        self.frame_shape = tuple(frame_shape)
+        self.dtype = np.dtype(dtype)
+        size = slots * int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        self._owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self._owner, size=size)
+        self.buffer = np.ndarray((slots,) + self.frame_shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, slot, frame):
+        """Copy frame vào slot (1 lần memcpy, không pickle)"""
+        if frame.shape != self.frame_shape:
+            raise ValueError(f"Frame shape {frame.shape} != ring shape {self.frame_shape}")
+        np.copyto(self.buffer[slot], frame)
+
+    def read(self, slot):
+        """View (không copy) của frame trong slot"""
+        return self.buffer[slot]
+
+    def close(self):
+        del self.buffer
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+
+
+def _infer_frame(face_recognizer, frame):
+    """Detect + embedding cho mọi khuôn mặt trong 1 frame"""
+    if config.FACE_ALIGNMENT:
+        faces, face_tensor, boxes, probs, landmarks = face_recognizer.detect_faces_aligned(frame)
+    else:
+        faces, boxes, probs, landmarks = face_recognizer.detect_faces(frame)
+        face_tensor = None
+
+    if faces is None:
+        return None
+
+    embeddings = face_recognizer.get_embeddings_batch(face_tensor if face_tensor is not None else faces)
+
+    return {
+        'faces': np.asarray(faces, dtype=np.uint8),
+        'boxes': boxes,
+        'probs': probs,
+        'landmarks': landmarks,
+        'embeddings': embeddings
+    }
+
+
+def _worker_main(worker_id, ring_name, slots, frame_shape, task_queue, result_queue, num_threads,
+                 face_alignment):
+    """Vòng lặp của 1 worker process: nạp model 1 lần rồi xử lý task đến khi nhận None"""
+    import cv2
+    import torch
+
+    # Chế độ căn chỉnh đã quyết định ở process chính (FACE_ALIGNMENT = "auto")
+    config.FACE_ALIGNMENT = face_alignment
+
+    # Mỗi worker dùng ít thread để N worker không tranh nhau CPU
+    torch.set_num_threads(num_threads)
+    cv2.setNumThreads(num_threads)
+
+    from face_recognition import FaceRecognizer
+
+    face_recognizer = FaceRecognizer()
+    ring = SharedFrameRing(slots, frame_shape, name=ring_name)
+    result_queue.put(('ready', worker_id, None))
+
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+
+            seq, slot = task
+            try:
+                result = _infer_frame(face_recognizer, ring.read(slot))
+                result_queue.put(('result', seq, result))
+            except Exception as e:
+                result_queue.put(('error', seq, f"worker {worker_id}: {e}"))
+    finally:
+        ring.close()
+
+
+class InferencePool:
+    """
+    Pool worker process dùng chung 1 ring buffer frame
+
+    Mỗi frame đang xử lý giữ 1 slot của ring, slot được trả khi lấy kết quả
+    (hoặc khi kết quả về muộn bị bỏ).
+    """
+
+    def __init__(self, num_workers=None, frame_shape=None, slots=None, num_threads=None, timeout=None):
+        """
+        Args:
+            num_workers: Số worker process (0/None = cpu_count // 2)
+            frame_shape: (H, W, 3) của frame gửi vào pool
+            slots: Số slot của ring (None = 2 * num_workers)
+            num_threads: Số thread torch/OpenCV mỗi worker
+            timeout: Số giây tối đa chờ kết quả 1 frame
+        """
+        self.num_workers = num_workers or config.INFERENCE_WORKERS or max(1, (os.cpu_count() or 2) // 2)
+        self.frame_shape = tuple(frame_shape or (config.CAMERA_HEIGHT, config.CAMERA_WIDTH, 3))
+        self.slots = slots or 2 * self.num_workers
+        self.num_threads = num_threads or config.INFERENCE_WORKER_THREADS
+        self.timeout = timeout or config.INFERENCE_TIMEOUT
+
+        self.ring = None
+        self.workers = []
+        self._task_queue = None
+        self._result_queue = None
+        self._collector = None
+
+        self._lock = threading.Condition()
+        self._free_slots = queue.Queue()
+        self._inflight = {}    # seq -> slot
+        self._results = {}     # seq -> (status, payload)
+        self._discarded = set()
+        self._next_seq = 0
+
+    @property
+    def is_running(self):
+        return bool(self.workers)
+
+    def start(self, startup_timeout=300):
+        """Tạo ring buffer, khởi động worker và chờ tất cả nạp model xong"""
+        if self.is_running:
+            return
+
+        ctx = mp.get_context('spawn')  # An toàn với torch/CUDA
+        self.ring = SharedFrameRing(self.slots, self.frame_shape)
+        self._task_queue = ctx.Queue()
+        self._result_queue = ctx.Queue()
+        self._free_slots = queue.Queue()
+        for slot in range(self.slots):
+            self._free_slots.put(slot)
+
+        for worker_id in range(self.num_workers):
+            worker = ctx.Process(
+                target=_worker_main, name=f"inference-worker-{worker_id}", daemon=True,
+                args=(worker_id, self.ring.name, self.slots, self.frame_shape, self._task_queue,
+                      self._result_queue, self.num_threads, config.FACE_ALIGNMENT)
+            )
+            worker.start()
+            self.workers.append(worker)
+
+        try:
+            for _ in range(self.num_workers):
+                self._result_queue.get(timeout=startup_timeout)
+        except queue.Empty:
+            self.shutdown()
+            raise RuntimeError("Inference workers failed to start")
+
+        self._collector = threading.Thread(target=self._collect_loop, name="inference-collector", daemon=True)
+        self._collector.start()
+        print(f"✅ Inference pool started ({self.num_workers} workers, {self.slots} frame slots)")
+
+    def shutdown(self):
+        """Dừng worker, giải phóng shared memory"""
+        for _ in self.workers:
+            self._task_queue.put(None)
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+
+        if self._collector is not None:
+            self._result_queue.put(('stop', None, None))
+            self._collector.join(timeout=2)
+            self._collector = None
+
+        with self._lock:
+            self._inflight = {}
+            self._results = {}
+            self._discarded = set()
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+    def submit(self, frame):
+        """
+        Ghi frame vào ring và gửi cho worker
+
+        Returns:
+            seq: Số thứ tự dùng để lấy kết quả bằng result()
+        """
+        # Chờ slot trống (backpressure khi worker xử lý không kịp)
+        slot = self._free_slots.get(timeout=self.timeout)
+        self.ring.write(slot, frame)
+
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._inflight[seq] = slot
+
+        self._task_queue.put((seq, slot))
+        return seq
+
+    def result(self, seq):
+        """
+        Chờ kết quả của frame seq
+
+        Returns:
+            result: Dictionary (faces, boxes, probs, landmarks, embeddings)
+                    hoặc None nếu không có khuôn mặt / worker lỗi / quá thời gian
+        """
+        with self._lock:
+            ready = self._lock.wait_for(lambda: seq in self._results, timeout=self.timeout)
+            if not ready:
+                # Kết quả về muộn sẽ được bỏ qua và trả slot
+                self._discarded.add(seq)
+                print(f"⚠️ Inference timeout for frame {seq}")
+                return None
+            status, payload = self._results.pop(seq)
+            self._release_task(seq)
+
+        if status == 'error':
+            print(f"⚠️ Inference failed: {payload}")
+            return None
+        return payload
+
+    def discard_pending(self):
+        """Bỏ kết quả của mọi frame đang xử lý (khi pipeline dừng)"""
+        with self._lock:
+            for seq in list(self._inflight.keys()):
+                if seq in self._results:
+                    self._results.pop(seq)
+                    self._release_task(seq)
+                else:
+                    self._discarded.add(seq)
+
+    def _collect_loop(self):
+        """Thread nhận kết quả từ worker"""
+        while True:
+            status, seq, payload = self._result_queue.get()
+            if status == 'stop':
+                break
+            with self._lock:
+                if seq in self._discarded:
+                    self._discarded.discard(seq)
+                    self._release_task(seq)
+                    continue
+                self._results[seq] = (status, payload)
+                self._lock.notify_all()
+
+    def _release_task(self, seq):
+        self._free_slots.put(self._inflight.pop(seq))
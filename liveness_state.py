@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+Module lưu trạng thái liveness theo từng track khuôn mặt
+Per-Track Liveness State Module
+
+Mỗi track có buffer riêng (numpy ring cấp phát sẵn) để bằng chứng nháy mắt
+của nhiều người trong khung hình không bị trộn lẫn, cùng crop khuôn mặt lần
+trước để tính optical flow trên vùng mặt nhỏ thay vì cả frame. Số track và
+thời gian sống đều có giới hạn nên bộ nhớ cố định dù có bao nhiêu lượt khách.
+
+TemporalLivenessAggregator gộp điểm liveness của track theo thời gian (EWMA),
+chỉ chạy lại các phương pháp đắt mỗi K frame hoặc khi điểm còn sát ngưỡng.
+Mọi frame của track (kể cả khi không cần nhận diện) đều đi qua lịch đánh giá
+này, và kết luận chỉ được đưa ra khi track đã có đủ số lần đánh giá.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import config
+
+
+class RingBuffer:
+    """Buffer vòng kích thước cố định trên numpy array cấp phát sẵn"""
+
+    def __init__(self, capacity, dtype=np.float64):
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.capacity = capacity
+        self.size = 0
+        self._index = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, value):
+        """Ghi đè phần tử cũ nhất khi đầy (O(1), không cấp phát)"""
+        self.data[self._index] = value
+        self._index = (self._index + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def values(self):
+        """View các phần tử hiện có (không theo thứ tự thời gian khi đã quay vòng)"""
+        return self.data[:self.size]
+
+    def clear(self):
+        self.size = 0
+        self._index = 0
+
+
+class TrackLivenessState:
+    """Trạng thái liveness của 1 track"""
+
+    def __init__(self, blink_buffer_size):
+        self.blink_frames = RingBuffer(blink_buffer_size)
+        self.prev_ear = 0
+        self.last_seen = 0.0
+
+        # Crop grayscale (đã căn chỉnh) lần trước của track cho motion analysis
+        self.prev_gray = None
+        self.prev_gray_time = 0.0
+
+        # Điểm liveness trung bình trượt (EWMA) của track
+        self.score = None
+        self.details = {}
+        self.num_evaluations = 0
+        self.frames_since_evaluation = 0
+
+    def swap_motion_history(self, gray, now, max_age):
+        """
+        Lưu crop hiện tại, trả về crop trước nếu còn đủ mới và cùng kích thước
+
+        Returns:
+            prev_gray: Crop grayscale lần trước hoặc None
+        """
+        prev_gray = self.prev_gray
+        if prev_gray is not None and (now - self.prev_gray_time > max_age or prev_gray.shape != gray.shape):
+            prev_gray = None
+        self.prev_gray = gray
+        self.prev_gray_time = now
+        return prev_gray
+
+
+class LivenessStateStore:
+    """
+    Map track_id -> TrackLivenessState có giới hạn
+
+    Thứ tự trong OrderedDict là thứ tự truy cập gần nhất, nên track hết hạn
+    (không thấy quá ttl giây) hoặc cũ nhất khi vượt max_tracks luôn ở đầu.
+    Có khóa vì các worker liveness bất đồng bộ dùng chung 1 store.
+    """
+
+    def __init__(self, max_tracks=None, ttl=None, blink_buffer_size=None):
+        self.max_tracks = max_tracks or config.LIVENESS_STATE_MAX_TRACKS
+        self.ttl = ttl if ttl is not None else config.LIVENESS_STATE_TTL
+        self.blink_buffer_size = blink_buffer_size or config.BLINK_BUFFER_SIZE
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._states)
+
+    def __contains__(self, track_id):
+        return track_id in self._states
+
+    def get(self, track_id, now=None):
+        """Lấy (hoặc tạo) trạng thái của track, đồng thời dọn các track hết hạn"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._evict(now)
+
+            state = self._states.get(track_id)
+            if state is None:
+                state = TrackLivenessState(self.blink_buffer_size)
+                self._states[track_id] = state
+                if len(self._states) > self.max_tracks:
+                    self._states.popitem(last=False)
+            else:
+                self._states.move_to_end(track_id)
+
+            state.last_seen = now
+        return state
+
+    def remove(self, track_id):
+        with self._lock:
+            self._states.pop(track_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._states.clear()
+
+    def _evict(self, now):
+        while self._states:
+            track_id, state = next(iter(self._states.items()))
+            if now - state.last_seen <= self.ttl:
+                break
+            del self._states[track_id]
+
+
+class TemporalLivenessAggregator:
+    """
+    Gộp điểm check_liveness của từng track bằng trung bình trượt hàm mũ
+
+    Kết quả không lật theo 1 frame nhiễu, và các phương pháp đắt chỉ chạy lại
+    khi track chưa đủ min_evaluations lần đánh giá, đã qua eval_every frame kể
+    từ lần chạy trước, hoặc điểm trung bình còn nằm trong margin quanh ngưỡng.
+    Các frame còn lại chỉ cập nhật buffer nháy mắt/crop motion
+    (AntiSpoofing.observe).
+    """
+
+    def __init__(self, anti_spoofing, alpha=None, eval_every=None, margin=None, min_evaluations=None):
+        """
+        Args:
+            anti_spoofing: AntiSpoofing (trạng thái track lưu trong track_states của nó)
+            alpha: Trọng số của điểm mới trong EWMA (0-1]
+            eval_every: Chạy lại check_liveness sau mỗi N frame của track
+            margin: Điểm cách ngưỡng ít hơn margin thì luôn chạy lại
+            min_evaluations: Số lần đánh giá tối thiểu trước khi kết luận thật/giả
+        """
+        self.anti_spoofing = anti_spoofing
+        self.alpha = alpha if alpha is not None else config.LIVENESS_EWMA_ALPHA
+        self.eval_every = eval_every or config.LIVENESS_EVAL_EVERY_N_FRAMES
+        self.margin = margin if margin is not None else config.LIVENESS_UNCERTAIN_MARGIN
+        self.min_evaluations = max(1, min_evaluations or config.LIVENESS_MIN_EVALUATIONS)
+        self.threshold = config.LIVENESS_THRESHOLD
+
+        self.evaluations = 0
+        self.reused = 0
+        self.inconclusive = 0
+
+    def needs_evaluation(self, state):
+        if state.num_evaluations < self.min_evaluations or state.frames_since_evaluation >= self.eval_every:
+            return True
+        return abs(state.score - self.threshold) < self.margin
+
+    def confidence(self, state):
+        """
+        Độ tin cậy của kết luận (0-1): khoảng cách từ điểm EWMA đến ngưỡng
+        (chuẩn hóa theo phía của ngưỡng) nhân với lượng bằng chứng đã gộp
+        (1 - (1 - alpha)^số lần đánh giá)
+        """
+        if state.score is None:
+            return 0.0
+        span = 1.0 - self.threshold if state.score >= self.threshold else self.threshold
+        distance = min(abs(state.score - self.threshold) / max(span, 1e-6), 1.0)
+        evidence = 1.0 - (1.0 - self.alpha) ** state.num_evaluations
+        return float(distance * evidence)
+
+    def update(self, face_image, landmarks=None, track_id=None, now=None):
+        """
+        Cập nhật liveness của track ở frame hiện tại
+
+        Args:
+            face_image: Crop khuôn mặt (RGB)
+            landmarks: Landmarks MTCNN (có thể None)
+            track_id: ID track; None thì chạy check_liveness 1 lần, không gộp
+            now: Thời điểm (time.monotonic) cho TTL của trạng thái
+
+        Returns:
+            is_real: Kết luận theo điểm EWMA; None khi track chưa đủ
+                min_evaluations lần đánh giá (chưa kết luận, thử lại ở frame sau)
+            score: Điểm EWMA (0-1)
+            confidence: Độ tin cậy của kết luận (0-1)
+            details: Điểm từng phương pháp ở lần đánh giá gần nhất
+        """
+        if track_id is None:
+            state = TrackLivenessState(1)
+            self._evaluate(state, face_image, landmarks, None)
+            return state.score >= self.threshold, state.score, self.confidence(state), state.details
+
+        state = self._step(face_image, landmarks, track_id, now)
+        if state.num_evaluations < self.min_evaluations:
+            self.inconclusive += 1
+            return None, state.score, self.confidence(state), state.details
+        return state.score >= self.threshold, state.score, self.confidence(state), state.details
+
+    def observe(self, face_image, landmarks=None, track_id=None, now=None):
+        """
+        Frame không cần kết luận: vẫn theo lịch đánh giá của update để điểm EWMA
+        của track tích lũy từ lần phát hiện đầu tiên
+        """
+        if track_id is None:
+            self.anti_spoofing.observe(face_image, landmarks, track_id)
+            return
+        self._step(face_image, landmarks, track_id, now)
+
+    def _step(self, face_image, landmarks, track_id, now):
+        state = self.anti_spoofing.track_states.get(track_id, now)
+        state.frames_since_evaluation += 1
+        if self.needs_evaluation(state):
+            self._evaluate(state, face_image, landmarks, track_id)
+        else:
+            self.anti_spoofing.observe(face_image, landmarks, track_id)
+            self.reused += 1
+        return state
+
+    def _evaluate(self, state, face_image, landmarks, track_id):
+        _, score, details = self.anti_spoofing.check_liveness(face_image, landmarks, track_id=track_id)
+        score = float(score)
+        state.score = score if state.score is None else state.score + self.alpha * (score - state.score)
+        state.details = details
+        state.num_evaluations += 1
+        state.frames_since_evaluation = 0
+        self.evaluations += 1
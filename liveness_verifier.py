@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Kiểm tra liveness bất đồng bộ trên pool thread
+Asynchronous Liveness Verification Module
+
+Pipeline không chờ kết quả liveness: nhận diện chạy tiếp với giả định mặt là
+thật, còn lượt chấm công chỉ được ghi khi kết luận "thật" về kịp trước hạn
+(deadline). Kết luận "giả" được ghi vào spoofing_logs.
+
+Mỗi track luôn được xử lý trên cùng 1 worker (chia theo hash của track id),
+nên các lần check_liveness/observe của 1 track chạy tuần tự theo đúng thứ tự
+frame, không tranh chấp buffer blink/motion của track. cv2 nhả GIL nên các
+worker chạy song song thực sự. Mỗi track chỉ giữ 1 lần observe đang chờ (frame
+mới nhất), nên khi worker chậm hàng đợi không dài thêm theo số frame; submit
+lấy frame đang chờ đó cho job chạy trước frame của job, nên frame observe sau
+job luôn vào 1 task mới xếp sau job.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+
+class LivenessJob:
+    """1 lần kiểm tra liveness đang chạy trong worker"""
+
+    def __init__(self, track_id, deadline):
+        self.track_id = track_id
+        self.submitted_at = time.monotonic()
+        self.deadline = self.submitted_at + deadline
+        self.completed_at = None
+        self.future = None
+        self.abandoned = False  # Đã quá hạn, lượt chấm công bị bỏ
+
+    def done(self):
+        return self.future.done()
+
+    @property
+    def on_time(self):
+        """Kết luận về trước hạn (chỉ có nghĩa khi done)"""
+        return self.completed_at is not None and self.completed_at <= self.deadline
+
+    @property
+    def expired(self):
+        """Đã quá hạn mà chưa có kết luận"""
+        return not self.done() and time.monotonic() > self.deadline
+
+    def result(self):
+        """
+        Returns:
+            (is_real, score, confidence, details); is_real None khi track chưa đủ
+            số lần đánh giá, lỗi trong worker cũng được coi là không kết luận được
+            (None, None, None, {'error': ...})
+        """
+        try:
+            return self.future.result(timeout=0)
+        except Exception as e:
+            return None, None, None, {'error': str(e)}
+
+
+class AsyncLivenessVerifier:
+    """Pool worker chạy liveness cho các track, mỗi track gắn với 1 worker"""
+
+    def __init__(self, anti_spoofing, aggregator=None, num_workers=None, deadline=None):
+        """
+        Args:
+            anti_spoofing: AntiSpoofing dùng chung (trạng thái theo track)
+            aggregator: TemporalLivenessAggregator (None = check_liveness từng lần)
+            num_workers: Số worker thread
+            deadline: Thời gian (giây) tối đa chờ kết luận để ghi chấm công
+        """
+        self.anti_spoofing = anti_spoofing
+        self.aggregator = aggregator
+        self.num_workers = max(1, num_workers or config.LIVENESS_ASYNC_WORKERS)
+        self.deadline = deadline if deadline is not None else config.LIVENESS_ASYNC_DEADLINE
+        self._executors = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"liveness-{i}")
+            for i in range(self.num_workers)
+        ]
+        self._lock = threading.Lock()
+        self._pending_observations = {}  # track_id -> [face_image, landmarks] mới nhất của task observe đang chờ
+        self.in_flight = 0
+        self.submitted = 0
+        self.coalesced = 0  # Số lần observe bị thay bằng frame mới hơn
+        self.latency_ms = 0.0
+
+    def _executor(self, track_id):
+        return self._executors[hash(track_id) % self.num_workers]
+
+    def submit(self, face_image, landmarks, track_id):
+        """Gửi 1 lần kiểm tra liveness, trả về LivenessJob ngay lập tức"""
+        job = LivenessJob(track_id, self.deadline)
+        with self._lock:
+            self.in_flight += 1
+            self.submitted += 1
+            # Frame observe đang chờ có trước frame này: job xử lý nó trước, task observe
+            # đã xếp hàng sẽ không còn gì để làm
+            slot = self._pending_observations.pop(track_id, None)
+            observation = tuple(slot) if slot is not None else None
+            job.future = self._executor(track_id).submit(self._run, job, face_image, landmarks, observation)
+        return job
+
+    def observe(self, face_image, landmarks, track_id):
+        """Cập nhật lịch sử blink/motion của track (theo thứ tự với các job của track)"""
+        with self._lock:
+            slot = self._pending_observations.get(track_id)
+            if slot is not None:
+                # Task observe của track chưa chạy: sẽ dùng frame mới nhất này
+                slot[:] = (face_image, landmarks)
+                self.coalesced += 1
+                return
+            slot = self._pending_observations[track_id] = [face_image, landmarks]
+            self._executor(track_id).submit(self._observe, track_id, slot)
+
+    def shutdown(self, wait=True):
+        for executor in self._executors:
+            executor.shutdown(wait=wait)
+
+    def _observe(self, track_id, slot):
+        with self._lock:
+            if self._pending_observations.get(track_id) is not slot:
+                return  # Job submit sau đã lấy frame này
+            del self._pending_observations[track_id]
+        self._observe_frame(track_id, *slot)
+
+    def _observe_frame(self, track_id, face_image, landmarks):
+        if self.aggregator is not None:
+            self.aggregator.observe(face_image, landmarks, track_id)
+        else:
+            self.anti_spoofing.observe(face_image, landmarks, track_id)
+
+    def _run(self, job, face_image, landmarks, observation=None):
+        try:
+            if observation is not None:
+                self._observe_frame(job.track_id, *observation)
+            if self.aggregator is not None:
+                is_real, score, confidence, details = self.aggregator.update(face_image, landmarks, job.track_id)
+            else:
+                is_real, score, details = self.anti_spoofing.check_liveness(
+                    face_image, landmarks, track_id=job.track_id
+                )
+                confidence = None
+            # is_real None: aggregator chưa đủ số lần đánh giá để kết luận
+            return (None if is_real is None else bool(is_real)), float(score), confidence, details
+        finally:
+            job.completed_at = time.monotonic()
+            with self._lock:
+                self.in_flight -= 1
+                elapsed = (job.completed_at - job.submitted_at) * 1000
+                self.latency_ms += 0.1 * (elapsed - self.latency_ms)
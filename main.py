@@ -16,6 +16,9 @@ import config
 from database import DatabaseManager
 from face_recognition import FaceRecognizer
 from anti_spoofing import AntiSpoofing
+from attendance import AttendanceLogger
+from write_behind import WriteBehindWriter
+from pipeline import AttendancePipeline, BoundedQueue, QueueClosed
 from report_exporter import ReportExporter
 
 class AttendanceApp:
@@ -31,18 +34,28 @@ class AttendanceApp:
         self.db = DatabaseManager()
         self.face_recognizer = FaceRecognizer()
         self.anti_spoofing = AntiSpoofing()
-        self.report_exporter = ReportExporter()
+        self.report_exporter = ReportExporter(self.db)
         
         # Load embeddings
         embeddings = self.db.load_face_embeddings()
         if embeddings:
             self.face_recognizer.load_embeddings(embeddings)
         
+        # Pipeline xử lý (capture -> detect -> liveness -> recognize -> log),
+        # giao diện chỉ là 1 subscriber nhận kết quả
+        # Ghi chấm công / giả mạo qua hàng đợi write-behind, không chặn camera
+        self.log_writer = WriteBehindWriter(self.db) if config.WRITE_BEHIND_ENABLED else None
+        self.attendance_logger = AttendanceLogger(self.db, writer=self.log_writer)
+        # Liveness chạy bất đồng bộ (LIVENESS_MODE): lượt chấm công chỉ được ghi
+        # khi kết luận "thật" về kịp hạn, lượt giả mạo ghi vào spoofing_logs
+        self.pipeline = AttendancePipeline(
+            self.face_recognizer, self.anti_spoofing,
+            self.log_attendance, spoof_handler=(self.log_writer or self.db).log_spoofing_attempt
+        )
+        self.display_queue = None
+        
         # Camera variables
-        self.camera = None
         self.is_camera_running = False
-        self.current_frame = None
-        self.prev_frame = None
         
         # Registration variables
         self.registration_mode = False
@@ -320,11 +333,11 @@ class AttendanceApp:
     def start_camera(self):
         """Khởi động camera"""
         if not self.is_camera_running:
-            self.camera = cv2.VideoCapture(config.CAMERA_INDEX)
-            self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, config.CAMERA_WIDTH)
-            self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, config.CAMERA_HEIGHT)
+            # Hàng đợi hiển thị: chỉ giữ frame mới nhất nếu giao diện vẽ chậm
+            self.display_queue = BoundedQueue(maxsize=2, policy='drop_oldest')
+            self.pipeline.subscribe(self.on_pipeline_result)
             
-            if self.camera.isOpened():
+            if self.pipeline.start():
                 self.is_camera_running = True
                 self.btn_start_camera.config(state=tk.DISABLED)
                 self.btn_stop_camera.config(state=tk.NORMAL)
@@ -334,102 +347,104 @@ class AttendanceApp:
                 thread = threading.Thread(target=self.update_camera_feed, daemon=True)
                 thread.start()
             else:
+                self.pipeline.unsubscribe(self.on_pipeline_result)
                 messagebox.showerror("Lỗi", "Không thể khởi động camera!")
     
     def stop_camera(self):
         """Dừng camera"""
         self.is_camera_running = False
-        if self.camera:
-            self.camera.release()
+        if self.display_queue is not None:
+            self.pipeline.unsubscribe(self.on_pipeline_result)
+            self.display_queue.close()
+        self.pipeline.stop()
         
         self.btn_start_camera.config(state=tk.NORMAL)
         self.btn_stop_camera.config(state=tk.DISABLED)
         self.status_label.config(text="📷 Camera đã tắt")
         self.camera_label.config(image='')
     
+    def on_pipeline_result(self, packet):
+        """Nhận kết quả từ pipeline, chỉ hiển thị camera được chọn"""
+        if packet.source_id == config.DISPLAY_SOURCE_ID:
+            self.display_queue.put(packet)
+    
     def update_camera_feed(self):
-        """Update camera feed và xử lý nhận diện - JARVIS STYLE"""
+        """Hiển thị kết quả từ pipeline - JARVIS STYLE"""
         import time
         import numpy as np
         frame_count = 0
-        process_every_n_frames = 5
-        skip_anti_spoofing = True
+        last_frame_time = time.time()
         
         # Biến lưu thông tin box để vẽ mượt (không nháy)
         last_boxes = []
         last_names = []
         last_probs = []
+        last_track_ids = []
         scan_line_y = 0  # Vị trí đường quét
         scan_speed = 10  # Tốc độ quét CỰC NHANH
         pulse_alpha = 0  # Hiệu ứng pulse
         particle_positions = []  # Hiệu ứng hạt
         
         # SCAN CHỈ 1 LẦN mỗi mặt
-        face_scan_status = {}  # {box_id: progress (0-100)}
-        face_scan_complete = {}  # {box_id: True/False}
+        face_scan_status = {}  # {track_id: progress (0-100)}
+        face_scan_complete = {}  # {track_id: True/False}
         
         while self.is_camera_running:
-            ret, frame = self.camera.read()
-            if not ret:
-                time.sleep(0.01)
+            try:
+                packet = self.display_queue.get(timeout=0.1)
+            except QueueClosed:
+                break
+            if packet is None:
                 continue
             
             frame_count += 1
-            small_frame = cv2.resize(frame, (640, 480))
+            now = time.time()
+            frame_interval = now - last_frame_time
+            last_frame_time = now
+            small_frame = packet.frame
             display_frame = small_frame.copy()
             
-            # Chỉ xử lý nhận diện mỗi N frames
-            if frame_count % process_every_n_frames == 0:
-                faces, boxes, probs, landmarks = self.face_recognizer.detect_faces(small_frame)
+            # Kết quả nhận diện chỉ có ở các frame pipeline đã xử lý
+            if packet.detected and packet.boxes is not None and len(packet.boxes) > 0:
+                # Cập nhật thông tin mới
+                last_boxes = []
+                last_names = []
+                last_probs = []
+                last_track_ids = []
                 
-                if boxes is not None and len(boxes) > 0:
-                    # Cập nhật thông tin mới
-                    last_boxes = []
-                    last_names = []
-                    last_probs = []
+                for face, box, prob, track in zip(packet.faces, packet.boxes, packet.probs, packet.tracks):
                     
-                    for i, (face, box, prob, landmark) in enumerate(zip(faces, boxes, probs, landmarks)):
-                        
-                        if skip_anti_spoofing or self.registration_mode:
-                            is_real = True
-                        else:
-                            is_real, liveness_score, details = self.anti_spoofing.check_liveness(
-                                face, landmark, self.prev_frame
-                            )
+                    if self.registration_mode:
+                        # Lưu ảnh mặt hiện tại để chụp sau 2s
+                        self.current_face_for_registration = face.copy()
                         
-                        if is_real:
-                            if self.registration_mode:
-                                # Lưu ảnh mặt hiện tại để chụp sau 2s
-                                self.current_face_for_registration = face.copy()
-                                
-                                # Hiển thị hướng dẫn góc cần chụp với countdown
-                                if self.current_pose_index < len(self.pose_names):
-                                    remaining_time = max(0, self.pose_hold_duration - self.pose_timer)
-                                    name = f"{self.pose_names[self.current_pose_index]} ({remaining_time:.1f}s)"
-                                else:
-                                    name = "HOÀN THÀNH"
-                                color = (0, 255, 255)  # Cyan
-                            else:
-                                employee_id, name, distance = self.face_recognizer.recognize_face(face)
-                                
-                                if employee_id:
-                                    color = (0, 255, 0)  # Green - Success
-                                    self.log_attendance(employee_id, name, prob, distance)
-                                else:
-                                    name = "UNKNOWN"
-                                    color = (0, 165, 255)  # Orange
-                            
-                            # Lưu thông tin để vẽ mượt
-                            last_boxes.append((box, color))
-                            last_names.append(name)
-                            last_probs.append(prob)
+                        # Hiển thị hướng dẫn góc cần chụp với countdown
+                        if self.current_pose_index < len(self.pose_names):
+                            remaining_time = max(0, self.pose_hold_duration - self.pose_timer)
+                            name = f"{self.pose_names[self.current_pose_index]} ({remaining_time:.1f}s)"
                         else:
-                            # Fake detected
-                            last_boxes.append((box, (0, 0, 255)))  # Red
-                            last_names.append("FAKE DETECTED")
-                            last_probs.append(prob)
-                
-                self.prev_frame = small_frame.copy()
+                            name = "HOÀN THÀNH"
+                        color = (0, 255, 255)  # Cyan
+                    elif track.pending or not track.is_identified:
+                        # Pipeline chưa trả kết quả cho track này
+                        name = "SCANNING..."
+                        color = (200, 200, 200)  # Gray
+                    elif not track.is_real:
+                        # Fake detected
+                        name = "FAKE DETECTED"
+                        color = (0, 0, 255)  # Red
+                    elif track.employee_id:
+                        name = track.name
+                        color = (0, 255, 0)  # Green - Success
+                    else:
+                        name = "UNKNOWN"
+                        color = (0, 165, 255)  # Orange
+                    
+                    # Lưu thông tin để vẽ mượt
+                    last_boxes.append((box, color))
+                    last_names.append(name)
+                    last_probs.append(prob)
+                    last_track_ids.append(track.track_id)
             
             # VẼ KHUNG NGẦU KIỂU JARVIS HUD
             for idx, (box_info) in enumerate(last_boxes):
@@ -495,9 +510,9 @@ class AttendanceApp:
                 # Màu xám trắng nhẹ
                 gray_white = (200, 200, 200)  # Xám nhạt
                 
-                # Tạo ID duy nhất cho mặt này (dựa vào TÊN thay vì vị trí để không lặp)
-                if idx < len(last_names):
-                    face_id = last_names[idx]  # Dùng tên người
+                # ID duy nhất cho mặt này: track id từ FaceTracker
+                if idx < len(last_track_ids):
+                    face_id = last_track_ids[idx]
                 else:
                     face_id = f"unknown_{idx}"
                 
@@ -620,7 +635,8 @@ class AttendanceApp:
                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
             
             # FPS counter
-            cv2.putText(display_frame, f"FPS: {int(1/0.03)}", (10, 45),
+            fps = 1.0 / frame_interval if frame_interval > 0 else 0
+            cv2.putText(display_frame, f"FPS: {int(fps)}", (10, 45),
                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
             
             # Face count
@@ -638,12 +654,7 @@ class AttendanceApp:
             pulse_alpha = (pulse_alpha + 1) % 360
             
             # Dọn dẹp face_scan_status cho các mặt không còn hiển thị
-            current_face_ids = set()
-            for box_info in last_boxes:
-                box, _ = box_info
-                x1, y1, x2, y2 = [int(b) for b in box]
-                face_id = f"{x1}_{y1}_{x2}_{y2}"
-                current_face_ids.add(face_id)
+            current_face_ids = set(last_track_ids)
             
             # Xóa các face_id cũ không còn trong frame
             face_scan_status = {k: v for k, v in face_scan_status.items() if k in current_face_ids}
@@ -651,8 +662,8 @@ class AttendanceApp:
             
             # === XỬ LÝ ĐĂNG KÝ TỰ ĐỘNG THEO THỜI GIAN ===
             if self.registration_mode and self.current_face_for_registration is not None:
-                # Tăng bộ đếm thời gian (mỗi frame = 0.03s)
-                self.pose_timer += 0.03
+                # Tăng bộ đếm thời gian theo thời gian thực giữa 2 frame
+                self.pose_timer += frame_interval
                 
                 # Vẽ thanh progress bar cho countdown
                 if self.current_pose_index < 5:
@@ -688,8 +699,6 @@ class AttendanceApp:
             
             self.camera_label.config(image=photo)
             self.camera_label.image = photo
-            
-            time.sleep(0.03)  # Giảm delay để mượt hơn
     
     def start_registration(self):
         """Bắt đầu đăng ký nhân viên"""
@@ -705,6 +714,7 @@ class AttendanceApp:
             return
         
         self.registration_mode = True
+        self.pipeline.recognition_enabled = False
         self.registration_images = []
         self.registration_poses = []
         self.current_pose_index = 0
@@ -774,6 +784,7 @@ class AttendanceApp:
     def complete_registration(self):
         """Hoàn tất đăng ký"""
         self.registration_mode = False
+        self.pipeline.recognition_enabled = True
         
         # Kiểm tra đã đủ 5 góc chưa
         if len(self.registration_images) < 5:
@@ -798,9 +809,12 @@ class AttendanceApp:
                 self.registration_images
             )
             
-            # Save embeddings
-            embeddings = self.face_recognizer.save_embeddings()
-            self.db.save_face_embeddings(embeddings)
+            # Chỉ ghi document của nhân viên vừa đăng ký
+            self.db.save_face_embedding(
+                self.registration_employee_id,
+                self.face_recognizer.known_embeddings[self.registration_employee_id],
+                self.registration_name
+            )
             
             # Thông báo chi tiết
             poses_text = "\n".join([f"  ✓ {pose}" for pose in self.registration_poses])
@@ -832,6 +846,7 @@ class AttendanceApp:
     def cancel_registration(self):
         """Hủy đăng ký"""
         self.registration_mode = False
+        self.pipeline.recognition_enabled = True
         self.registration_images = []
         self.registration_poses = []
         self.current_pose_index = 0
@@ -844,35 +859,22 @@ class AttendanceApp:
         self.register_progress.config(text="Đã hủy", foreground="gray")
         self.pose_instruction.config(text="")
     
-    def log_attendance(self, employee_id, name, confidence, distance):
-        """Ghi nhận chấm công"""
-        # Check time between check-ins
-        last_checkin = self.db.get_last_checkin(employee_id)
-        
-        if last_checkin:
-            last_time = datetime.strptime(last_checkin['datetime'], config.DATETIME_FORMAT)
-            time_diff = (datetime.now() - last_time).total_seconds()
-            
-            if time_diff < config.MIN_TIME_BETWEEN_CHECKINS:
-                return  # Too soon
-        
-        # Determine if late
-        current_time = datetime.now()
-        work_start = datetime.strptime(config.WORK_START_TIME, "%H:%M").time()
-        is_late = current_time.time() > work_start
-        
-        # Log to database
-        self.db.log_attendance(
-            employee_id, "Check-in", "Success",
-            confidence, int(is_late),
-            f"Distance: {distance:.3f}"
-        )
-        
-        # Update UI
-        log_text = f"[{current_time.strftime(config.DATETIME_FORMAT)}]\n"
-        log_text += f"✅ {name} ({employee_id})\n"
-        log_text += f"Confidence: {confidence:.2f}\n"
-        if is_late:
+    def log_attendance(self, employee_id, name, confidence, distance, timestamp=None):
+        """Ghi nhận chấm công (được pipeline gọi từ stage log)"""
+        record = self.attendance_logger.log(employee_id, name, confidence, distance, timestamp=timestamp)
+        if record is None:
+            return None  # Too soon
+        
+        # Update UI trên Tk thread
+        self.root.after(0, self.show_attendance_record, record)
+        return record
+    
+    def show_attendance_record(self, record):
+        """Hiển thị lượt chấm công vào lịch sử gần nhất"""
+        log_text = f"[{record['datetime'].strftime(config.DATETIME_FORMAT)}]\n"
+        log_text += f"✅ {record['name']} ({record['employee_id']})\n"
+        log_text += f"Confidence: {record['confidence']:.2f}\n"
+        if record['is_late']:
             log_text += "⚠️ ĐI MUỘN\n"
         log_text += "-" * 40 + "\n\n"
         
@@ -917,19 +919,11 @@ class AttendanceApp:
             # Xóa trong database
             self.db.delete_employee(employee_id)
             
-            # Xóa face embeddings trong bộ nhớ
-            if employee_id in self.face_recognizer.known_embeddings:
-                del self.face_recognizer.known_embeddings[employee_id]
-                print(f"✅ Đã xóa face embedding của {employee_id} khỏi bộ nhớ")
+            # Xóa face embeddings trong bộ nhớ (đồng bộ cả gallery matrix)
+            self.face_recognizer.delete_employee(employee_id)
             
-            if employee_id in self.face_recognizer.known_names:
-                del self.face_recognizer.known_names[employee_id]
-                print(f"✅ Đã xóa tên của {employee_id} khỏi bộ nhớ")
-            
-            # Lưu lại embeddings sau khi xóa
-            embeddings = self.face_recognizer.save_embeddings()
-            self.db.save_face_embeddings(embeddings)
-            print(f"✅ Đã cập nhật file embeddings")
+            # Chỉ xóa document của nhân viên này
+            self.db.delete_face_embedding(employee_id)
             
             # Refresh danh sách
             self.refresh_employee_list()
@@ -940,6 +934,7 @@ class AttendanceApp:
         """Xuất báo cáo"""
         start_date = self.entry_start_date.get().strip() or None
         end_date = self.entry_end_date.get().strip() or None
+        self.flush_pending_logs()
         
         try:
             if format_type == 'excel':
@@ -955,8 +950,14 @@ class AttendanceApp:
         except Exception as e:
             messagebox.showerror("Lỗi", f"Lỗi khi xuất báo cáo: {str(e)}")
     
+    def flush_pending_logs(self):
+        """Chờ các lượt chấm công trong hàng đợi write-behind được ghi trước khi đọc báo cáo"""
+        if self.log_writer is not None:
+            self.log_writer.flush(timeout=config.WRITE_BEHIND_FLUSH_INTERVAL * 4)
+    
     def update_statistics(self):
         """Cập nhật thống kê"""
+        self.flush_pending_logs()
         try:
             logs = self.db.get_attendance_logs()
             employees = self.db.get_all_employees()
@@ -987,6 +988,10 @@ class AttendanceApp:
     def on_closing(self):
         """Xử lý khi đóng ứng dụng"""
         self.stop_camera()
+        self.pipeline.close()
+        if self.log_writer is not None:
+            self.log_writer.close()
+        self.db.close()
         self.root.destroy()
 
 
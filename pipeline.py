@@ -0,0 +1,922 @@
+# -*- coding: utf-8 -*-
+"""
+Pipeline xử lý chấm công nhiều luồng, không phụ thuộc giao diện
+Headless Multi-Stage Attendance Pipeline
+
+    capture -> detect -> liveness -> recognize -> log -> subscribers
+
+Mỗi stage chạy trên 1 thread riêng, nối với nhau bằng hàng đợi có giới hạn.
+Khi hàng đợi đầy, frame cũ nhất bị bỏ (drop-oldest) để stage chậm không
+làm nghẽn các stage khác.
+
+Nhiều camera dùng chung 1 FaceRecognizer/AntiSpoofing: mỗi camera có thread
+capture riêng, còn detect và recognize gom frame của các camera thành batch.
+
+Chế độ process (PIPELINE_EXECUTION_MODE = "process"): detect + embedding chạy
+trong pool worker process (inference_pool.py), frame đi qua shared memory;
+liveness vẫn chạy ở process chính vì trạng thái liveness gắn với track:
+
+    capture -> submit -> [workers] -> collect -> liveness -> recognize -> log -> subscribers
+
+Liveness bất đồng bộ (LIVENESS_MODE = "async"): stage liveness
+chỉ gửi việc cho AsyncLivenessVerifier, nhận diện chạy tiếp với giả định mặt
+thật, stage log giữ lượt chấm công lại và chỉ ghi khi kết luận "thật" về kịp
+LIVENESS_ASYNC_DEADLINE; kết luận "giả" được chuyển cho spoof_handler.
+
+Cổng chuyển động (MOTION_GATE_ENABLED): khi khung hình tĩnh và camera không
+còn track nào, frame đi thẳng tới subscriber mà không chạy detect; có chuyển
+động thì frame đó được detect ngay, không chờ lượt mỗi N frame.
+
+Usage (headless):
+    python pipeline.py --source 0
+    python pipeline.py --source 0 1 rtsp://gate-2/stream
+    python pipeline.py --source 0 1 2 3 --workers 8
+"""
+
+import argparse
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+import config
+from face_tracker import FaceTracker
+from inference_pool import InferencePool
+from liveness_state import TemporalLivenessAggregator
+from liveness_verifier import AsyncLivenessVerifier
+from motion_gate import MotionGate
+
+
+class QueueClosed(Exception):
+    """Hàng đợi đã đóng (pipeline đang dừng)"""
+
+
+class BoundedQueue:
+    """
+    Hàng đợi có giới hạn, thread-safe
+
+    Chính sách khi đầy:
+        drop_oldest: bỏ phần tử cũ nhất để nhận phần tử mới
+        drop_newest: bỏ phần tử mới
+        block: chờ tới khi có chỗ
+    """
+
+    POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+    def __init__(self, maxsize=None, policy=None):
+        self.maxsize = maxsize or config.PIPELINE_QUEUE_SIZE
+        self.policy = policy or config.PIPELINE_DROP_POLICY
+        if self.policy not in self.POLICIES:
+            raise ValueError(f"Unknown drop policy: {self.policy}")
+
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+
+    def __len__(self):
+        with self._cond:
+            return len(self._items)
+
+    def put(self, item):
+        """Đưa phần tử vào hàng đợi, trả về False nếu phần tử bị bỏ"""
+        with self._cond:
+            if self._closed:
+                raise QueueClosed()
+
+            if len(self._items) >= self.maxsize:
+                if self.policy == 'drop_newest':
+                    self.dropped += 1
+                    return False
+                if self.policy == 'drop_oldest':
+                    self._items.popleft()
+                    self.dropped += 1
+                else:
+                    while len(self._items) >= self.maxsize and not self._closed:
+                        self._cond.wait()
+                    if self._closed:
+                        raise QueueClosed()
+
+            self._items.append(item)
+            self._cond.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        """Lấy phần tử, trả về None nếu hết timeout"""
+        with self._cond:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not self._items:
+                if self._closed:
+                    raise QueueClosed()
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def get_batch(self, max_items, timeout=None):
+        """Chờ phần tử đầu tiên, sau đó lấy thêm (không chờ) tới max_items phần tử"""
+        first = self.get(timeout)
+        if first is None:
+            return []
+
+        items = [first]
+        with self._cond:
+            while self._items and len(items) < max_items:
+                items.append(self._items.popleft())
+            self._cond.notify_all()
+        return items
+
+    def close(self):
+        """Đóng hàng đợi, đánh thức mọi thread đang chờ"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class FramePacket:
+    """Dữ liệu của 1 frame đi qua các stage"""
+
+    def __init__(self, source_id, frame_id, frame, timestamp):
+        self.source_id = source_id
+        self.frame_id = frame_id
+        self.frame = frame
+        self.timestamp = timestamp
+        # Trạng thái cổng chuyển động của camera ở frame này
+        self.motion = True
+        self.woke = False
+
+        # Kết quả detect (chỉ có ở các frame được xử lý)
+        self.detected = False
+        self.faces = None
+        self.face_tensor = None
+        self.embeddings = None  # Chỉ có ở chế độ process (tính sẵn trong worker)
+        self.inference_seq = None
+        self.boxes = None
+        self.probs = None
+        self.landmarks = None
+        self.tracks = []
+
+        # Chỉ số các mặt cần liveness + nhận diện ở frame này
+        self.pending = []
+        self.liveness = {}
+        self.liveness_confidence = {}
+        self.liveness_jobs = {}  # Chỉ có ở chế độ liveness async
+        self.logged = []
+
+
+class Stage(threading.Thread):
+    """
+    1 stage của pipeline: lấy từ in_queue, xử lý, đưa sang out_queue
+
+    Với max_batch > 1, func nhận list packet (gom từ nhiều camera) và trả về
+    list packet theo đúng thứ tự
+    """
+
+    def __init__(self, name, func, in_queue, out_queue, stop_event, max_batch=1):
+        super().__init__(name=f"pipeline-{name}", daemon=True)
+        self.stage_name = name
+        self.func = func
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.stop_event = stop_event
+        self.max_batch = max_batch
+
+        self.processed = 0
+        self.batches = 0
+        self.total_time = 0.0
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                items = self.in_queue.get_batch(self.max_batch, timeout=0.1)
+            except QueueClosed:
+                break
+            if not items:
+                continue
+
+            start = time.perf_counter()
+            try:
+                if self.max_batch > 1:
+                    results = self.func(items)
+                else:
+                    results = [self.func(items[0])]
+            except Exception as e:
+                print(f"⚠️ Pipeline stage '{self.stage_name}' failed: {e}")
+                continue
+            self.total_time += time.perf_counter() - start
+            self.processed += len(items)
+            self.batches += 1
+
+            if self.out_queue is None:
+                continue
+            try:
+                for result in results:
+                    if result is not None:
+                        self.out_queue.put(result)
+            except QueueClosed:
+                break
+
+    @property
+    def avg_ms(self):
+        return 1000.0 * self.total_time / self.processed if self.processed else 0.0
+
+    @property
+    def avg_batch(self):
+        return self.processed / self.batches if self.batches else 0.0
+
+
+class FrameSource:
+    """1 nguồn video (camera index, file, RTSP) với thống kê FPS/độ trễ riêng"""
+
+    def __init__(self, source_id, source):
+        self.source_id = source_id
+        self.source = source
+        self.capture = None
+        self.thread = None
+        self.frame_count = 0
+        self.motion_gate = MotionGate() if config.MOTION_GATE_ENABLED else None
+
+        # Thống kê
+        self.fps = 0.0
+        self.latency_ms = 0.0
+        self.detect_latency_ms = 0.0
+        self._fps_window_start = time.time()
+        self._fps_window_frames = 0
+        self.skipped_detections = 0  # Lượt detect bị bỏ vì khung hình tĩnh
+        self.wake_time = None  # Thời điểm cổng mở gần nhất, chờ detect được mặt
+        self.time_to_first_detection_ms = None
+        self.avg_time_to_first_detection_ms = 0.0
+        self._detections_after_wake = 0
+
+    def open(self):
+        self.capture = cv2.VideoCapture(self.source)
+        self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, config.CAMERA_WIDTH)
+        self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, config.CAMERA_HEIGHT)
+        if not self.capture.isOpened():
+            self.capture.release()
+            self.capture = None
+            return False
+        return True
+
+    def release(self):
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+
+    def record_frame(self):
+        """Cập nhật FPS capture (cửa sổ 1 giây)"""
+        self._fps_window_frames += 1
+        now = time.time()
+        elapsed = now - self._fps_window_start
+        if elapsed >= 1.0:
+            self.fps = self._fps_window_frames / elapsed
+            self._fps_window_start = now
+            self._fps_window_frames = 0
+
+    def record_latency(self, packet, alpha=0.1):
+        """Độ trễ end-to-end (capture -> subscriber), trung bình trượt"""
+        latency = 1000.0 * (time.time() - packet.timestamp)
+        self.latency_ms += alpha * (latency - self.latency_ms)
+        if packet.detected:
+            self.detect_latency_ms += alpha * (latency - self.detect_latency_ms)
+
+    def record_detection(self, num_faces):
+        """Thời gian từ lúc cổng chuyển động mở tới khi detect được mặt đầu tiên"""
+        wake_time = self.wake_time
+        if wake_time is None or num_faces == 0:
+            return
+        self.wake_time = None
+        self.time_to_first_detection_ms = 1000.0 * (time.time() - wake_time)
+        self._detections_after_wake += 1
+        self.avg_time_to_first_detection_ms += (
+            (self.time_to_first_detection_ms - self.avg_time_to_first_detection_ms) / self._detections_after_wake
+        )
+
+
+class AttendancePipeline:
+    """
+    Pipeline chấm công: capture -> detect -> liveness -> recognize -> log
+
+    1 pipeline phục vụ N nguồn video với 1 bộ model dùng chung. Kết quả từng
+    frame (kèm source_id) được phát tới các subscriber (giao diện Tk, console, ...)
+    """
+
+    def __init__(self, face_recognizer, anti_spoofing, attendance_handler,
+                 sources=None, liveness_enabled=None, process_every_n_frames=None,
+                 queue_size=None, drop_policy=None, max_batch=None,
+                 execution_mode=None, num_workers=None, spoof_handler=None, liveness_mode=None):
+        """
+        Args:
+            face_recognizer: FaceRecognizer dùng chung cho mọi camera
+            anti_spoofing: AntiSpoofing dùng chung cho mọi camera
+            attendance_handler: Hàm (employee_id, name, confidence, distance) -> record/None
+            sources: List camera index / đường dẫn video / RTSP URL
+            liveness_enabled: Bật kiểm tra liveness
+            process_every_n_frames: Chỉ detect mỗi N frame (của mỗi camera)
+            max_batch: Số frame tối đa gom thành 1 batch ở stage detect/recognize
+            execution_mode: "thread" hoặc "process" (detect/embedding trong worker process)
+            num_workers: Số worker process ở chế độ process
+            spoof_handler: Hàm (liveness_score, is_real, method, notes) ghi lượt giả mạo
+            liveness_mode: "inline" hoặc "async" (ghi chấm công khi có kết luận liveness)
+        """
+        self.face_recognizer = face_recognizer
+        self.anti_spoofing = anti_spoofing
+        self.attendance_handler = attendance_handler
+        self.spoof_handler = spoof_handler
+        if sources is None:
+            sources = config.CAMERA_SOURCES
+        self.sources = [FrameSource(i, src) for i, src in enumerate(sources)]
+        self.liveness_enabled = (config.ENABLE_ANTI_SPOOFING if liveness_enabled is None
+                                 else liveness_enabled)
+        self.process_every_n_frames = process_every_n_frames or config.PROCESS_EVERY_N_FRAMES
+        self.queue_size = queue_size or config.PIPELINE_QUEUE_SIZE
+        self.drop_policy = drop_policy or config.PIPELINE_DROP_POLICY
+        self.max_batch = max_batch or config.PIPELINE_MAX_BATCH
+        self.execution_mode = execution_mode or config.PIPELINE_EXECUTION_MODE
+        if self.execution_mode not in ('thread', 'process'):
+            raise ValueError(f"Unknown execution mode: {self.execution_mode}")
+        self.num_workers = num_workers
+        self.pool = None
+
+        # Gộp liveness theo thời gian cho từng track (chế độ thread)
+        self.liveness_aggregator = None
+        if anti_spoofing is not None and config.LIVENESS_TEMPORAL:
+            self.liveness_aggregator = TemporalLivenessAggregator(anti_spoofing)
+
+        self.liveness_mode = liveness_mode or config.LIVENESS_MODE
+        if self.liveness_mode not in ('inline', 'async'):
+            raise ValueError(f"Unknown liveness mode: {self.liveness_mode}")
+        self.liveness_verifier = None
+        # Lượt chấm công chờ kết luận liveness: được xử lý ngay khi job xong (callback
+        # trong worker liveness), kể cả khi camera không còn frame nào đi qua stage log
+        self._deferred = []
+        self._deferred_lock = threading.Lock()
+        self._late_records = []  # Lượt đã ghi, phát cho subscriber cùng packet kế tiếp
+        self.liveness_stats = {'committed': 0, 'spoofs': 0, 'expired': 0, 'failed': 0, 'inconclusive': 0}
+
+        # Tắt khi đang đăng ký nhân viên (chỉ detect, không nhận diện/chấm công)
+        self.recognition_enabled = True
+
+        # Mỗi camera có tracker riêng
+        self.trackers = {source.source_id: FaceTracker() for source in self.sources}
+
+        self.stages = []
+        self.queues = []
+        self._subscribers = []
+        self._stop_event = threading.Event()
+
+        # CPU của cả process giữa 2 lần gọi resource_stats()
+        self._cpu_window = (time.process_time(), time.monotonic(), 0, 0)
+        self.idle_cpu_percent = None
+
+    # ------------------------------------------------------------------
+    # Vòng đời
+    # ------------------------------------------------------------------
+    @property
+    def is_running(self):
+        return any(source.thread is not None and source.thread.is_alive() for source in self.sources)
+
+    def subscribe(self, callback):
+        """Đăng ký nhận FramePacket sau khi đi hết pipeline"""
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def start(self):
+        """Mở các nguồn video và khởi động các stage, trả về False nếu không mở được nguồn nào"""
+        if self.is_running:
+            return True
+
+        opened = []
+        for source in self.sources:
+            if source.open():
+                opened.append(source)
+            else:
+                print(f"⚠️ Không thể mở nguồn video: {source.source}")
+        if not opened:
+            return False
+
+        self._stop_event.clear()
+        for tracker in self.trackers.values():
+            tracker.reset()
+        for source in self.sources:
+            if source.motion_gate is not None:
+                source.motion_gate.reset()
+
+        if self.liveness_enabled and self.liveness_mode == 'async' and self.liveness_verifier is None:
+            self.liveness_verifier = AsyncLivenessVerifier(self.anti_spoofing, self.liveness_aggregator)
+
+        if self.execution_mode == 'process':
+            self._start_pool()
+            # Packet đã gửi cho worker phải được collect (giữ slot shared memory)
+            # nên hàng đợi submit -> collect chặn thay vì bỏ frame
+            steps = [
+                ('submit', self._submit, 1),
+                ('collect', self._collect, 1),
+                ('liveness', self._liveness, 1),
+                ('recognize', self._recognize_batch, self.max_batch),
+                ('log', self._log, 1),
+            ]
+            policies = [self.drop_policy, 'block', self.drop_policy, self.drop_policy, self.drop_policy]
+        else:
+            # Detect và recognize gom frame của nhiều camera thành batch
+            steps = [
+                ('detect', self._detect_batch, self.max_batch),
+                ('liveness', self._liveness, 1),
+                ('recognize', self._recognize_batch, self.max_batch),
+                ('log', self._log, 1),
+            ]
+            policies = [self.drop_policy] * len(steps)
+
+        # Hàng đợi capture -> detect đủ chỗ cho 1 lượt frame của mọi camera
+        first_queue_size = max(self.queue_size, len(opened))
+        self.queues = [BoundedQueue(first_queue_size if i == 0 else self.queue_size, policies[i])
+                       for i in range(len(steps))]
+        self.stages = []
+        for i, (name, func, max_batch) in enumerate(steps):
+            out_queue = self.queues[i + 1] if i + 1 < len(steps) else None
+            self.stages.append(Stage(name, func, self.queues[i], out_queue, self._stop_event, max_batch))
+
+        for stage in self.stages:
+            stage.start()
+
+        for source in opened:
+            source.frame_count = 0
+            source.thread = threading.Thread(target=self._capture_loop, args=(source,),
+                                             name=f"pipeline-capture-{source.source_id}", daemon=True)
+            source.thread.start()
+        print(f"✅ Pipeline started ({len(opened)} source(s): {[s.source for s in opened]})")
+        return True
+
+    def stop(self):
+        """Dừng toàn bộ stage và giải phóng camera"""
+        self._stop_event.set()
+        for q in self.queues:
+            q.close()
+
+        for source in self.sources:
+            if source.thread is not None:
+                source.thread.join(timeout=2)
+                source.thread = None
+        for stage in self.stages:
+            stage.join(timeout=2)
+        self.stages = []
+
+        for source in self.sources:
+            source.release()
+
+        if self.pool is not None:
+            self.pool.discard_pending()
+
+    def close(self):
+        """Dừng pipeline và tắt pool worker process/liveness (nếu có)"""
+        self.stop()
+        if self.liveness_verifier is not None:
+            # Chờ các job đang chạy (callback ghi nốt những lượt có kết luận kịp hạn)
+            self.liveness_verifier.shutdown(wait=True)
+            self._deferred = []
+            self._late_records = []
+            self.liveness_verifier = None
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def _start_pool(self):
+        """Khởi động pool worker 1 lần, giữ lại giữa các lần start/stop (nạp model chậm)"""
+        if self.pool is not None:
+            return
+        self.pool = InferencePool(
+            num_workers=self.num_workers,
+            frame_shape=(config.CAMERA_HEIGHT, config.CAMERA_WIDTH, 3)
+        )
+        self.pool.start()
+
+    def stats(self):
+        """Thống kê thời gian xử lý, batch trung bình và số frame bị bỏ của từng stage"""
+        return {
+            stage.stage_name: {
+                'processed': stage.processed,
+                'avg_ms': stage.avg_ms,
+                'avg_batch': stage.avg_batch,
+                'dropped': stage.in_queue.dropped,
+                'queue_depth': len(stage.in_queue)
+            }
+            for stage in self.stages
+        }
+
+    def camera_stats(self):
+        """Thống kê FPS capture và độ trễ end-to-end của từng camera"""
+        return {
+            source.source_id: {
+                'source': source.source,
+                'frames': source.frame_count,
+                'fps': source.fps,
+                'latency_ms': source.latency_ms,
+                'detect_latency_ms': source.detect_latency_ms,
+                'idle_ratio': source.motion_gate.idle_ratio if source.motion_gate is not None else 0.0,
+                'wakeups': source.motion_gate.wakeups if source.motion_gate is not None else 0,
+                'skipped_detections': source.skipped_detections,
+                'time_to_first_detection_ms': source.time_to_first_detection_ms,
+                'avg_time_to_first_detection_ms': source.avg_time_to_first_detection_ms
+            }
+            for source in self.sources
+        }
+
+    def resource_stats(self):
+        """
+        CPU của process từ lần gọi trước (% của 1 core); cửa sổ mà mọi camera
+        đều tĩnh (cổng đóng suốt cửa sổ) được gộp vào idle_cpu_percent
+        """
+        cpu_start, wall_start, frames_start, idle_start = self._cpu_window
+        cpu_now, wall_now = time.process_time(), time.monotonic()
+        gates = [source.motion_gate for source in self.sources if source.motion_gate is not None]
+        frames = sum(gate.frames for gate in gates)
+        idle = sum(gate.idle_frames for gate in gates)
+        self._cpu_window = (cpu_now, wall_now, frames, idle)
+
+        cpu_percent = 100.0 * (cpu_now - cpu_start) / max(wall_now - wall_start, 1e-6)
+        if frames > frames_start and idle - idle_start == frames - frames_start:
+            self.idle_cpu_percent = (cpu_percent if self.idle_cpu_percent is None
+                                     else self.idle_cpu_percent + 0.3 * (cpu_percent - self.idle_cpu_percent))
+        return {'cpu_percent': cpu_percent, 'idle_cpu_percent': self.idle_cpu_percent}
+
+    # ------------------------------------------------------------------
+    # Các stage
+    # ------------------------------------------------------------------
+    def _capture_loop(self, source):
+        """Stage capture: đọc frame từ 1 camera/video"""
+        while not self._stop_event.is_set():
+            ret, frame = source.capture.read()
+            if not ret:
+                time.sleep(0.01)
+                continue
+
+            source.frame_count += 1
+            source.record_frame()
+            small_frame = cv2.resize(frame, (config.CAMERA_WIDTH, config.CAMERA_HEIGHT))
+            packet = FramePacket(source.source_id, source.frame_count, small_frame, time.time())
+            if source.motion_gate is not None:
+                packet.motion, packet.woke = source.motion_gate.update(small_frame)
+                if packet.woke:
+                    source.wake_time = packet.timestamp
+                elif not packet.motion:
+                    source.wake_time = None
+            try:
+                self.queues[0].put(packet)
+            except QueueClosed:
+                break
+
+    def _detect_batch(self, packets):
+        """Stage detect: MTCNN (1 batch cho frame của mọi camera) + tracker từng camera"""
+        # Chỉ xử lý nhận diện mỗi N frames, các frame khác đi thẳng tới subscriber
+        to_detect = [p for p in packets if self._should_detect(p)]
+
+        if config.FACE_ALIGNMENT:
+            detections = self.face_recognizer.detect_faces_aligned_batch([p.frame for p in to_detect])
+        else:
+            detections = []
+            for packet in to_detect:
+                faces, boxes, probs, landmarks = self.face_recognizer.detect_faces(packet.frame)
+                detections.append((faces, None, boxes, probs, landmarks))
+
+        for packet, (faces, face_tensor, boxes, probs, landmarks) in zip(to_detect, detections):
+            packet.face_tensor = face_tensor
+            self._apply_detection(packet, faces, boxes, probs, landmarks)
+        return packets
+
+    def _should_detect(self, packet):
+        """
+        Frame có cần detect không: mỗi N frame, trừ khi khung hình tĩnh và
+        camera không còn track nào (người đứng yên trước camera vẫn được theo dõi);
+        frame cổng vừa mở được detect ngay
+        """
+        scheduled = packet.frame_id % self.process_every_n_frames == 0
+        source = self.sources[packet.source_id]
+        if source.motion_gate is None or self.trackers[packet.source_id].tracks:
+            return scheduled
+        if not packet.motion:
+            if scheduled:
+                source.skipped_detections += 1
+            return False
+        return scheduled or packet.woke
+
+    def _apply_detection(self, packet, faces, boxes, probs, landmarks):
+        """Gắn kết quả detect vào packet, cập nhật tracker và chọn các mặt cần nhận diện"""
+        self.sources[packet.source_id].record_detection(0 if boxes is None else len(boxes))
+        packet.detected = True
+        packet.faces = faces
+        packet.boxes = boxes
+        packet.probs = probs
+        packet.landmarks = landmarks
+
+        # Ghép detection với track cũ của cùng camera
+        tracker = self.trackers[packet.source_id]
+        packet.tracks = tracker.update(boxes, landmarks)
+
+        if self.recognition_enabled:
+            packet.pending = [i for i, track in enumerate(packet.tracks)
+                              if tracker.needs_identification(track)]
+            for i in packet.pending:
+                tracker.mark_pending(packet.tracks[i])
+
+    def _submit(self, packet):
+        """Stage submit (chế độ process): ghi frame vào shared memory, gửi cho worker"""
+        if self._should_detect(packet):
+            try:
+                packet.inference_seq = self.pool.submit(packet.frame)
+            except queue.Empty:
+                print("⚠️ Inference pool busy, frame skipped")
+        return packet
+
+    def _collect(self, packet):
+        """Stage collect (chế độ process): nhận kết quả worker theo đúng thứ tự frame"""
+        if packet.inference_seq is None:
+            return packet
+
+        result = self.pool.result(packet.inference_seq)
+        if result is None:
+            self._apply_detection(packet, None, None, None, None)
+            return packet
+
+        packet.embeddings = result['embeddings']
+        self._apply_detection(packet, result['faces'], result['boxes'],
+                              result['probs'], result['landmarks'])
+        return packet
+
+    def _liveness(self, packet):
+        """Stage liveness: kiểm tra người thật cho các mặt cần nhận diện"""
+        for i, track in enumerate(packet.tracks):
+            # Track id chỉ duy nhất trong 1 camera
+            track_id = (packet.source_id, track.track_id)
+            if not self.liveness_enabled:
+                if i in packet.pending:
+                    packet.liveness[i] = (True, None)
+                continue
+
+            if self.liveness_verifier is not None:
+                if i in packet.pending:
+                    # Không chờ: nhận diện chạy tiếp, stage log đợi kết luận
+                    packet.liveness_jobs[i] = self.liveness_verifier.submit(
+                        packet.faces[i], packet.landmarks[i], track_id
+                    )
+                    packet.liveness[i] = (True, None)
+                else:
+                    self.liveness_verifier.observe(packet.faces[i], packet.landmarks[i], track_id)
+            elif i in packet.pending and self.liveness_aggregator is not None:
+                # Điểm EWMA của track, chỉ chạy lại phân tích khi đến hạn hoặc còn sát ngưỡng
+                is_real, liveness_score, confidence, _ = self.liveness_aggregator.update(
+                    packet.faces[i], packet.landmarks[i], track_id
+                )
+                packet.liveness[i] = (is_real, liveness_score)
+                packet.liveness_confidence[i] = confidence
+            elif i in packet.pending:
+                is_real, liveness_score, details = self.anti_spoofing.check_liveness(
+                    packet.faces[i], packet.landmarks[i], track_id=track_id
+                )
+                packet.liveness[i] = (is_real, liveness_score)
+            elif self.liveness_aggregator is not None:
+                # Mặt đã nhận diện: điểm EWMA của track vẫn tích lũy theo lịch đánh giá
+                self.liveness_aggregator.observe(packet.faces[i], packet.landmarks[i], track_id)
+            else:
+                # Mặt đã nhận diện: chỉ cập nhật lịch sử blink/motion của track
+                self.anti_spoofing.observe(packet.faces[i], packet.landmarks[i], track_id)
+        return packet
+
+    def _recognize_batch(self, packets):
+        """Stage recognize: nhận diện mọi mặt thật của mọi camera trong 1 lần forward"""
+        entries = []
+        batch_input = []
+        for packet in packets:
+            for i in packet.pending:
+                if not packet.liveness[i][0]:
+                    continue
+                entries.append((packet, i))
+                if packet.embeddings is not None:
+                    batch_input.append(packet.embeddings[i])
+                elif packet.face_tensor is not None:
+                    # Tensor đã căn chỉnh + normalize, đưa thẳng vào FaceNet
+                    batch_input.append(packet.face_tensor[i])
+                else:
+                    batch_input.append(packet.faces[i])
+
+        if self.execution_mode == 'process':
+            # Embeddings đã tính trong worker, chỉ còn tìm trong gallery
+            results = self.face_recognizer.identify_embeddings(np.asarray(batch_input))
+        else:
+            results = self.face_recognizer.recognize_faces_batch(batch_input)
+        recognition_results = {(id(packet), i): result for (packet, i), result in zip(entries, results)}
+
+        for packet in packets:
+            tracker = self.trackers[packet.source_id]
+            for i in packet.pending:
+                is_real, liveness_score = packet.liveness[i]
+                if is_real is None:
+                    # Track chưa đủ số lần đánh giá liveness: nhận diện lại ở frame sau
+                    tracker.mark_inconclusive(packet.tracks[i])
+                    continue
+                employee_id, name, distance = recognition_results.get((id(packet), i),
+                                                                      (None, "Unknown", 1.0))
+                tracker.mark_identified(packet.tracks[i], employee_id, name, distance,
+                                        is_real, liveness_score, packet.liveness_confidence.get(i))
+        return packets
+
+    def _log(self, packet):
+        """Stage log: ghi chấm công cho các track vừa nhận diện, phát kết quả"""
+        for i in packet.pending:
+            track = packet.tracks[i]
+            if i in packet.liveness_jobs:
+                # Chờ kết luận liveness (cả mặt chưa nhận ra: lượt giả mạo vẫn được ghi)
+                job = packet.liveness_jobs[i]
+                entry = (job, packet.source_id, track, track.employee_id, track.name,
+                         packet.probs[i], track.distance, packet.timestamp)
+                with self._deferred_lock:
+                    self._deferred.append(entry)
+                job.future.add_done_callback(lambda _, entry=entry: self._resolve_deferred(entry))
+            elif packet.liveness[i][0] is None:
+                continue  # Liveness chưa kết luận, track giữ kết quả cũ
+            elif track.employee_id and track.is_real:
+                record = self.attendance_handler(track.employee_id, track.name,
+                                                 packet.probs[i], track.distance)
+                if record:
+                    record['source_id'] = packet.source_id
+                    record['liveness_score'] = track.liveness_score
+                    record['liveness_confidence'] = track.liveness_confidence
+                    packet.logged.append(record)
+        if self._deferred or self._late_records:
+            self._expire_deferred(packet)
+
+        self.sources[packet.source_id].record_latency(packet)
+
+        for callback in list(self._subscribers):
+            try:
+                callback(packet)
+            except Exception as e:
+                print(f"⚠️ Pipeline subscriber failed: {e}")
+        return None
+
+    def _expire_deferred(self, packet):
+        """Bỏ sớm các lượt đã quá hạn mà chưa có kết luận, phát các lượt đã ghi từ callback"""
+        with self._deferred_lock:
+            expired = [entry for entry in self._deferred if not entry[0].abandoned and entry[0].expired]
+            for entry in expired:
+                # Bỏ lượt chấm công, kiểm tra lại track; vẫn chờ để ghi lượt giả mạo nếu có
+                entry[0].abandoned = True
+                self.liveness_stats['expired'] += 1
+            packet.logged.extend(self._late_records)
+            self._late_records = []
+        for entry in expired:
+            self.trackers[entry[1]].invalidate(entry[2])
+
+    def _resolve_deferred(self, entry):
+        """
+        Xử lý 1 lượt chờ kết luận liveness async khi job xong (trong worker liveness):
+        - "thật" về kịp hạn: ghi chấm công (thời điểm gốc của frame)
+        - "giả": ghi spoofing_logs, đánh dấu track giả
+        - chưa đủ bằng chứng, quá hạn hoặc lỗi: bỏ lượt chấm công, cho track kiểm tra lại
+        """
+        with self._deferred_lock:
+            if entry not in self._deferred:
+                return
+            self._deferred.remove(entry)
+
+        job, source_id, track, employee_id, name, prob, distance, timestamp = entry
+        tracker = self.trackers[source_id]
+        is_real, score, confidence, details = job.result()
+        if is_real is None:
+            outcome = 'failed' if 'error' in details else 'inconclusive'
+            tracker.invalidate(track)
+        elif not is_real:
+            outcome = 'spoofs'
+            tracker.mark_identified(track, None, "Unknown", 1.0, False, score, confidence)
+            if self.spoof_handler is not None:
+                method = "+".join(details) or "liveness"
+                notes = (f"CAM {source_id}, track {track.track_id}, "
+                         f"matched {employee_id or 'Unknown'} (distance {distance:.3f})")
+                self.spoof_handler(score, 0, method, notes)
+        elif not job.on_time:
+            if job.abandoned:
+                return  # Đã tính là quá hạn
+            outcome = 'expired'
+            tracker.invalidate(track)
+        else:
+            track.liveness_score = score
+            track.liveness_confidence = confidence
+            record = None
+            if employee_id:
+                record = self.attendance_handler(employee_id, name, prob, distance,
+                                                 timestamp=datetime.fromtimestamp(timestamp))
+            if not record:
+                return
+            outcome = 'committed'
+            record['source_id'] = source_id
+            record['liveness_score'] = score
+            record['liveness_confidence'] = confidence
+            with self._deferred_lock:
+                self._late_records.append(record)
+
+        with self._deferred_lock:
+            self.liveness_stats[outcome] += 1
+
+
+def main():
+    """Chạy pipeline không cần giao diện (gate controller, server)"""
+    from database import DatabaseManager
+    from face_recognition import FaceRecognizer
+    from anti_spoofing import AntiSpoofing
+    from attendance import AttendanceLogger
+    from write_behind import WriteBehindWriter
+
+    parser = argparse.ArgumentParser(description="Headless attendance pipeline")
+    parser.add_argument('--source', nargs='+', default=[str(s) for s in config.CAMERA_SOURCES],
+                        help="1 hoặc nhiều camera index / đường dẫn video / RTSP URL")
+    parser.add_argument('--no-liveness', action='store_true', help="Tắt anti-spoofing")
+    parser.add_argument('--stats-every', type=float, default=10.0,
+                        help="In thống kê mỗi N giây (0 = tắt)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Chạy detect/embedding trong N worker process (0 = tự động)")
+    args = parser.parse_args()
+
+    sources = [int(s) if s.isdigit() else s for s in args.source]
+
+    print("=" * 60)
+    print("🚀 AI ATTENDANCE SYSTEM - HEADLESS PIPELINE")
+    print("=" * 60)
+
+    db = DatabaseManager()
+    face_recognizer = FaceRecognizer()
+    embeddings = db.load_face_embeddings()
+    if embeddings:
+        face_recognizer.load_embeddings(embeddings)
+
+    log_writer = WriteBehindWriter(db) if config.WRITE_BEHIND_ENABLED else None
+    logger = AttendanceLogger(db, writer=log_writer)
+    pipeline = AttendancePipeline(
+        face_recognizer, AntiSpoofing(), logger.log,
+        sources=sources, liveness_enabled=False if args.no_liveness else None,
+        spoof_handler=(log_writer or db).log_spoofing_attempt,
+        execution_mode='process' if args.workers is not None else None,
+        num_workers=args.workers or None
+    )
+
+    def print_result(packet):
+        for record in packet.logged:
+            late = " ⚠️ ĐI MUỘN" if record['is_late'] else ""
+            print(f"✅ [{record['datetime'].strftime(config.DATETIME_FORMAT)}] "
+                  f"CAM {record['source_id']}: {record['name']} ({record['employee_id']}){late}")
+
+    pipeline.subscribe(print_result)
+
+    if not pipeline.start():
+        print(f"❌ Không thể mở nguồn video: {args.source}")
+        return
+
+    try:
+        while pipeline.is_running:
+            time.sleep(args.stats_every or 1.0)
+            if args.stats_every:
+                for name, s in pipeline.stats().items():
+                    print(f"📊 {name:<10} processed={s['processed']:<6} avg={s['avg_ms']:.1f}ms "
+                          f"batch={s['avg_batch']:.1f} dropped={s['dropped']} depth={s['queue_depth']}")
+                for source_id, s in pipeline.camera_stats().items():
+                    print(f"📹 CAM {source_id} ({s['source']}): fps={s['fps']:.1f} "
+                          f"latency={s['latency_ms']:.0f}ms detect_latency={s['detect_latency_ms']:.0f}ms")
+                    print(f"💤 CAM {source_id}: idle={s['idle_ratio']:.0%} wakeups={s['wakeups']} "
+                          f"skipped_detect={s['skipped_detections']} "
+                          f"first_detection={s['avg_time_to_first_detection_ms']:.0f}ms")
+                resources = pipeline.resource_stats()
+                idle_cpu = resources['idle_cpu_percent']
+                print(f"🖥️ CPU {resources['cpu_percent']:.0f}% "
+                      f"(idle {'n/a' if idle_cpu is None else f'{idle_cpu:.0f}%'})")
+                if pipeline.liveness_verifier is not None:
+                    s = pipeline.liveness_stats
+                    print(f"🛡️ liveness   in_flight={pipeline.liveness_verifier.in_flight} "
+                          f"latency={pipeline.liveness_verifier.latency_ms:.0f}ms waiting={len(pipeline._deferred)} "
+                          f"committed={s['committed']} spoofs={s['spoofs']} expired={s['expired']} "
+                          f"inconclusive={s['inconclusive']}")
+                if log_writer is not None:
+                    s = log_writer.stats()
+                    print(f"💾 db writes  depth={s['queue_depth']} pending={s['pending']} "
+                          f"flushed={s['flushed']} batch={s['avg_batch']:.1f} "
+                          f"flush={s['flush_ms']:.1f}ms max={s['max_flush_ms']:.1f}ms blocked={s['blocked']}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pipeline.close()
+        if log_writer is not None:
+            log_writer.close()
+        db.close()
+        print("✅ Pipeline stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -23,8 +23,9 @@ from database import DatabaseManager
 class ReportExporter:
     """Class xuất báo cáo chấm công"""
     
-    def __init__(self):
-        self.db = DatabaseManager()
+    def __init__(self, db=None):
+        # Dùng chung DatabaseManager (và kết nối) của ứng dụng nếu được truyền vào
+        self.db = db or DatabaseManager()
         
         # Register font hỗ trợ tiếng Việt cho PDF (nếu có)
         try:
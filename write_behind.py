@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+Ghi chấm công / giả mạo bất đồng bộ theo lô (write-behind + group commit)
+Write-Behind Log Writer Module
+
+Thread gọi (camera, stage log của pipeline, worker liveness) chỉ đưa sự kiện
+vào hàng đợi có giới hạn và append 1 dòng vào journal; 1 thread riêng gom sự
+kiện và ghi vào SQLite trong 1 transaction khi đủ WRITE_BEHIND_BATCH_SIZE sự
+kiện hoặc sau WRITE_BEHIND_FLUSH_INTERVAL giây. Đĩa chậm chỉ làm lô lớn hơn,
+không làm đứng vòng lặp video.
+
+Mỗi sự kiện có số thứ tự (seq) tăng dần; seq cuối của lô được commit cùng
+transaction (bảng write_behind_state). Journal gồm các segment
+(<journal_path>.<seq đầu>): sau mỗi lần ghi thành công segment hiện tại được
+đóng lại, các segment chỉ chứa sự kiện đã commit bị xóa, nên journal không
+phình ra dưới tải liên tục. Khi khởi động, các sự kiện trong journal có seq
+lớn hơn giá trị đã commit được ghi lại, nên crash giữa chừng không làm mất
+hay ghi trùng lượt chấm công.
+"""
+
+import glob
+import json
+import os
+import queue
+import threading
+import time
+
+import config
+from database import attendance_row, spoofing_row
+
+
+class _JournalSegment:
+    """1 file journal, append bằng O_APPEND (mỗi dòng 1 lần write, không xen lẫn giữa các thread)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.max_seq = 0
+        self.writers = 0  # Số thread đang ghi vào segment
+
+    def close(self, remove=False):
+        os.close(self.fd)
+        if remove:
+            os.remove(self.path)
+
+
+class WriteBehindWriter:
+    """Hàng đợi ghi log dùng thay cho DatabaseManager.log_attendance / log_spoofing_attempt"""
+
+    def __init__(self, db, queue_size=None, batch_size=None, flush_interval=None,
+                 journal_path=None, journal_fsync=None):
+        """
+        Args:
+            db: DatabaseManager
+            queue_size: Số sự kiện tối đa trong hàng đợi
+            batch_size: Ghi ngay khi gom đủ N sự kiện
+            flush_interval: Hoặc sau N giây kể từ sự kiện đầu tiên của lô
+            journal_path: Tiền tố các file journal sự kiện chưa commit
+            journal_fsync: fsync journal sau mỗi sự kiện
+        """
+        self.db = db
+        self.batch_size = max(1, batch_size or config.WRITE_BEHIND_BATCH_SIZE)
+        self.flush_interval = flush_interval if flush_interval is not None else config.WRITE_BEHIND_FLUSH_INTERVAL
+        self.journal_path = journal_path or config.WRITE_BEHIND_JOURNAL_PATH
+        self.journal_fsync = config.WRITE_BEHIND_JOURNAL_FSYNC if journal_fsync is None else journal_fsync
+
+        self._queue = queue.Queue(maxsize=queue_size or config.WRITE_BEHIND_QUEUE_SIZE)
+        # Giữ khi cấp seq + đưa vào hàng đợi (thứ tự trong hàng đợi đúng thứ tự seq);
+        # ghi journal / fsync nằm ngoài lock
+        self._cond = threading.Condition()
+        self._pending = 0  # Đã nhận nhưng chưa commit
+        self._seq = 0
+        self._committed_seq = 0
+        self._closed = False
+        self._stop_event = threading.Event()
+
+        # Thống kê
+        self.enqueued = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.blocked = 0  # Số lần thread gọi phải chờ vì hàng đợi đầy
+        self.flush_ms = 0.0  # Độ trễ ghi 1 lô (EWMA)
+        self.max_flush_ms = 0.0
+
+        self.recovered = self._recover()
+        self._segment = _JournalSegment(self._segment_path(self._seq + 1))
+        self._closed_segments = []
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def log_attendance(self, employee_id, attendance_type, status, confidence=0.0, is_late=0, notes="",
+                       timestamp=None):
+        """Như DatabaseManager.log_attendance nhưng không chờ ghi xuống đĩa"""
+        self._enqueue('attendance', attendance_row(
+            employee_id, attendance_type, status, confidence, is_late, notes, timestamp
+        ))
+
+    def log_spoofing_attempt(self, liveness_score, is_real, method, notes=""):
+        """Như DatabaseManager.log_spoofing_attempt nhưng không chờ ghi xuống đĩa"""
+        self._enqueue('spoofing', spoofing_row(liveness_score, is_real, method, notes))
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue_depth,
+            'pending': self._pending,
+            'enqueued': self.enqueued,
+            'flushed': self.flushed,
+            'flushes': self.flushes,
+            'avg_batch': self.flushed / self.flushes if self.flushes else 0.0,
+            'flush_ms': self.flush_ms,
+            'max_flush_ms': self.max_flush_ms,
+            'blocked': self.blocked,
+            'errors': self.flush_errors,
+            'recovered': self.recovered,
+        }
+
+    def flush(self, timeout=None):
+        """Chờ mọi sự kiện đã nhận được commit (trước khi đọc báo cáo, ...)"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending == 0, timeout)
+
+    def close(self, timeout=None):
+        """Ghi nốt hàng đợi rồi dừng thread ghi (gọi trước DatabaseManager.close)"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._stop_event.set()
+        self._thread.join(timeout)
+        with self._cond:
+            segments = self._closed_segments + [self._segment]
+            self._closed_segments = []
+            pending = self._pending
+        for segment in segments:
+            segment.close(remove=pending == 0)
+        if pending:
+            print(f"⚠️ {pending} log events left in journal, will be replayed on next start")
+
+    def _enqueue(self, table, row):
+        with self._cond:
+            if self._queue.full():
+                self.blocked += 1
+            while self._queue.full() and not self._closed:
+                self._cond.wait(0.1)
+            closed = self._closed
+            if not closed:
+                self._seq += 1
+                seq = self._seq
+                segment = self._segment
+                segment.max_seq = seq
+                segment.writers += 1
+                self._queue.put_nowait((seq, table, row))
+                self._pending += 1
+                self.enqueued += 1
+
+        if closed:
+            # Ứng dụng đang tắt: ghi trực tiếp
+            try:
+                self._write([(None, table, row)])
+            except Exception as e:
+                self.flush_errors += 1
+                print(f"⚠️ Failed to write log event: {e}")
+            return
+
+        # Nếu thread ghi commit sự kiện trước dòng journal này, khi khôi phục dòng
+        # đó có seq <= seq đã commit nên bị bỏ qua
+        try:
+            os.write(segment.fd, (json.dumps({'seq': seq, 'table': table, 'row': row}) + "\n").encode('utf-8'))
+            if self.journal_fsync:
+                os.fsync(segment.fd)
+        finally:
+            with self._cond:
+                segment.writers -= 1
+                obsolete = self._collect_segments()
+            for segment in obsolete:
+                segment.close(remove=True)
+
+    def _run(self):
+        batch = []
+        first_at = None
+        while True:
+            stopping = self._stop_event.is_set()
+            timeout = self.flush_interval if first_at is None else first_at + self.flush_interval - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=max(0.0, min(timeout, 0.1) if stopping else timeout)))
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if batch and first_at is None:
+                first_at = time.monotonic()
+            with self._cond:
+                self._cond.notify_all()  # Hàng đợi vừa có chỗ trống
+
+            if batch and (stopping or len(batch) >= self.batch_size
+                          or time.monotonic() - first_at >= self.flush_interval):
+                if self._flush(batch):
+                    batch = []
+                    first_at = None
+                elif stopping:
+                    break  # Database lỗi lúc tắt: để lại journal
+                else:
+                    time.sleep(self.flush_interval)
+
+            if stopping and not batch and self._queue.empty():
+                break
+
+    def _flush(self, batch):
+        start = time.perf_counter()
+        try:
+            self._write(batch)
+        except Exception as e:
+            self.flush_errors += 1
+            print(f"⚠️ Failed to write {len(batch)} log events: {e}")
+            return False
+
+        elapsed = (time.perf_counter() - start) * 1000
+        self.flushes += 1
+        self.flushed += len(batch)
+        self.flush_ms += 0.1 * (elapsed - self.flush_ms) if self.flushes > 1 else elapsed
+        self.max_flush_ms = max(self.max_flush_ms, elapsed)
+        with self._cond:
+            self._pending -= len(batch)
+            self._committed_seq = batch[-1][0]
+            if self._segment.max_seq:
+                # Đóng segment hiện tại, sự kiện mới ghi vào segment mới
+                self._closed_segments.append(self._segment)
+                self._segment = _JournalSegment(self._segment_path(self._seq + 1))
+            obsolete = self._collect_segments()
+            self._cond.notify_all()
+        for segment in obsolete:
+            segment.close(remove=True)
+        return True
+
+    def _segment_path(self, first_seq):
+        return f"{self.journal_path}.{first_seq}"
+
+    def _collect_segments(self):
+        """Tách các segment đã đóng mà mọi sự kiện đã commit và không còn thread ghi (giữ _cond)"""
+        obsolete = [segment for segment in self._closed_segments
+                    if segment.max_seq <= self._committed_seq and segment.writers == 0]
+        if obsolete:
+            self._closed_segments = [segment for segment in self._closed_segments if segment not in obsolete]
+        return obsolete
+
+    def _write(self, events):
+        attendance_rows = [row for _, table, row in events if table == 'attendance']
+        spoofing_rows = [row for _, table, row in events if table == 'spoofing']
+        self.db.write_batch(attendance_rows, spoofing_rows, last_seq=events[-1][0])
+        for row in attendance_rows:
+            print(f"✅ Logged attendance: {row[0]} - {row[3]} - {row[4]}")
+
+    def _recover(self):
+        """Ghi lại các sự kiện trong journal chưa được commit (sau crash)"""
+        self._seq = self.db.get_write_behind_seq()
+        paths = glob.glob(glob.escape(self.journal_path) + '.*')
+        if os.path.exists(self.journal_path):
+            paths.append(self.journal_path)  # Journal 1 file của phiên bản trước
+        if not paths:
+            return 0
+
+        events = []
+        for path in paths:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue  # Dòng cuối bị cắt dở khi crash
+                    self._seq = max(self._seq, event['seq'])
+                    events.append((event['seq'], event['table'], tuple(event['row'])))
+
+        committed = self.db.get_write_behind_seq()
+        events = sorted(e for e in events if e[0] > committed)
+        if events:
+            self._write(events)
+            print(f"♻️ Recovered {len(events)} log events from journal")
+        for path in paths:
+            os.remove(path)
+        return len(events)